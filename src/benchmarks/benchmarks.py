@@ -0,0 +1,238 @@
+""" Timings of the loader, backtests and a tuner evaluation at several data scales, saved as json baselines which later
+	runs can be compared against.
+
+		python -m src.benchmarks.benchmarks run --scales 1 3 10 --save my_change
+		python -m src.benchmarks.benchmarks compare baseline my_change --threshold 0.1
+
+	A scale of n is n seasons of synthetic data, written by load.generate_synthetic_data and read back by its
+	load_generated, which is timed too, along with each stage of Loader.run_loader over every generated season.
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from src.load import generate_synthetic_data
+from src.load.load import Loader
+from src.logger import logger, validate_path
+from src.models.player_percentages.player_ratings_backtest import PlayerRatingsBacktest
+from src.models.team_ratings.league_ratings import LeagueRatings
+from src.models.team_ratings.team_ratings_backtest import TeamRatingsBacktest
+from src.paths import paths
+from src.tuners.player_tuner import PlayerTuner
+from src.tuners.team_tuner import TeamTuner
+from src.tuners.tuner_params import PARAM_LAYOUT, load_params
+from src.utils import group_indices
+
+DEFAULT_SCALES = (1, 3, 10)
+N_TEAMS = 20
+# the stages of Loader.run_loader, in the order it runs them
+LOADER_STAGES = (
+	'load_fpl_summary',
+	'add_maps',
+	'load_match_scores',
+	'add_player_id_list',
+	'load_player_data',
+	'add_player_team_id_to_player_data',
+	'add_player_positions',
+	'add_att_def_scores_to_data',
+	'merge_att_def_ratings_to_all_player_data',
+	'add_assists_to_data',
+)
+
+
+def generated_data(n_seasons, rng, **kwargs):
+	""" n_seasons of load.generate_synthetic_data, written to a temporary folder (left for the os to clear up) and
+		read back by load_generated, returning the root, the season names and the loaded data.
+	"""
+	root = tempfile.mkdtemp(prefix='fpl_benchmark_')
+	seasons = generate_synthetic_data.generate(root, n_seasons=n_seasons, seed=rng.randint(2 ** 31), **kwargs)
+	return root, seasons, generate_synthetic_data.load_generated(root, seasons)
+
+
+def loader_stage_cases(root, seasons):
+	""" (name, function) pairs timing each stage of Loader.run_loader, run by a loader for each generated season on
+		the data the stages before it leave. Each run starts from that data again, as some stages replace frames that
+		the next run of the stage would otherwise build on.
+	"""
+	loaders = [Loader(**generate_synthetic_data.loader_paths(root, season)) for season in seasons]
+	cases = []
+	for stage in LOADER_STAGES:
+		def run_stage(stage=stage, inputs=tuple(dict(loader.data) for loader in loaders)):
+			for loader, data in zip(loaders, inputs):
+				loader.data.update(data)
+				getattr(loader, stage)()
+
+		# running it once leaves the data for the next stage
+		run_stage()
+		cases.append(('Loader.' + stage, run_stage))
+	return cases
+
+
+def time_call(function, repeats, min_time=0.05):
+	""" Runs function repeats times (each being as many calls as take at least min_time, for quick functions) and
+		returns the min and median wall times per call.
+	"""
+	number = 1
+	while True:
+		start = time.perf_counter()
+		for _ in range(number):
+			function()
+		if time.perf_counter() - start >= min_time:
+			break
+		number *= 2
+
+	timings = []
+	for _ in range(repeats):
+		start = time.perf_counter()
+		for _ in range(number):
+			function()
+		timings.append((time.perf_counter() - start) / number)
+	return dict(min=min(timings), median=statistics.median(timings), repeats=repeats, number=number)
+
+
+def benchmark_cases(scale, rng):
+	""" (name, function) pairs for everything timed at the given scale.
+	"""
+	params = PARAM_LAYOUT.vector(load_params())
+	synthetic_root, seasons, data = generated_data(scale, rng)
+	matches, players = data['match_scores'], data['all_player_data']
+	groupby_dict = group_indices(matches.gw.values)
+
+	def team_backtest():
+		TeamRatingsBacktest(
+			params=params,
+			home_goals=matches.fthg.values,
+			away_goals=matches.ftag.values,
+			home_ids=matches.home_id.values,
+			away_ids=matches.away_id.values,
+			groupby_dict=groupby_dict
+		).run_backtest()
+
+	player_arrays = PlayerTuner.extract_arrays(players)
+
+	def player_backtest():
+		PlayerRatingsBacktest(params=params, **player_arrays).run_backtest()
+
+	# one league update over a gameweek's worth of matches for each season's worth of data
+	n_league = N_TEAMS // 2 * scale
+	league_args = [rng.lognormal(0, 0.1, n_league) for _ in range(4)] + [
+		rng.poisson(1.5, n_league), rng.poisson(1.1, n_league), 1]
+
+	def league_update_step():
+		LeagueRatings(params).run_update_step(*league_args)
+
+	team_tuner = TeamTuner(matches, [], [], 'Nelder-Mead', None, False, False)
+	player_tuner = PlayerTuner(players, [], [], 'Nelder-Mead', None, False, False)
+
+	cases = [
+		('TeamRatingsBacktest.run_backtest', team_backtest),
+		('PlayerRatingsBacktest.run_backtest', player_backtest),
+		('LeagueRatings.run_update_step', league_update_step),
+		('TeamTuner.minimise_me', lambda: team_tuner.minimise_me(team_tuner.tuner_params.x0)),
+		('PlayerTuner.minimise_me', lambda: player_tuner.minimise_me(player_tuner.tuner_params.x0)),
+	]
+	cases += loader_stage_cases(synthetic_root, seasons)
+	cases.append(('load_generated', lambda: generate_synthetic_data.load_generated(synthetic_root, seasons)))
+	return cases
+
+
+def run_benchmarks(scales=DEFAULT_SCALES, repeats=5, seed=0):
+	results = dict(metadata=run_metadata(), results={})
+	for scale in scales:
+		for name, function in benchmark_cases(scale, np.random.RandomState(seed)):
+			timing = time_call(function, repeats)
+			results['results'].setdefault(name, {})[str(scale)] = timing
+			logger.info('{:48} scale {:>4}: median {:10.4f}s, min {:10.4f}s'.format(
+				name, scale, timing['median'], timing['min']))
+	return results
+
+
+def compare(baseline, current, threshold=0.1):
+	""" Compares the best (min) timings of current against baseline, which are the least affected by whatever else
+		the machine is doing, returning the (name, scale, ratio) of those more than threshold slower.
+	"""
+	regressions = []
+	logger.info('{:48} {:>6} {:>12} {:>12} {:>8}'.format('benchmark', 'scale', 'baseline', 'current', 'ratio'))
+	for name, by_scale in current['results'].items():
+		for scale, timing in by_scale.items():
+			try:
+				base = baseline['results'][name][scale]
+			except KeyError:
+				continue
+			ratio = timing['min'] / base['min']
+			flag = 'REGRESSION' if ratio > 1 + threshold else 'faster' if ratio < 1 - threshold else ''
+			logger.info('{:48} {:>6} {:12.4f} {:12.4f} {:8.3f} {}'.format(
+				name, scale, base['min'], timing['min'], ratio, flag))
+			if ratio > 1 + threshold:
+				regressions.append((name, scale, ratio))
+	return regressions
+
+
+def baseline_path(name):
+	return paths['benchmarks'] + name + '.json'
+
+
+def save_results(results, name):
+	path = baseline_path(name)
+	validate_path(path)
+	with open(path, 'w') as file:
+		json.dump(results, file, indent=4)
+	logger.info('Saved benchmark results to {}'.format(path))
+
+
+def load_results(name):
+	with open(baseline_path(name), 'r') as file:
+		return json.load(file)
+
+
+def run_metadata():
+	try:
+		commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		commit = None
+	return dict(
+		commit=commit,
+		time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+		python=platform.python_version(),
+		numpy=np.__version__,
+		machine=platform.machine(),
+		processor=platform.processor(),
+	)
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	commands = parser.add_subparsers(dest='command')
+
+	run_parser = commands.add_parser('run', help='time the benchmarks')
+	run_parser.add_argument('--scales', type=int, nargs='+', default=list(DEFAULT_SCALES))
+	run_parser.add_argument('--repeats', type=int, default=5)
+	run_parser.add_argument('--save', default='baseline', help='name of the json file to save the results as')
+
+	compare_parser = commands.add_parser('compare', help='flag regressions of one set of results against another')
+	compare_parser.add_argument('baseline')
+	compare_parser.add_argument('current')
+	compare_parser.add_argument('--threshold', type=float, default=0.1, help='fractional slow down to flag')
+
+	args = parser.parse_args(argv)
+	if args.command == 'run':
+		save_results(run_benchmarks(args.scales, args.repeats), args.save)
+	elif args.command == 'compare':
+		regressions = compare(load_results(args.baseline), load_results(args.current), args.threshold)
+		if regressions:
+			logger.info('{} benchmark(s) regressed by more than {:.0%}'.format(len(regressions), args.threshold))
+			return 1
+	else:
+		parser.print_help()
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
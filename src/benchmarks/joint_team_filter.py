@@ -0,0 +1,84 @@
+""" Timings of the joint team filter against the per-team one, on synthetic seasons of several leagues of N_TEAMS
+	from load.generate_synthetic_data, with teams promoted and relegated between neighbouring leagues each summer. For
+	each of a few correlation tolerances it reports the joint filter's cost per gameweek, how much of the per-team
+	filter's log likelihood it improves on, and how much of the covariance it keeps, from which the default tolerance
+	is chosen.
+
+		python -m src.benchmarks.joint_team_filter --leagues 1 2 5 --tols 0.003 0.01 0.04 1 --save joint_team_filter
+"""
+import argparse
+import sys
+
+import numpy as np
+
+from src.benchmarks.benchmarks import N_TEAMS, generated_data, run_metadata, save_results, time_call
+from src.logger import logger
+from src.models.team_ratings.joint_team_ratings_backtest import JointTeamRatingsBacktest
+from src.models.team_ratings.team_ratings_backtest import TeamRatingsBacktest
+from src.tuners.tuner_params import PARAM_LAYOUT, load_params
+from src.utils import group_indices
+
+DEFAULT_LEAGUES = (1, 2, 5)
+# the joint filter's correlation tolerances, the last of which keeps no correlations
+DEFAULT_TOLS = (0.003, 0.01, 0.04, 1.)
+N_SEASONS = 2
+
+
+def run_benchmarks(n_leagues_list=DEFAULT_LEAGUES, tols=DEFAULT_TOLS, repeats=3, seed=0):
+	""" Times the per-team filter's backtest, and the joint filter's at each correlation tolerance, over N_SEASONS
+		seasons of each number of leagues.
+	"""
+	rng = np.random.RandomState(seed)
+	params = PARAM_LAYOUT.vector(load_params())
+	results = dict(metadata=run_metadata(), results={})
+
+	for n_leagues in n_leagues_list:
+		_, _, data = generated_data(N_SEASONS, rng, n_leagues=n_leagues, n_teams=N_TEAMS)
+		matches = data['match_scores']
+		args = (params, matches.fthg.values, matches.ftag.values, matches.home_id.values, matches.away_id.values,
+				group_indices(matches.gw.values))
+		n_gameweeks = matches.gw.nunique()
+		n_teams = str(n_leagues * N_TEAMS)
+
+		backtests = [('team_ratings', lambda: TeamRatingsBacktest(*args))] + [
+			('joint_team_ratings tol {:g}'.format(tol),
+			 lambda tol=tol: JointTeamRatingsBacktest(*args, correlation_tol=tol))
+			for tol in tols
+		]
+		per_team_log_lhood = None
+		for name, make_backtest in backtests:
+			timing = time_call(lambda: make_backtest().run_backtest(), repeats)
+			timing['per_gameweek'] = timing['min'] / n_gameweeks
+			backtest = make_backtest()
+			backtest.run_backtest()
+			timing['log_lhood'] = backtest.cum_team_log_lhood
+			if per_team_log_lhood is None:
+				per_team_log_lhood = backtest.cum_team_log_lhood
+			results['results'].setdefault(name, {})[n_teams] = timing
+			logger.info('{:28} {:>4} teams: {:10.6f}s a gameweek, log likelihood gain {:6.2f}'.format(
+				name, n_teams, timing['per_gameweek'], timing['log_lhood'] - per_team_log_lhood))
+
+			if isinstance(backtest, JointTeamRatingsBacktest):
+				timing['largest_block'] = int(backtest.team_ratings.largest_block)
+				timing['covariance_entries'] = int(backtest.team_ratings.P.nnz)
+				logger.info('{:28} {:>4} teams: largest block of {} ratings, {} covariance entries'.format(
+					'', n_teams, timing['largest_block'], timing['covariance_entries']))
+	return results
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--leagues', type=int, nargs='+', default=list(DEFAULT_LEAGUES))
+	parser.add_argument('--tols', type=float, nargs='+', default=list(DEFAULT_TOLS))
+	parser.add_argument('--repeats', type=int, default=3)
+	parser.add_argument('--save', default=None, help='name of the json file to save the results as')
+	args = parser.parse_args(argv)
+
+	results = run_benchmarks(args.leagues, args.tols, args.repeats)
+	if args.save:
+		save_results(results, args.save)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,135 @@
+""" Timings of the batched resampling kernels in utils against the loop implementations they replaced, for single
+	filters of N particles and for a batch of filters resampled in one call.
+
+		python -m src.benchmarks.resampling --sizes 1000 10000 100000 1000000 --save resampling
+
+	The systematic and stratified kernels are also checked to pick exactly the same indexes as the loops. The residual
+	ones are not, as the loop version took its residual as w - floor(N * w) rather than N * w - floor(N * w).
+"""
+import argparse
+import sys
+
+import numpy as np
+
+from src.benchmarks.benchmarks import run_metadata, save_results, time_call
+from src.logger import logger
+from src.utils import residual_resample, stratified_resample, systematic_resample
+
+DEFAULT_SIZES = (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6)
+
+
+def loop_residual_resample(weights, random_state=np.random):
+	N = len(weights)
+	indexes = np.zeros(N, 'i')
+	num_copies = (np.floor(N*weights)).astype(int)
+	k = 0
+	for i in range(N):
+		for _ in range(num_copies[i]):
+			indexes[k] = i
+			k += 1
+	residual = weights - num_copies
+	residual /= sum(residual)
+	cumulative_sum = np.cumsum(residual)
+	cumulative_sum[-1] = 1.
+	indexes[k:N] = np.searchsorted(cumulative_sum, random_state.random_sample(N-k))
+	return indexes
+
+
+def loop_stratified_resample(weights, random_state=np.random):
+	N = len(weights)
+	positions = (random_state.random_sample(N) + np.arange(N)) / N
+	return _walk_cumulative_sum(weights, positions)
+
+
+def loop_systematic_resample(weights, random_state=np.random):
+	N = len(weights)
+	positions = (random_state.random_sample() + np.arange(N)) / N
+	return _walk_cumulative_sum(weights, positions)
+
+
+def _walk_cumulative_sum(weights, positions):
+	N = len(weights)
+	indexes = np.zeros(N, 'i')
+	cumulative_sum = np.cumsum(weights)
+	i, j = 0, 0
+	while i < N:
+		if positions[i] < cumulative_sum[j]:
+			indexes[i] = j
+			i += 1
+		else:
+			j += 1
+	return indexes
+
+
+KERNELS = (
+	('residual', loop_residual_resample, residual_resample),
+	('stratified', loop_stratified_resample, stratified_resample),
+	('systematic', loop_systematic_resample, systematic_resample),
+)
+
+
+def random_weights(shape, rng):
+	""" Normalised weights as degenerate as a particle filter's when it resamples: log normal with a large spread.
+	"""
+	weights = rng.lognormal(0, 2, shape)
+	return weights / weights.sum(axis=-1, keepdims=True)
+
+
+def check_kernels(rng, N=1000, n_rows=5):
+	for name, loop, batched in KERNELS:
+		weights = random_weights((n_rows, N), rng)
+		rows = np.array([batched(w, np.random.RandomState(k)) for k, w in enumerate(weights)])
+		if name != 'residual':
+			loops = np.array([loop(w, np.random.RandomState(k)) for k, w in enumerate(weights)])
+			if not np.array_equal(rows, loops):
+				raise ValueError('The batched {} kernel disagrees with the loop implementation'.format(name))
+
+		# one call on the batch draws each row's random numbers in turn, so matches row by row calls on one stream
+		random_state = np.random.RandomState(0)
+		rows = np.array([batched(w, random_state) for w in weights])
+		if not np.array_equal(batched(weights, np.random.RandomState(0)), rows):
+			raise ValueError('The {} kernel gives different indexes on a batch than row by row'.format(name))
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, n_rows=100, repeats=5, seed=0):
+	""" Times each kernel on one filter of each size, and on n_rows filters of each size (up to 10^5 particles)
+		resampled both in one batched call and a row at a time.
+	"""
+	rng = np.random.RandomState(seed)
+	check_kernels(rng)
+	results = dict(metadata=run_metadata(), results={})
+
+	def record(name, size, function):
+		timing = time_call(function, repeats)
+		results['results'].setdefault(name, {})[str(size)] = timing
+		logger.info('{:40} N {:>8}: min {:10.6f}s'.format(name, size, timing['min']))
+
+	for size in sizes:
+		weights = random_weights(size, rng)
+		batch = random_weights((n_rows, size), rng) if size <= 10 ** 5 else None
+		for name, loop, batched in KERNELS:
+			random_state = np.random.RandomState(seed)
+			record('loop_{}_resample'.format(name), size, lambda: loop(weights, random_state))
+			record('{}_resample'.format(name), size, lambda: batched(weights, random_state))
+			if batch is not None:
+				record('{}_resample x{} rows'.format(name, n_rows), size, lambda: [batched(w, random_state) for w in batch])
+				record('{}_resample x{} batched'.format(name, n_rows), size, lambda: batched(batch, random_state))
+	return results
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+	parser.add_argument('--rows', type=int, default=100, help='number of filters in the batched timings')
+	parser.add_argument('--repeats', type=int, default=5)
+	parser.add_argument('--save', default=None, help='name of the json file to save the results as')
+	args = parser.parse_args(argv)
+
+	results = run_benchmarks(args.sizes, args.rows, args.repeats)
+	if args.save:
+		save_results(results, args.save)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,129 @@
+""" Timings of the squad optimiser's solvers on random player pools of fpl's size, after checking them against brute
+	force on pools small enough to try every squad of.
+
+		python -m src.benchmarks.squad_selection --sizes 200 400 700 --save squad_selection
+"""
+import argparse
+import itertools
+import sys
+
+import numpy as np
+
+from src.benchmarks.benchmarks import run_metadata, save_results, time_call
+from src.logger import logger
+from src.selection.squad_optimiser import SQUAD_QUOTAS, SquadOptimiser, best_lineup, milp
+
+DEFAULT_SIZES = (200, 400, 700)
+SOLVERS = ('milp', 'branch_and_bound') if milp is not None else ('branch_and_bound',)
+# a small pool's players per position (gks, def, mid, att), giving 3 * 21 * 21 * 10 squads
+SMALL_POOL = (3, 7, 7, 5)
+
+
+def random_pool(n_players, rng, n_clubs=20, positions=None):
+	""" A SquadOptimiser over a pool like fpl's: a third of the players barely play, and prices rise with projected
+		points, noisily.
+	"""
+	positions = rng.choice([1, 2, 3, 4], n_players, p=[0.1, 0.33, 0.4, 0.17]) if positions is None else positions
+	plays = rng.random_sample(n_players) > 1 / 3
+	points = np.where(plays, rng.gamma(4, 5, n_players), rng.exponential(1, n_players))
+	prices = np.clip(np.round(40 + 1.5 * points + rng.normal(0, 8, n_players)), 40, 130)
+	return SquadOptimiser(np.arange(1, n_players + 1), positions, rng.randint(1, n_clubs + 1, n_players), prices, points)
+
+
+def brute_force(optimiser):
+	""" The value of the best squad, trying every one that meets the quotas.
+	"""
+	by_position = [np.flatnonzero(optimiser.positions == position) for position in range(1, len(SQUAD_QUOTAS))]
+	best_value = -np.inf
+	for groups in itertools.product(*[
+			itertools.combinations(players, quota) for players, quota in zip(by_position, SQUAD_QUOTAS[1:])]):
+		players = np.concatenate(groups)
+		if optimiser.prices[players].sum() > optimiser.budget:
+			continue
+		if np.bincount(np.unique(optimiser.team_ids[players], return_inverse=True)[1]).max() > optimiser.max_per_club:
+			continue
+		best_value = max(best_value, best_lineup(optimiser.points[players], optimiser.positions[players],
+												 optimiser.bench_weight)[2])
+	return best_value
+
+
+def small_pool(rng):
+	""" A random pool of SMALL_POOL players, with a budget halfway between the cheapest and dearest squads', so that it
+		binds.
+	"""
+	positions = np.repeat([1, 2, 3, 4], SMALL_POOL)
+	optimiser = random_pool(len(positions), rng, n_clubs=10, positions=positions)
+	cheapest, dearest = [
+		sum(np.sort(optimiser.prices[positions == position])[order][:SQUAD_QUOTAS[position]].sum() for position in range(1, 5))
+		for order in (slice(None), slice(None, None, -1))
+	]
+	optimiser.budget = (cheapest + dearest) / 2
+	return optimiser
+
+
+def crowded_pool(rng, max_per_club=2):
+	""" A pool in which every outfield player has to be picked, filling the clubs of six keepers that dominate the
+		other two, so that the only squads have the dominated keepers, and dropping them would leave none. The budget
+		does not bind.
+	"""
+	positions = np.repeat([1, 2, 3, 4], [8, 5, 5, 3])
+	outfield_clubs = np.append(np.repeat(np.arange(1, 7), max_per_club), 7)[:13]
+	team_ids = np.concatenate([np.arange(1, 9), outfield_clubs])
+	points = np.concatenate([rng.uniform(5, 10, 6), rng.uniform(0, 4, 2), rng.gamma(4, 5, 13)])
+	prices = np.round(np.concatenate([rng.uniform(40, 45, 6), rng.uniform(50, 55, 2), rng.uniform(40, 100, 13)]))
+	return SquadOptimiser(np.arange(1, 22), positions, team_ids, prices, points, budget=prices.sum(),
+						  max_per_club=max_per_club)
+
+
+def check_solvers(rng, n_pools=3):
+	for optimiser in [small_pool(rng) for _ in range(n_pools)] + [crowded_pool(rng)]:
+		expected = brute_force(optimiser)
+		for solver in SOLVERS:
+			for prune in (False, True):
+				value = optimiser.solve(solver, prune=prune).value
+				if not np.isclose(value, expected):
+					raise ValueError('The {} solver (prune={}) found a squad worth {}, not {}'.format(
+						solver, prune, value, expected))
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, repeats=3, seed=0):
+	""" Times brute force and the solvers on a small pool, and the solvers, with and without dropping the dominated
+		players first, on a random pool of each size.
+	"""
+	rng = np.random.RandomState(seed)
+	check_solvers(rng)
+	results = dict(metadata=run_metadata(), results={})
+
+	def record(name, size, function):
+		timing = time_call(function, repeats)
+		results['results'].setdefault(name, {})[str(size)] = timing
+		logger.info('{:30} {:>5} players: min {:10.6f}s'.format(name, size, timing['min']))
+
+	small = small_pool(rng)
+	record('brute_force', sum(SMALL_POOL), lambda: brute_force(small))
+	for solver in SOLVERS:
+		record(solver, sum(SMALL_POOL), lambda: small.solve(solver))
+
+	for size in sizes:
+		optimiser = random_pool(size, rng)
+		for solver in SOLVERS:
+			record(solver, size, lambda: optimiser.solve(solver))
+			record(solver + ' unpruned', size, lambda: optimiser.solve(solver, prune=False))
+	return results
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+	parser.add_argument('--repeats', type=int, default=3)
+	parser.add_argument('--save', default=None, help='name of the json file to save the results as')
+	args = parser.parse_args(argv)
+
+	results = run_benchmarks(args.sizes, args.repeats)
+	if args.save:
+		save_results(results, args.save)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,77 @@
+""" Timings of the transfer planner over horizons of a few gameweeks, on a random pool of fpl's size whose projections
+	swing from gameweek to gameweek, after checking that its pruning never changes the plan it finds.
+
+		python -m src.benchmarks.transfer_planning --horizons 1 3 5 --save transfer_planning
+"""
+import argparse
+import sys
+
+import numpy as np
+
+from src.benchmarks.benchmarks import run_metadata, save_results, time_call
+from src.benchmarks.squad_selection import random_pool
+from src.logger import logger
+from src.selection.transfer_planner import TransferPlanner
+
+DEFAULT_HORIZONS = (1, 3, 5)
+N_PLAYERS = 400
+
+
+def random_planner(n_players, n_gameweeks, rng, **kwargs):
+	""" A TransferPlanner over a random pool, with each player's points scaled by a fixture difficulty per gameweek,
+		and the squad the SquadOptimiser picks for the first gameweek alone with what is left of its budget.
+	"""
+	optimiser = random_pool(n_players, rng)
+	points = optimiser.points[:, None] * rng.gamma(8, 1 / 8, (n_players, n_gameweeks))
+	optimiser.points = points[:, 0]
+	squad = optimiser.solve()
+	planner = TransferPlanner(optimiser.pids, optimiser.positions, optimiser.team_ids, optimiser.prices, points,
+							  np.arange(1, n_gameweeks + 1), **kwargs)
+	return planner, squad.pids, optimiser.budget - squad.cost
+
+
+def check_pruning(rng, n_pools=2, n_gameweeks=3):
+	for _ in range(n_pools):
+		planner, squad, bank = random_planner(N_PLAYERS, n_gameweeks, rng, max_moves=4)
+		expected = planner.plan(squad, bank, prune=False).value
+		value = planner.plan(squad, bank).value
+		if not np.isclose(value, expected):
+			raise ValueError('The pruned planner found a plan worth {}, not {}'.format(value, expected))
+
+
+def run_benchmarks(horizons=DEFAULT_HORIZONS, repeats=3, seed=0):
+	""" Times the planner, with and without pruning, over each horizon.
+	"""
+	rng = np.random.RandomState(seed)
+	check_pruning(rng)
+	results = dict(metadata=run_metadata(), results={})
+
+	def record(name, horizon, function):
+		timing = time_call(function, repeats)
+		results['results'].setdefault(name, {})[str(horizon)] = timing
+		logger.info('{:30} {:>2} gameweeks: min {:10.6f}s'.format(name, horizon, timing['min']))
+
+	for horizon in horizons:
+		planner, squad, bank = random_planner(N_PLAYERS, horizon, rng)
+		record('transfer_planner', horizon, lambda: planner.plan(squad, bank))
+		# without pruning the search grows with the moves to the power of the horizon
+		if horizon <= 2:
+			record('transfer_planner unpruned', horizon, lambda: planner.plan(squad, bank, prune=False))
+	return results
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--horizons', type=int, nargs='+', default=list(DEFAULT_HORIZONS))
+	parser.add_argument('--repeats', type=int, default=3)
+	parser.add_argument('--save', default=None, help='name of the json file to save the results as')
+	args = parser.parse_args(argv)
+
+	results = run_benchmarks(args.horizons, args.repeats)
+	if args.save:
+		save_results(results, args.save)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
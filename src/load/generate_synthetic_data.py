@@ -0,0 +1,378 @@
+""" Writes synthetic seasons in the same on-disk formats as the real data, so that the loader, backtests and tuners can
+	be run (and stress tested at many times today's volume) without it:
+
+		<root>/match_data/<season>/E<league>.csv       football-data style results, one file per league
+		<root>/fpl_data/<season>_Data/main_JSON.json    fpl summary with events (deadlines), teams and elements
+		<root>/fpl_data/<season>_Data/<player id>.txt   fpl player json with a history row per fixture
+
+	Only the first league (E0) has fpl data, as with the real game. The seasons are generated from the fitted params:
+	teams' attack and defence ratings and players' goal and assist rates start from, and random walk with, the spreads
+	the filters assume, so that the tuners should recover params of the same order. Each league is a LEAGUE_STEP weaker
+	than the one above, and after each season the bottom PROMOTED teams of a league swap with the top PROMOTED of the
+	one below, keeping their ids, ratings and players. load_generated reads every league's results.
+
+		python -m src.load.generate_synthetic_data <root> --seasons 3 --leagues 2 --teams 20 --players-per-team 30
+"""
+import argparse
+import datetime
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.load.load import load
+from src.logger import logger, validate_path
+from src.tuners.tuner_params import load_params
+
+# positions (1: gks, 2: def, 3: mid, 4: att) of a squad, its first players being the starting eleven
+SQUAD_POSITIONS = (1, 2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 1, 2, 2, 3, 3, 4)
+POSITION_NAMES = {1: 'gks', 2: 'def', 3: 'mid', 4: 'att'}
+ASSIST_PROBABILITY = 0.75
+# prices in tenths of a million, as in the fpl data: a position's base, plus more for starters and higher rates
+BASE_PRICES = {1: 40, 2: 40, 3: 45, 4: 45}
+# the teams relegated from (and promoted to) each league every season, and how much weaker each league is
+PROMOTED = 3
+LEAGUE_STEP = 0.85
+
+
+def season_name(start_year):
+	return '{}_{:02d}'.format(start_year, (start_year + 1) % 100)
+
+
+def team_name(team_id):
+	return 'Team {}'.format(team_id)
+
+
+def team_id(name):
+	""" The id of one of team_name's names.
+	"""
+	return int(name.rsplit(' ', 1)[1])
+
+
+def round_robin(n_teams):
+	""" Rounds of a double round robin as lists of (home, away) team ids, from 1, with byes for an odd n_teams.
+	"""
+	teams = list(range(1, n_teams + 1)) + ([None] if n_teams % 2 else [])
+	rounds = []
+	for second_half in (False, True):
+		order = list(teams)
+		for _ in range(len(teams) - 1):
+			fixtures = []
+			for i in range(len(teams) // 2):
+				home, away = order[i], order[-1 - i]
+				if home is not None and away is not None:
+					fixtures.append((away, home) if second_half else (home, away))
+			rounds.append(fixtures)
+			order = [order[0], order[-1]] + order[1:-1]
+	return rounds
+
+
+class SyntheticLeague:
+	""" The evolving attack and defence ratings of a league's teams, and the goals they produce. The teams are the
+		league's slots, from 1, in which team_ids[slot] is playing this season, and the season's table is kept as
+		points and goal_difference.
+	"""
+
+	def __init__(self, n_teams, params, rng, level=1., first_id=1):
+		self.n_teams = n_teams
+		self.rng = rng
+		self.team_ids = np.arange(first_id - 1, first_id + n_teams)
+		self.home_rate = params['league_home_init']
+		self.away_rate = params['league_away_init']
+		# the home variances are used as they are by the filters while the away ones are squared
+		self.initial_spread = np.array([
+			np.sqrt(abs(params['team_initial_home_att_rating_var'])),
+			np.sqrt(abs(params['team_initial_home_def_rating_var'])),
+			abs(params['team_initial_away_att_rating_var']),
+			abs(params['team_initial_away_def_rating_var']),
+		])
+		self.drift = abs(params['team_rating_variance'])
+		# columns: home att, home def, away att, away def
+		self.ratings = np.maximum(0.2, 1 + rng.normal(size=(n_teams + 1, 4)) * self.initial_spread)
+		self.ratings *= np.array([level, 1 / level, level, 1 / level])
+		self.points = np.zeros(n_teams + 1, dtype=int)
+		self.goal_difference = np.zeros(n_teams + 1, dtype=int)
+
+	def step(self):
+		self.ratings = np.maximum(0.2, self.ratings + self.rng.normal(size=self.ratings.shape) * self.drift)
+
+	def play(self, home, away):
+		h_att, h_def = self.ratings[home, :2]
+		a_att, a_def = self.ratings[away, 2:]
+		home_goals = self.rng.poisson(h_att * self.home_rate * a_def)
+		away_goals = self.rng.poisson(h_def * self.away_rate * a_att)
+		self.goal_difference[[home, away]] += home_goals - away_goals, away_goals - home_goals
+		self.points[[home, away]] += 3 * (home_goals > away_goals) + (home_goals == away_goals), \
+			3 * (away_goals > home_goals) + (home_goals == away_goals)
+		return home_goals, away_goals
+
+	def table(self):
+		""" The slots from top to bottom of the table, by points and then goal difference.
+		"""
+		slots = np.arange(1, self.n_teams + 1)
+		return slots[np.lexsort((-self.goal_difference[1:], -self.points[1:]))]
+
+	def new_season(self):
+		self.points[:] = 0
+		self.goal_difference[:] = 0
+
+
+def promote(leagues, n_promoted=PROMOTED):
+	""" Swaps the bottom n_promoted teams of each league, with their ratings, for the top n_promoted of the one below.
+	"""
+	tables = [league.table() for league in leagues]
+	for upper, lower, upper_table, lower_table in zip(leagues, leagues[1:], tables, tables[1:]):
+		relegated, promoted = upper_table[len(upper_table) - n_promoted:], lower_table[:n_promoted]
+		upper.team_ids[relegated], lower.team_ids[promoted] = lower.team_ids[promoted], upper.team_ids[relegated]
+		upper.ratings[relegated], lower.ratings[promoted] = lower.ratings[promoted], upper.ratings[relegated]
+	for league in leagues:
+		league.new_season()
+
+
+class SyntheticSquads:
+	""" Players of every team, with goal and assist rates random walking from their position's x0 with the filters' P0
+		and Q. Only those of the first league's teams play in the fpl data.
+	"""
+
+	def __init__(self, n_teams, players_per_team, params, rng):
+		self.rng = rng
+		positions = [SQUAD_POSITIONS[j % len(SQUAD_POSITIONS)] for j in range(players_per_team)]
+		self.team = np.repeat(np.arange(1, n_teams + 1), players_per_team)
+		self.position = np.tile(positions, n_teams)
+		self.player_id = np.arange(1, len(self.team) + 1)
+		self.starter = np.tile(np.arange(players_per_team) < 11, n_teams)
+
+		self.rates, self.drift = {}, {}
+		for model in ('goal', 'assist'):
+			x0 = np.array([params['player_{}_x0_{}'.format(model, POSITION_NAMES[p])] for p in self.position])
+			spread = abs(params['player_{}_P0'.format(model)])
+			self.rates[model] = np.maximum(1e-3, x0 + rng.normal(size=len(x0)) * spread)
+			self.drift[model] = abs(params['player_{}_Q'.format(model)])
+
+	def step(self):
+		for model, rates in self.rates.items():
+			self.rates[model] = np.maximum(1e-3, rates + self.rng.normal(size=len(rates)) * self.drift[model])
+
+	def prices(self):
+		base = np.array([BASE_PRICES[p] for p in self.position])
+		value = base + 5 * self.starter + 150 * (self.rates['goal'] + 0.5 * self.rates['assist'])
+		return np.clip(np.round(value), 40, 130).astype(int)
+
+	def play(self, team, goals):
+		""" Minutes, goals and assists of each of the team's players in a match where they scored goals. Starters play
+			all or most of the match and a couple of substitutes come on. Each goal goes to a player on the pitch
+			with probability proportional to their goal rate and minutes, and most are assisted by another.
+		"""
+		players = np.flatnonzero(self.team == team)
+		minutes = np.zeros(len(players), dtype=int)
+		starters = self.starter[players]
+		minutes[starters] = np.where(self.rng.random_sample(starters.sum()) < 0.8, 90, self.rng.randint(45, 90, starters.sum()))
+		subs = self.rng.choice(np.flatnonzero(~starters & (self.position[players] != 1)), size=min(2, np.sum(~starters)), replace=False)
+		minutes[subs] = self.rng.randint(1, 45, len(subs))
+
+		player_goals = np.zeros(len(players), dtype=int)
+		player_assists = np.zeros(len(players), dtype=int)
+		goal_weights = self.rates['goal'][players] * minutes
+		assist_weights = self.rates['assist'][players] * minutes
+		for _ in range(goals):
+			scorer = self.rng.choice(len(players), p=goal_weights / goal_weights.sum())
+			player_goals[scorer] += 1
+			if self.rng.random_sample() < ASSIST_PROBABILITY:
+				weights = assist_weights.copy()
+				weights[scorer] = 0
+				player_assists[self.rng.choice(len(players), p=weights / weights.sum())] += 1
+		return players, minutes, player_goals, player_assists
+
+
+def generate(root, n_seasons=1, n_leagues=1, n_teams=20, players_per_team=15, first_season=2017, seed=0, params=None):
+	""" Writes n_seasons seasons of n_leagues leagues of n_teams teams each, with players_per_team players in each
+		team, under root. Teams and players carry over between seasons, with teams moving between the leagues.
+		Returns the season names.
+	"""
+	rng = np.random.RandomState(seed)
+	params = load_params() if params is None else params
+	leagues = [
+		SyntheticLeague(n_teams, params, rng, level=LEAGUE_STEP ** league, first_id=league * n_teams + 1)
+		for league in range(n_leagues)
+	]
+	squads = SyntheticSquads(n_leagues * n_teams, players_per_team, params, rng)
+	rounds = round_robin(n_teams)
+
+	seasons = []
+	for year in range(first_season, first_season + n_seasons):
+		if year > first_season:
+			promote(leagues, min(PROMOTED, n_teams // 2))
+		season = season_name(year)
+		# deadlines are on Saturday mornings and the gameweek's matches all that afternoon
+		first_deadline = datetime.datetime(year, 8, 10, 11, 0)
+		first_deadline += datetime.timedelta(days=(5 - first_deadline.weekday()) % 7)
+		deadlines = [first_deadline + datetime.timedelta(weeks=k) for k in range(len(rounds))]
+
+		results = [[] for _ in range(n_leagues)]
+		first_league_ids = leagues[0].team_ids[1:]
+		history = {pid: [] for pid in squads.player_id[np.isin(squads.team, first_league_ids)]}
+		for gw, (deadline, fixtures) in enumerate(zip(deadlines, rounds), 1):
+			kickoff = deadline.replace(hour=15)
+			for league in leagues:
+				league.step()
+			squads.step()
+
+			for league_id, (league, league_results) in enumerate(zip(leagues, results)):
+				for fixture, (home, away) in enumerate(fixtures, len(league_results) + 1):
+					home_goals, away_goals = league.play(home, away)
+					league_results.append(dict(
+						Div='E{}'.format(league_id),
+						Date=kickoff.strftime('%d/%m/%y'),
+						HomeTeam=team_name(league.team_ids[home]),
+						AwayTeam=team_name(league.team_ids[away]),
+						FTHG=home_goals,
+						FTAG=away_goals,
+						FTR='H' if home_goals > away_goals else 'A' if away_goals > home_goals else 'D',
+					))
+					if league_id == 0:
+						_add_history(history, squads, fixture, gw, kickoff, league.team_ids[home],
+									 league.team_ids[away], home_goals, away_goals)
+
+		_write_match_data(root, season, results)
+		_write_fpl_data(root, season, deadlines, first_league_ids, squads, history)
+		seasons.append(season)
+		logger.info('Wrote synthetic season {} ({} leagues, {} teams, {} players) to {}'.format(
+			season, n_leagues, n_teams, len(squads.player_id), root))
+	return seasons
+
+
+def _add_history(history, squads, fixture, gw, kickoff, home, away, home_goals, away_goals):
+	for team, opponent, was_home, goals, conceded in (
+			(home, away, True, home_goals, away_goals), (away, home, False, away_goals, home_goals)):
+		players, minutes, goals_scored, assists = squads.play(team, goals)
+		prices = squads.prices()[players]
+		for k, pid in enumerate(squads.player_id[players]):
+			history[pid].append(dict(
+				element=int(pid),
+				fixture=fixture,
+				opponent_team=int(opponent),
+				was_home=was_home,
+				kickoff_time=kickoff.strftime('%Y-%m-%dT%H:%M:%SZ'),
+				team_h_score=int(home_goals),
+				team_a_score=int(away_goals),
+				round=gw,
+				minutes=int(minutes[k]),
+				goals_scored=int(goals_scored[k]),
+				assists=int(assists[k]),
+				clean_sheets=int(minutes[k] >= 60 and conceded == 0),
+				goals_conceded=int(conceded) if minutes[k] else 0,
+				own_goals=0,
+				penalties_saved=0,
+				penalties_missed=0,
+				yellow_cards=0,
+				red_cards=0,
+				saves=0,
+				bonus=0,
+				bps=0,
+				offside=0,
+				transfers_balance=0,
+				value=int(prices[k]),
+			))
+
+
+def _write_match_data(root, season, results):
+	folder = os.path.join(root, 'match_data', season) + '/'
+	validate_path(folder)
+	for league_id, league_results in enumerate(results):
+		pd.DataFrame(league_results).to_csv(folder + 'E{}.csv'.format(league_id), index=False)
+
+
+def _write_fpl_data(root, season, deadlines, team_ids, squads, history):
+	folder = os.path.join(root, 'fpl_data', season + '_Data') + '/'
+	validate_path(folder)
+	summary = dict(
+		events=[
+			dict(id=gw, name='Gameweek {}'.format(gw), deadline_time=deadline.strftime('%Y-%m-%dT%H:%M:%SZ'))
+			for gw, deadline in enumerate(deadlines, 1)
+		],
+		teams=[dict(id=int(team), name=team_name(team)) for team in team_ids],
+		elements=[
+			dict(id=int(pid), element_type=int(position), team=int(team), now_cost=int(price))
+			for pid, position, team, price in zip(squads.player_id, squads.position, squads.team, squads.prices())
+			if pid in history
+		],
+	)
+	with open(folder + 'main_JSON.json', 'w') as file:
+		json.dump(summary, file)
+	for pid, rows in history.items():
+		with open(folder + '{}.txt'.format(pid), 'w') as file:
+			json.dump(dict(history=rows), file)
+
+
+def load_generated(root, seasons, add_team_ratings=True, add_team_assists=True):
+	""" Runs the loader over each generated season and stacks them, numbering gameweeks on across seasons (as the
+		tuners' gameweek groupings expect), for the multi-season volumes the real data does not have. The loader only
+		reads the first league, so the others' results are added to match_scores here, with a league column.
+	"""
+	data = dict(match_scores=[], all_player_data=[])
+	gw_offset = 0
+	for season in seasons:
+		data_paths = loader_paths(root, season)
+		season_data = load(add_team_ratings, add_team_assists, **data_paths)
+		season_data['match_scores']['league'] = 0
+		other_leagues = _load_other_leagues(data_paths['match_data_path'], season_data['match_scores'])
+		season_data['match_scores'] = pd.concat([season_data['match_scores']] + other_leagues, ignore_index=True)
+		season_data['match_scores']['gw'] += gw_offset
+		season_data['all_player_data']['gameweek'] += gw_offset
+		for key in data:
+			data[key].append(season_data[key])
+		gw_offset = season_data['match_scores']['gw'].max()
+	return {key: pd.concat(frames, ignore_index=True) for key, frames in data.items()}
+
+
+def loader_paths(root, season):
+	""" The Loader's data path kwargs for a season generated under root.
+	"""
+	return dict(
+		match_data_path=os.path.join(root, 'match_data', season) + '/',
+		fpl_data_path=os.path.join(root, 'fpl_data') + '/',
+		season=season,
+	)
+
+
+def _load_other_leagues(match_data_path, first_league):
+	""" The results of the leagues after the first, in the loader's match_scores columns, with gameweeks from the
+		first league's matches on the same dates.
+	"""
+	date_to_gw = dict(zip(first_league.date, first_league.gw))
+	frames = []
+	league = 1
+	while os.path.exists(match_data_path + 'E{}.csv'.format(league)):
+		results = pd.read_csv(match_data_path + 'E{}.csv'.format(league))
+		date = pd.to_datetime(results.Date, format='%d/%m/%y')
+		frames.append(pd.DataFrame(dict(
+			date=date,
+			home_name=results.HomeTeam,
+			away_name=results.AwayTeam,
+			fthg=results.FTHG,
+			ftag=results.FTAG,
+			home_id=results.HomeTeam.map(team_id),
+			away_id=results.AwayTeam.map(team_id),
+			gw=date.map(date_to_gw),
+			league=league,
+		))[first_league.columns])
+		league += 1
+	return frames
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('root')
+	parser.add_argument('--seasons', type=int, default=1)
+	parser.add_argument('--leagues', type=int, default=1)
+	parser.add_argument('--teams', type=int, default=20)
+	parser.add_argument('--players-per-team', type=int, default=15)
+	parser.add_argument('--first-season', type=int, default=2017)
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args(argv)
+	generate(args.root, args.seasons, args.leagues, args.teams, args.players_per_team, args.first_season, args.seed)
+
+
+if __name__ == '__main__':
+	main()
@@ -15,8 +15,11 @@ from src.tuners.tuner_params import load_params
 
 class Loader:
 
-	def __init__(self, add_team_ratings=True, add_team_assists=True):
+	def __init__(self, add_team_ratings=True, add_team_assists=True, match_data_path=MATCH_DATA_PATH,
+				 fpl_data_path=FPL_DATA_PATH, season='2017_18'):
 		self.data = {}
+		self.match_data_path = match_data_path
+		self.fpl_season_path = fpl_data_path + season + '_Data/'
 		self.maps = {}
 		self.add_team_ratings = add_team_ratings
 		self.add_team_assists = add_team_assists
@@ -91,7 +94,7 @@ class Loader:
 
 	def load_fpl_summary(self):
 		# import data
-		with open(FPL_DATA_PATH + '2017_18_Data/main_JSON.json', 'r') as file:
+		with open(self.fpl_season_path + 'main_JSON.json', 'r') as file:
 			data = json.load(file)
 
 		self.data['fpl_summary_json'] = data
@@ -99,7 +102,7 @@ class Loader:
 
 	def load_match_scores(self):
 		# import data
-		match_scores = pd.read_csv(MATCH_DATA_PATH + 'E0.csv')
+		match_scores = pd.read_csv(self.match_data_path + 'E0.csv')
 
 		# remove unwanted columns
 		COLS_TO_KEEP = ['Date', 'HomeTeam', 'AwayTeam', 'FTHG', 'FTAG']
@@ -127,7 +130,7 @@ class Loader:
 		list_all_player_data = []
 
 		for player_id_i in self.player_id_list:
-			with open(FPL_DATA_PATH + '2017_18_Data/' + '{}.txt'.format(player_id_i)) as file:
+			with open(self.fpl_season_path + '{}.txt'.format(player_id_i)) as file:
 				player_i_data_df = pd.DataFrame(json.load(file)['history'])
 				list_all_player_data.append(player_i_data_df)
 
@@ -273,8 +276,8 @@ class Loader:
 		self.data['all_player_data']['position_id'] = self.data['all_player_data'].player_id.map(self.maps['pid_to_pos'])
 
 
-def load(add_team_ratings=True, add_team_assists=True):
-	loader = Loader(add_team_ratings, add_team_assists)
+def load(add_team_ratings=True, add_team_assists=True, **data_paths):
+	loader = Loader(add_team_ratings, add_team_assists, **data_paths)
 	loader.run_loader()
 	return loader.data
 
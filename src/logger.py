@@ -1,7 +1,11 @@
 """ Configures all the logging bullshit.
 """
+import atexit
 import datetime
 import logging
+import logging.handlers
+import os
+import queue
 import sys
 from os import makedirs
 from os.path import exists
@@ -51,53 +55,90 @@ validate_path(folder_path)
 
 logger = logging.getLogger('test')
 stream_logger = logging.getLogger('stream')
+timer_logger = logging.getLogger('timer')
 
 logger.setLevel(LOGGING_LEVEL)
+timer_logger.setLevel('INFO')
 
-__stream_handler__ = logging.StreamHandler(
-	stream=sys.stdout
-)
-__stream_handler__.setLevel(LOGGING_LEVEL)
-__file_handler__ = logging.FileHandler(
-	filename=logging_path
-)
 __formatter__ = logging.Formatter(
 	fmt='%(asctime)s  %(module)-30s \t %(message)s',
 	datefmt='%d/%m/%Y %H:%M:%S',
 )
+__timer_formatter__ = logging.Formatter(
+	fmt='%(asctime)s %(message)s',
+	datefmt='%d/%m/%Y %H:%M:%S',
+)
+
+
+def _is_timer_record(record):
+	return record.name == 'timer'
+
+
+def _is_not_timer_record(record):
+	return record.name != 'timer'
+
+
+def _build_handlers():
+	""" The stream and file handlers that records are finally written by, the timer's records getting a formatter of
+		their own.
+	"""
+	handlers = []
+	for formatter, record_filter in ((__formatter__, _is_not_timer_record), (__timer_formatter__, _is_timer_record)):
+		for handler in (logging.StreamHandler(stream=sys.stdout), logging.FileHandler(filename=logging_path)):
+			handler.setLevel(LOGGING_LEVEL)
+			handler.setFormatter(formatter)
+			handler.addFilter(record_filter)
+			handlers.append(handler)
+	return handlers
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+	""" Puts records on the queue as they are, so that the message is only formatted (including its %-style args) by
+		the listener thread, rather than on the caller's thread as QueueHandler.prepare does.
+	"""
+
+	def prepare(self, record):
+		return record
+
 
-for handler in (__stream_handler__, __file_handler__):
-	handler.setLevel(LOGGING_LEVEL)
-	handler.setFormatter(__formatter__)
-	logger.addHandler(handler)
+__handlers__ = _build_handlers()
+__queue_handler__ = DeferredQueueHandler(queue.SimpleQueue())
+__listener__ = logging.handlers.QueueListener(__queue_handler__.queue, *__handlers__, respect_handler_level=True)
+__listener__.start()
+atexit.register(__listener__.stop)
 
-stream_logger.addHandler(__stream_handler__)
+for _logger in (logger, timer_logger):
+	_logger.addHandler(__queue_handler__)
+
+
+def _log_synchronously_in_child():
+	""" The listener thread does not survive a fork, and pool workers exit without running atexit, so forked processes
+		write their (rare) records directly instead.
+	"""
+	for _logger in (logger, timer_logger):
+		_logger.removeHandler(__queue_handler__)
+		for handler in __handlers__:
+			_logger.addHandler(handler)
+
+
+os.register_at_fork(after_in_child=_log_synchronously_in_child)
+
+stream_logger.addHandler(__handlers__[0])
 stream_logger.info('Logging is being written to {}'.format(logging_path))
 
 
 class TimerLogger:
+	""" Logs through the timer logger, with the calling module in place of the logging module. There is only ever one
+		instance.
+	"""
+
+	_instance = None
 
-	def __init__(self):
-		self.timer_logger = logging.getLogger('timer')
-		self.timer_logger.setLevel('INFO')
-		if not self.timer_logger.handlers:
-			sh = logging.StreamHandler(
-				stream=sys.stdout
-			)
-			sh.setLevel('INFO')
-			fh = logging.FileHandler(
-				filename=logging_path
-			)
-			timer_formatter = logging.Formatter(
-				fmt='%(asctime)s %(message)s',
-				datefmt='%d/%m/%Y %H:%M:%S',
-			)
-			sh.setFormatter(timer_formatter)
-			fh.setFormatter(timer_formatter)
-			self.timer_logger.addHandler(sh)
-			self.timer_logger.addHandler(fh)
-		assert len(self.timer_logger.handlers) == 2
+	def __new__(cls):
+		if cls._instance is None:
+			cls._instance = super().__new__(cls)
+			cls._instance.timer_logger = timer_logger
+		return cls._instance
 
 	def info(self, msg, override):
-		msg = ' {:36}'.format(override) + msg
-		return self.timer_logger.info(msg)
+		return self.timer_logger.info(' %-36s%s', override, msg)
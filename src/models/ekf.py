@@ -0,0 +1,100 @@
+""" The extended Kalman filter core shared by the team, league and player rating models. A model's states are stacked
+	into a (batch x state) array, with (batch x state x state) covariances, so that a batch of independent filters (a
+	gameweek's matches, or its players) is updated at once, and an unbatched (state,) model is handled by the same
+	broadcasting. Each model runs its own predict step into xk_minus and Pk_minus, and plugs in its measurement function
+	and Jacobian as _predict and _generate_Hk, which read the prior from xk_minus (the Jacobian is generated first, so a
+	linear measurement can predict with it). The observations are goal counts, with Poisson noise, so Rk is the diagonal
+	of the predictions and the likelihood accumulated is theirs.
+"""
+import numpy as np
+from scipy.special import gammaln
+
+from src.profiler import profiler
+
+
+class ExtendedKalmanFilter:
+
+	def __init__(self):
+		# -- hidden state variables -- #
+		self.xk_minus = None
+		self.xk = None
+		self.Pk_minus = None
+		self.Pk = None
+
+		# -- observation state variables -- #
+		self.observations = None
+		self.predictions = None
+		self.yk = None
+		self.Rk = None
+		self.Hk = None
+		self.Sk = None
+		self.Kk = None
+
+		# -- lhood tracking -- #
+		self.tot_log_lhood = 0
+		self.n_observations = 0
+
+	def _predict(self, *inputs):
+		raise NotImplementedError
+
+	def _generate_Hk(self, *inputs):
+		raise NotImplementedError
+
+	def _run_ekf_update(self, observations, *inputs):
+		""" Updates the prior in xk_minus and Pk_minus on the observations, with inputs passed on to the measurement
+			function and its Jacobian, leaving the posterior in xk and Pk and returning each observation's log
+			likelihood.
+		"""
+		self.Hk = self._generate_Hk(*inputs)
+		self.predictions = self._predict(*inputs)
+		self.Rk = stacked_diag(self.predictions)
+		self.observations = np.asarray(observations)
+		self.yk = self.observations - self.predictions
+		self._kalman_update()
+		return self._update_log_lhood()
+
+	def _kalman_update(self):
+		self.xk, self.Pk, self.Sk, self.Kk = kalman_update(self.xk_minus, self.Pk_minus, self.Hk, self.Rk, self.yk)
+
+	def _update_log_lhood(self):
+		log_lhoods = poisson_log_lhood(self.predictions, self.observations)
+		self.tot_log_lhood += np.sum(log_lhoods)
+		self.n_observations += log_lhoods.size
+		return log_lhoods
+
+
+def kalman_update(xk_minus, Pk_minus, Hk, Rk, yk):
+	""" The posterior state and covariance, innovation covariance and gain of a Kalman update, stacked along any
+		leading batch axes, where
+
+			Sk = Hk Pk_minus Hk^T + Rk,     Kk = Pk_minus Hk^T Sk^-1,
+			xk = xk_minus + Kk yk,          Pk = (I - Kk Hk) Pk_minus
+
+		A single observation (as in the player models) divides by Sk rather than solving with it.
+	"""
+	PHT = np.matmul(Pk_minus, np.swapaxes(Hk, -1, -2))
+	Sk = np.matmul(Hk, PHT) + Rk
+	if Sk.shape[-1] == 1:
+		Kk = PHT / Sk
+	else:
+		# Sk and Pk_minus are symmetric, so Kk^T = Sk^-1 Hk Pk_minus
+		Kk = np.swapaxes(np.linalg.solve(Sk, np.swapaxes(PHT, -1, -2)), -1, -2)
+	xk = xk_minus + np.matmul(Kk, yk[..., None])[..., 0]
+	Pk = Pk_minus - np.matmul(Kk, np.matmul(Hk, Pk_minus))
+	return xk, Pk, Sk, Kk
+
+
+def stacked_diag(values):
+	""" np.diag of each of the stacked vectors along the last axis of values.
+	"""
+	return values[..., None] * np.eye(values.shape[-1])
+
+
+def poisson_log_lhood(predictions, observations):
+	return observations * np.log(predictions) - predictions - gammaln(observations + 1)
+
+
+profiler.instrument(ExtendedKalmanFilter, dict(
+	_kalman_update='ekf update',
+	_update_log_lhood='ekf likelihood',
+))
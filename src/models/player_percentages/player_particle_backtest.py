@@ -0,0 +1,60 @@
+import numpy as np
+
+from src.models.player_percentages.player_particle_ratings import PlayerParticleGoalRatings, PlayerParticleAssistRatings
+from src.models.player_percentages.player_ratings_backtest import PlayerRatingsBacktest, _occurrence
+from src.profiler import profiler
+from src.utils import group_indices, systematic_resample
+
+
+class PlayerParticleBacktest(PlayerRatingsBacktest):
+	""" PlayerRatingsBacktest with the particle filter models, which update all of a gameweek's players at once. The
+		cost and likelihood totals are the same, the likelihoods being the predictive ones of the particle filters.
+	"""
+
+	def __init__(self, params, pids, player_goals, player_assists, team_goals, team_assists, positions, gameweeks,
+				 record_gameweeks=False, models=('goal', 'assist'), n_particles=1000, ess_threshold=0.5,
+				 resampler=systematic_resample, seed=0):
+		super().__init__(params, pids, player_goals, player_assists, team_goals, team_assists, positions, gameweeks,
+						 record_gameweeks, models)
+		self.filter_kwargs = dict(n_particles=n_particles, ess_threshold=ess_threshold, resampler=resampler)
+		self.seed = seed
+		self.player_ids, self.players = np.unique(np.asarray(pids), return_inverse=True)
+
+	def run_backtest(self):
+		updated = (self.positions != 1) & (self.team_goals > 0)
+		random_state = np.random.RandomState(self.seed)
+		if self.run_goals:
+			self.goal_ratings = self._run_model(
+				PlayerParticleGoalRatings, np.flatnonzero(updated), self.player_goals, self.team_goals, random_state)
+		if self.run_assists:
+			self.assist_ratings = self._run_model(
+				PlayerParticleAssistRatings, np.flatnonzero(updated & (self.team_assists > 0)), self.player_assists,
+				self.team_assists, random_state)
+
+	def _run_model(self, ratings_class, rows, obs, n_goals_or_assists, random_state):
+		""" Runs the model over the given rows a step at a time, each step being a gameweek's rows or, in a double
+			gameweek, the first or second of its players' rows, so that no player appears twice in a step.
+		"""
+		players = self.players[rows]
+		gameweeks = np.asarray(self.gameweeks)[rows]
+
+		# each player starts from the x0 of the position they are first seen in, as with the Kalman filters
+		_, first = np.unique(players, return_index=True)
+		player_positions = np.zeros(len(self.player_ids), dtype=int)
+		player_positions[players[first]] = np.asarray(self.positions)[rows][first]
+		ratings = ratings_class(self.params, player_positions, random_state=random_state, **self.filter_kwargs)
+
+		occurrence = _occurrence(gameweeks, players)
+		n_occurrences = occurrence.max() + 1 if len(rows) else 1
+		for step_key, step in group_indices(gameweeks * n_occurrences + occurrence).items():
+			gameweek = step_key // n_occurrences
+			step_rows = rows[step]
+			log_lhoods = ratings.run_update_step(
+				players[step], np.asarray(obs)[step_rows], np.asarray(n_goals_or_assists, dtype=float)[step_rows])
+			if self.record_gameweeks:
+				self.gw_log_lhoods[gameweek] += log_lhoods.sum()
+				self.gw_n_obs[gameweek] += len(step_rows)
+		return ratings
+
+
+profiler.instrument(PlayerParticleBacktest, dict(run_backtest='player particle backtest'))
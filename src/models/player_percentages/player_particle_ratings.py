@@ -0,0 +1,103 @@
+""" Particle filter versions of the player goal and assist models. Rather than a Gaussian approximation of each
+	player's rating, clipped to stay positive, the rating is represented by n_particles samples, which random walk
+	(reflected at zero) with the same Q and start from the same x0 and P0. The particles of every player are held in one
+	(n_players, n_particles) array so that a whole gameweek's players are updated at once.
+"""
+import numpy as np
+from scipy.special import gammaln, logsumexp
+
+from src.profiler import profiler
+from src.tuners.tuner_params import get_param
+from src.utils import systematic_resample
+
+
+class PlayerParticleRatings:
+
+	def __init__(self, params, positions, n_particles=1000, ess_threshold=0.5, resampler=systematic_resample,
+				 random_state=None):
+		""" positions holds the position of each player (indexed from 0), which picks their x0. A player's particles
+			are resampled whenever their effective sample size drops below ess_threshold * n_particles, all of a
+			step's players at once, so resampler is one of the batched resamplers in utils.
+		"""
+		self.params = params
+		self.n_particles = n_particles
+		self.ess_threshold = ess_threshold
+		self.resampler = resampler
+		self.random_state = np.random.RandomState(0) if random_state is None else random_state
+
+		x0 = np.array([0., self.x0_gks, self.x0_def, self.x0_mid, self.x0_att])[positions]
+		self.particles = np.abs(
+			x0[:, None] + np.sqrt(self.P0) * self.random_state.standard_normal((len(positions), n_particles)))
+		self.weights = np.full(self.particles.shape, 1 / n_particles)
+
+		self.tot_log_lhood = 0
+		self.n_obs = 0
+		self.n_resamples = 0
+
+	def run_update_step(self, players, obs, n_goals_or_assists):
+		""" Updates the given players (distinct indices into the particle arrays) on their observed goals or assists
+			out of their team's, returning each observation's log likelihood under the predicted rating.
+		"""
+		# -- predict -- #
+		particles = np.abs(
+			self.particles[players]
+			+ np.sqrt(self.Q) * self.random_state.standard_normal((len(players), self.n_particles))
+		)
+
+		# -- update -- #
+		rates = n_goals_or_assists[:, None] * particles
+		with np.errstate(divide='ignore'):
+			log_weights = np.log(self.weights[players]) + obs[:, None] * np.log(rates) - rates - gammaln(obs + 1)[:, None]
+		log_lhoods = logsumexp(log_weights, axis=1)
+		weights = np.exp(log_weights - log_lhoods[:, None])
+
+		# -- resample -- #
+		ess = 1 / np.sum(weights ** 2, axis=1)
+		degenerate = np.flatnonzero(ess < self.ess_threshold * self.n_particles)
+		if len(degenerate):
+			indexes = self.resampler(weights[degenerate], self.random_state)
+			particles[degenerate] = np.take_along_axis(particles[degenerate], indexes, axis=1)
+			weights[degenerate] = 1 / self.n_particles
+			self.n_resamples += len(degenerate)
+
+		self.particles[players] = particles
+		self.weights[players] = weights
+
+		# -- calc lhood -- #
+		self.tot_log_lhood += log_lhoods.sum()
+		self.n_obs += len(players)
+		return log_lhoods
+
+	def rating_moments(self, players=slice(None)):
+		""" Posterior mean and variance of the players' ratings.
+		"""
+		mean = np.sum(self.weights[players] * self.particles[players], axis=1)
+		var = np.sum(self.weights[players] * (self.particles[players] - mean[:, None]) ** 2, axis=1)
+		return mean, var
+
+
+class PlayerParticleGoalRatings(PlayerParticleRatings):
+
+	def __init__(self, params, positions, **kwargs):
+		self.x0_gks = get_param(params, 'player_goal_x0_gks')
+		self.x0_def = get_param(params, 'player_goal_x0_def')
+		self.x0_mid = get_param(params, 'player_goal_x0_mid')
+		self.x0_att = get_param(params, 'player_goal_x0_att')
+		self.P0 = get_param(params, 'player_goal_P0') ** 2
+		self.Q = get_param(params, 'player_goal_Q') ** 2
+		super().__init__(params, positions, **kwargs)
+
+
+class PlayerParticleAssistRatings(PlayerParticleRatings):
+
+	def __init__(self, params, positions, **kwargs):
+		self.x0_gks = get_param(params, 'player_assist_x0_gks')
+		self.x0_def = get_param(params, 'player_assist_x0_def')
+		self.x0_mid = get_param(params, 'player_assist_x0_mid')
+		self.x0_att = get_param(params, 'player_assist_x0_att')
+		self.P0 = get_param(params, 'player_assist_P0') ** 2
+		self.Q = get_param(params, 'player_assist_Q') ** 2
+		super().__init__(params, positions, **kwargs)
+
+
+profiler.instrument(PlayerParticleRatings, dict(run_update_step='player particle update step'))
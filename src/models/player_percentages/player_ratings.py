@@ -1,51 +1,75 @@
-import math
 from collections import defaultdict
-from abc import ABC, abstractmethod
 
+import numpy as np
 
-class PlayerRatings(ABC):
+from src.models.ekf import ExtendedKalmanFilter
+from src.profiler import profiler
+from src.tuners.tuner_params import get_param
+
+
+class PlayerRatings(ExtendedKalmanFilter):
+	""" A player's rating is their expected share of their team's goals (or assists) while on the pitch, observed
+		through the goals they score out of their team's, with a floor just above zero. model names the parameters.
+	"""
+	model = None
 
 	def __init__(self, params):
+		super().__init__()
 		self.current_ratings = defaultdict(dict)
 		self.historical_ratings = defaultdict(dict)
 		self.params = params
 
-		# -- hidden state variables -- #
-		self.xk_minus = None
-		self.xk = None
-		self.Qk = None
-		self.Pk_minus = None
-		self.Pk = None
-
-		# -- observation state variables -- #
-		# self.observation = None
-		self.prediction = None
-		self.yk = None
-		self.Rk = None
-		self.Hk = None
-		self.Sk = None
-		self.Kk = None
-
-		self.tot_log_lhood = 0
-		self.n_obs = 0
-
-	@abstractmethod
-	def run_update_step(self, gameweek, pid, obs, n_goals_or_assists, position):
-		return NotImplemented
-
-	def _get_player_data(self, pid, position):
-		try:
-			rating = self.current_ratings[pid]['rating']
-			var = self.current_ratings[pid]['variance']
-		except KeyError:
-			rating = {
-				1: self.x0_gks,
-				2: self.x0_def,
-				3: self.x0_mid,
-				4: self.x0_att,
-			}[position]
-			var = self.P0
-		return rating, var
+		self.x0_gks = get_param(self.params, 'player_{}_x0_gks'.format(self.model))
+		self.x0_def = get_param(self.params, 'player_{}_x0_def'.format(self.model))
+		self.x0_mid = get_param(self.params, 'player_{}_x0_mid'.format(self.model))
+		self.x0_att = get_param(self.params, 'player_{}_x0_att'.format(self.model))
+		self.P0 = get_param(self.params, 'player_{}_P0'.format(self.model)) ** 2
+		self.Q = get_param(self.params, 'player_{}_Q'.format(self.model)) ** 2
+
+	@property
+	def n_obs(self):
+		return self.n_observations
+
+	def run_update_step(self, gameweek, pids, obs, n_goals_or_assists, positions):
+		""" Updates the given players, none of whom appear twice, on the goals (or assists) they got out of their
+			team's n_goals_or_assists, returning each observation's log likelihood.
+		"""
+		prev_ratings, prev_vars = self._get_player_data(pids, positions)
+
+		# -- predict -- #
+		self.xk_minus = prev_ratings[:, None]
+		self.Pk_minus = (prev_vars + self.Q)[:, None, None]
+
+		# -- update -- #
+		log_lhoods = self._run_ekf_update(
+			np.asarray(obs, dtype=float)[:, None], np.asarray(n_goals_or_assists, dtype=float))
+		self.xk = np.maximum(1e-6, self.xk)
+
+		# -- save posterior (which is all the history keeps of a gameweek) -- #
+		for pid, rating, var in zip(pids, self.xk[:, 0], self.Pk[:, 0, 0]):
+			self._update_historical_ratings(pid, gameweek, rating, var)
+			self._update_current_ratings(pid, rating, var)
+		return log_lhoods[:, 0]
+
+	def _predict(self, n_goals_or_assists):
+		return n_goals_or_assists[:, None] * self.xk_minus
+
+	def _generate_Hk(self, n_goals_or_assists):
+		return n_goals_or_assists[:, None, None]
+
+	def _get_player_data(self, pids, positions):
+		""" The players' current ratings and variances, or their position's x0 and P0 for those not yet seen.
+		"""
+		x0 = np.array([np.nan, self.x0_gks, self.x0_def, self.x0_mid, self.x0_att])
+		ratings = x0[np.asarray(positions, dtype=int)]
+		variances = np.full(len(ratings), self.P0)
+		for i, pid in enumerate(pids):
+			try:
+				ratings[i] = self.current_ratings[pid]['rating']
+				variances[i] = self.current_ratings[pid]['variance']
+			except KeyError:
+				continue
+		return ratings, variances
 
 	def _update_current_ratings(self, pid, rating, var):
 		self.current_ratings[pid]['rating'] = rating
@@ -59,91 +83,16 @@ class PlayerRatings(ABC):
 
 
 class PlayerGoalRatings(PlayerRatings):
-
-	def __init__(self, params):
-		super().__init__(params)
-
-		self.x0_gks = self.params['player_goal_x0_gks']
-		self.x0_def = self.params['player_goal_x0_def']
-		self.x0_mid = self.params['player_goal_x0_mid']
-		self.x0_att = self.params['player_goal_x0_att']
-		self.P0 = self.params['player_goal_P0'] ** 2
-		self.Q = self.params['player_goal_Q'] ** 2
-
-	def run_update_step(self, gameweek, pid, obs, n_goals, position):
-
-		prev_rating, prev_var = self._get_player_data(pid, position)
-
-		# -- predict -- #
-		self.xk_minus = prev_rating
-		self.Pk_minus = prev_var + self.Q
-
-		# -- save prior -- #
-		self._update_historical_ratings(pid, gameweek, self.xk_minus, self.Pk_minus)
-
-		# -- update -- #
-		# self.Hk = players_team_att * opp_def * league_avg
-		self.Hk = n_goals
-		self.prediction = self.Rk = self.Hk * self.xk_minus
-		self.yk = obs - self.prediction
-		self.Sk = self.Hk * self.Pk_minus * self.Hk + self.Rk
-		self.Kk = self.Pk_minus * self.Hk / self.Sk
-
-		self.xk = max(1e-6, self.xk_minus + self.Kk * self.yk)
-		self.Pk = (1 - self.Kk * self.Hk) * self.Pk_minus
-
-		# -- save prior -- #
-		self._update_historical_ratings(pid, gameweek, self.xk, self.Pk)
-		self._update_current_ratings(pid, self.xk, self.Pk)
-
-		# -- calc lhood -- #
-		self.tot_log_lhood += -self.prediction + obs * math.log(self.prediction) - math.log(math.factorial(obs))
-		self.n_obs += 1
+	model = 'goal'
 
 
 class PlayerAssistRatings(PlayerRatings):
-
-	def __init__(self, params):
-		super().__init__(params)
-
-		self.x0_gks = self.params['player_assist_x0_gks']
-		self.x0_def = self.params['player_assist_x0_def']
-		self.x0_mid = self.params['player_assist_x0_mid']
-		self.x0_att = self.params['player_assist_x0_att']
-		self.P0 = self.params['player_assist_P0'] ** 2
-		self.Q = self.params['player_assist_Q'] ** 2
-
-	def run_update_step(self, gameweek, pid, obs, n_assists, position):
-
-		prev_rating, prev_var = self._get_player_data(pid, position)
-
-		# -- predict -- #
-		self.xk_minus = prev_rating
-		self.Pk_minus = prev_var + self.Q
-
-		# -- save prior -- #
-		self._update_historical_ratings(pid, gameweek, self.xk_minus, self.Pk_minus)
-
-		# -- update -- #
-		self.Hk = n_assists
-		self.prediction = self.Rk = self.Hk * self.xk_minus
-		self.yk = obs - self.prediction
-		self.Sk = self.Hk * self.Pk_minus * self.Hk + self.Rk
-		self.Kk = self.Pk_minus * self.Hk / self.Sk
-
-		self.xk = max(1e-6, self.xk_minus + self.Kk * self.yk)
-		self.Pk = (1 - self.Kk * self.Hk) * self.Pk_minus
-
-		# -- save posterior -- #
-		self._update_historical_ratings(pid, gameweek, self.xk, self.Pk)
-		self._update_current_ratings(pid, self.xk, self.Pk)
-
-		# -- calc lhood -- #
-		self.tot_log_lhood += -self.prediction + obs * math.log(self.prediction) - math.log(math.factorial(obs))
-		self.n_obs += 1
-
-
-
-
+	model = 'assist'
 
 
+profiler.instrument(PlayerRatings, dict(
+	run_update_step='player update step',
+	_get_player_data='player state read',
+	_update_current_ratings='player state write',
+	_update_historical_ratings='player history write',
+))
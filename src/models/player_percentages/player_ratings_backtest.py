@@ -1,12 +1,21 @@
 import math
+from collections import defaultdict
+
+import numpy as np
 
 from src.models.player_percentages.player_ratings import PlayerGoalRatings, PlayerAssistRatings
+from src.profiler import profiler
+from src.utils import group_indices
 
 
 class PlayerRatingsBacktest:
 	# TODO: split goals and assists backtests as they're completely seperate (should speed up tuning)
 
-	def __init__(self, params, pids, player_goals, player_assists, team_goals, team_assists, positions, gameweeks):
+	def __init__(self, params, pids, player_goals, player_assists, team_goals, team_assists, positions, gameweeks,
+				 record_gameweeks=False, models=('goal', 'assist')):
+		""" If record_gameweeks is True, the log likelihood and number of observations are also totalled per
+			gameweek, for use by window_log_lhood. Only the models named in models ('goal' and/or 'assist') are run.
+		"""
 		self.params = params
 		self.pids = pids
 		self.player_goals = player_goals
@@ -19,19 +28,53 @@ class PlayerRatingsBacktest:
 		self.goal_ratings = PlayerGoalRatings(self.params)
 		self.assist_ratings = PlayerAssistRatings(self.params)
 
+		self.run_goals = 'goal' in models
+		self.run_assists = 'assist' in models
+
+		self.record_gameweeks = record_gameweeks
+		self.gw_log_lhoods = defaultdict(float)
+		self.gw_n_obs = defaultdict(int)
+
 	def run_backtest(self):
-		for pid, player_goals, player_assists, team_goals, \
-			team_assists, player_position, gameweek in \
-				zip(self.pids, self.player_goals, self.player_assists,
-					self.team_goals, self.team_assists, self.positions,
-					self.gameweeks):
-			if player_position == 1:
-				continue
-
-			if team_goals > 0:
-				self.goal_ratings.run_update_step(gameweek, pid, player_goals, team_goals, player_position)
-				if team_assists > 0:
-					self.assist_ratings.run_update_step(gameweek, pid, player_assists, team_assists, player_position)
+		updated = (np.asarray(self.positions) != 1) & (np.asarray(self.team_goals) > 0)
+		if self.run_goals:
+			self._run_model(self.goal_ratings, np.flatnonzero(updated), self.player_goals, self.team_goals)
+		if self.run_assists:
+			self._run_model(self.assist_ratings, np.flatnonzero(updated & (np.asarray(self.team_assists) > 0)),
+							self.player_assists, self.team_assists)
+
+	def _run_model(self, ratings, rows, obs, n_goals_or_assists):
+		""" Runs the model over the given rows a step at a time, each step being a gameweek's rows or, in a double
+			gameweek, the first or second of its players' rows, so that no player appears twice in a step.
+		"""
+		pids = np.asarray(self.pids)[rows]
+		gameweeks = np.asarray(self.gameweeks)[rows]
+		positions = np.asarray(self.positions)[rows]
+		obs = np.asarray(obs)[rows]
+		n_goals_or_assists = np.asarray(n_goals_or_assists, dtype=float)[rows]
+
+		occurrence = _occurrence(gameweeks, np.unique(pids, return_inverse=True)[1])
+		n_occurrences = occurrence.max() + 1 if len(rows) else 1
+		for step_key, step in group_indices(gameweeks * n_occurrences + occurrence).items():
+			gameweek = step_key // n_occurrences
+			log_lhoods = ratings.run_update_step(
+				gameweek, pids[step], obs[step], n_goals_or_assists[step], positions[step])
+			if self.record_gameweeks:
+				self.gw_log_lhoods[gameweek] += log_lhoods.sum()
+				self.gw_n_obs[gameweek] += len(step)
+
+	def window_log_lhood(self, gameweeks):
+		""" Returns the total log likelihood and number of observations over the given gameweeks.
+		"""
+		return sum(self.gw_log_lhoods[gw] for gw in gameweeks), sum(self.gw_n_obs[gw] for gw in gameweeks)
+
+	@property
+	def tot_log_lhood(self):
+		return self.goal_ratings.tot_log_lhood + self.assist_ratings.tot_log_lhood
+
+	@property
+	def n_obs(self):
+		return self.goal_ratings.n_obs + self.assist_ratings.n_obs
 
 	@property
 	def goal_prop(self):
@@ -49,3 +92,16 @@ class PlayerRatingsBacktest:
 		return cost
 
 
+def _occurrence(gameweeks, players):
+	""" How many earlier rows each row's player has in the same gameweek.
+	"""
+	order = np.lexsort((np.arange(len(players)), players, gameweeks))
+	new_group = np.ones(len(order), dtype=bool)
+	new_group[1:] = (np.diff(gameweeks[order]) != 0) | (np.diff(players[order]) != 0)
+	group_starts = np.maximum.accumulate(np.where(new_group, np.arange(len(order)), 0))
+	occurrence = np.empty(len(order), dtype=int)
+	occurrence[order] = np.arange(len(order)) - group_starts
+	return occurrence
+
+
+profiler.instrument(PlayerRatingsBacktest, dict(run_backtest='player backtest'))
@@ -3,36 +3,24 @@ from abc import ABC, abstractmethod
 import numpy as np
 from collections import defaultdict
 
+from src.models.ekf import ExtendedKalmanFilter
 
-class PlayerRatings(ABC):
+
+class PlayerRatings(ExtendedKalmanFilter, ABC):
+	""" The predict step, measurement function (_predict) and Jacobian (_generate_Hk) are left to subclasses, which
+		update through the ekf core's _run_ekf_update.
+	"""
 
 	def __init__(self, params):
+		super().__init__()
 		self.current_player_ratings = defaultdict(dict)
 		self.historical_player_ratings = defaultdict(lambda: defaultdict(dict))
 		self.params = params
-
-		# -- hidden state variables -- #
-		self.xk_minus = None
-		self.xk = None
 		self.Qk = None
-		self.Pk_minus = None
-		self.Pk = None
-
-		# -- observation state variables -- #
-		self.observations = None
-		self.predictions = None
-		self.yk = None
-		self.Rk = None
-		self.Hk = None
-		self.Sk = None
-		self.Kk = None
 
 		# -- initial variables -- #
 		self._initialise_params()
 
-		self.tot_log_lhood = 0
-		self.n_obs = 0
-
 	@abstractmethod
 	def _initialise_params(self):
 		return NotImplemented
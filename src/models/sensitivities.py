@@ -0,0 +1,62 @@
+""" Helpers for propagating forward-mode sensitivities (derivatives with respect to a set of tunable parameters)
+	through the Kalman filter updates. Every derivative array carries the parameters along its last axis, and any
+	leading axes beyond the matrices' are a batch, as in the ekf core.
+"""
+import numpy as np
+
+
+def unit_sensitivity(sensitivity_params, name, scale=1.):
+	""" The derivative of parameter `name` (multiplied by `scale`) with respect to each of the sensitivity params.
+	"""
+	output = np.zeros(len(sensitivity_params))
+	if name in sensitivity_params:
+		output[sensitivity_params.index(name)] = scale
+	return output
+
+
+def d_diag(d_values):
+	""" Derivative of np.diag(values) given d_values of shape (..., m, n).
+	"""
+	m, n = d_values.shape[-2:]
+	output = np.zeros(d_values.shape[:-2] + (m, m, n))
+	output[..., np.arange(m), np.arange(m), :] = d_values
+	return output
+
+
+def d_dot(A, dA, B, dB):
+	""" Derivative of A.dot(B) for matrices A and B.
+	"""
+	return np.einsum('...ijn,...jk->...ikn', dA, B) + np.einsum('...ij,...jkn->...ikn', A, dB)
+
+
+def d_kalman_update(Pk_minus, dPk_minus, Hk, dHk, Sk, dRk, Kk, yk, dyk):
+	""" Derivatives of the posterior state and covariance of a Kalman update, given those of its inputs, where
+
+			Sk = Hk Pk_minus Hk^T + Rk,     Kk = Pk_minus Hk^T Sk^-1,
+			xk = xk_minus + Kk yk,          Pk = (I - Kk Hk) Pk_minus
+
+		Returns (dKk yk + Kk dyk, dPk), to which the caller adds the derivative of xk_minus.
+	"""
+	HkT = np.swapaxes(Hk, -1, -2)
+	dHkT = np.swapaxes(dHk, -2, -3)
+	Sk_inv = np.linalg.inv(Sk)
+
+	PHT = np.matmul(Pk_minus, HkT)
+	dPHT = d_dot(Pk_minus, dPk_minus, HkT, dHkT)
+	dSk = d_dot(Hk, dHk, PHT, dPHT) + dRk
+	dSk_inv = -np.einsum('...ij,...jkn,...kl->...iln', Sk_inv, dSk, Sk_inv)
+	dKk = d_dot(PHT, dPHT, Sk_inv, dSk_inv)
+
+	dxk = np.einsum('...ijn,...j->...in', dKk, yk) + np.einsum('...ij,...jn->...in', Kk, dyk)
+
+	I_KH = np.eye(Pk_minus.shape[-1]) - np.matmul(Kk, Hk)
+	dI_KH = -d_dot(Kk, dKk, Hk, dHk)
+	dPk = d_dot(I_KH, dI_KH, Pk_minus, dPk_minus)
+	return dxk, dPk
+
+
+def d_poisson_log_lhood(predictions, observations, d_predictions):
+	""" Derivative of the summed Poisson log likelihood of the observations.
+	"""
+	observations = np.asarray(observations)
+	return np.tensordot(observations / predictions - 1, d_predictions, axes=observations.ndim)
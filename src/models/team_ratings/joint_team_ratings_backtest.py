@@ -0,0 +1,15 @@
+from src.models.team_ratings.joint_team_ratings import CORRELATION_TOL, JointTeamRatings
+from src.models.team_ratings.team_ratings_backtest import TeamRatingsBacktest
+
+
+class JointTeamRatingsBacktest(TeamRatingsBacktest):
+	""" TeamRatingsBacktest with the joint team filter, which does not propagate sensitivities.
+	"""
+
+	def __init__(self, params, home_goals, away_goals, home_ids, away_ids, groupby_dict, sensitivity_params=None,
+				 record_gameweeks=False, correlation_tol=CORRELATION_TOL):
+		if sensitivity_params is not None:
+			raise ValueError('The joint team filter does not propagate sensitivities')
+		super().__init__(params, home_goals, away_goals, home_ids, away_ids, groupby_dict,
+						 record_gameweeks=record_gameweeks)
+		self.team_ratings = JointTeamRatings(params, correlation_tol)
@@ -3,39 +3,36 @@ from collections import defaultdict
 
 import numpy as np
 
-from src.utils import vcalc_poisson_lhood
+from src.models.ekf import ExtendedKalmanFilter
+from src.models.sensitivities import d_diag, d_kalman_update, d_poisson_log_lhood, unit_sensitivity
+from src.profiler import profiler
+from src.tuners.tuner_params import get_param
 
 
-class LeagueRatings:
+class LeagueRatings(ExtendedKalmanFilter):
 
-	def __init__(self, params):
+	def __init__(self, params, sensitivity_params=None):
+		super().__init__()
 		self.current_ratings = {}
 		self.historical_ratings = defaultdict(lambda: defaultdict(dict))
 		self.params = params
 
-		# -- hidden state variables -- #
-		self.xk_minus = None
-		self.xk = None
-		self.Qk = None
-		self.Pk_minus = None
-		self.Pk = None
-
-		# -- observation state variables -- #
-		self.observations = None
-		self.predictions = None
-		self.yk = None
-		self.Rk = None
-		self.Hk = None
-		self.Sk = None
-		self.Kk = None
-
 		self.x0 = None
-		self.Qk = self.params['league_rating_variance']
+		self.Qk = get_param(self.params, 'league_rating_variance')
+		self.home_init = get_param(self.params, 'league_home_init')
+		self.away_init = get_param(self.params, 'league_away_init')
+		self.home_variance_init = get_param(self.params, 'league_home_variance_init')
+		self.away_variance_init = get_param(self.params, 'league_away_variance_init')
 		# self.P0 = self.params['team_initial_error_var']
 
-		# -- lhood tracking -- #
-		self.tot_log_lhood = 0
-		self.n_observations = 0
+		# -- bumped on every update, so that predictions cached against the ratings know when they are stale -- #
+		self.version = 0
+
+		# -- forward-mode sensitivities wrt sensitivity_params -- #
+		self.sensitivity_params = sensitivity_params
+		if self.sensitivity_params is not None:
+			self.current_sensitivities = {}
+			self.d_tot_log_lhood = np.zeros(len(self.sensitivity_params))
 
 	def _update_current_ratings(self, home, away, home_var, away_var):
 		self.current_ratings['home'] = home
@@ -43,6 +40,13 @@ class LeagueRatings:
 		self.current_ratings['home_var'] = home_var
 		self.current_ratings['away_var'] = away_var
 
+	def _update_current_sensitivities(self, d_home, d_away, d_home_var, d_away_var):
+		# keyed exactly as current_ratings so that these always follow whichever ratings get_ratings() returns
+		self.current_sensitivities['home'] = d_home
+		self.current_sensitivities['away'] = d_away
+		self.current_sensitivities['home_var'] = d_home_var
+		self.current_sensitivities['away_var'] = d_away_var
+
 	def _update_historical_ratings(self, team_id, gameweek, attack, defence, variance, r_type, ishome):
 		pass
 
@@ -53,37 +57,84 @@ class LeagueRatings:
 			home_var = self.current_ratings['home_variance']
 			away_var = self.current_ratings['away_variance']
 		except KeyError:
-			home = self.params['league_home_init']
-			away = self.params['league_away_init']
-			home_var = self.params['league_home_variance_init']
-			away_var = self.params['league_away_variance_init']
+			home = self.home_init
+			away = self.away_init
+			home_var = self.home_variance_init
+			away_var = self.away_variance_init
 
 		return home, away, home_var, away_var
 
-	def run_update_step(self, home_att, home_def, away_att, away_def, home_goals, away_goals, gw):
+	def get_sensitivities(self):
+		""" Returns the derivatives of each of the values that get_ratings() returns.
+		"""
+		try:
+			d_home = self.current_sensitivities['home']
+			d_away = self.current_sensitivities['away']
+			d_home_var = self.current_sensitivities['home_variance']
+			d_away_var = self.current_sensitivities['away_variance']
+		except KeyError:
+			d_home = unit_sensitivity(self.sensitivity_params, 'league_home_init')
+			d_away = unit_sensitivity(self.sensitivity_params, 'league_away_init')
+			d_home_var = unit_sensitivity(self.sensitivity_params, 'league_home_variance_init')
+			d_away_var = unit_sensitivity(self.sensitivity_params, 'league_away_variance_init')
+
+		return d_home, d_away, d_home_var, d_away_var
+
+	def run_update_step(self, home_att, home_def, away_att, away_def, home_goals, away_goals, gw, d_team_ratings=None):
 		l_h, l_a, l_h_var, l_a_var = self.get_ratings()
+		if self.sensitivity_params is not None:
+			d_l_h, d_l_a, d_l_h_var, d_l_a_var = self.get_sensitivities()
 
 		# -- predict -- #
 		self.xk_minus = np.array([l_h, l_a])
 		self.Pk_minus = np.diag([l_h_var, l_a_var])
 
 		# -- update -- #
-		self.Hk = self._generate_Hk(home_att, home_def, away_att, away_def)
-		self.predictions = np.dot(self.Hk, self.xk_minus)
-		self.Rk = np.diag(self.predictions)
-		self.observations = np.array([home_goals, away_goals]).T.ravel()
-		self.yk = self.observations - self.predictions
-		self.Sk = np.dot(np.dot(self.Hk, self.Pk_minus), self.Hk.T) + self.Rk
-		self.Kk = np.dot(np.dot(self.Pk_minus, self.Hk.T), np.linalg.inv(self.Sk))
-
-		self.xk = self.xk_minus + np.dot(self.Kk, self.yk)
-		self.Pk = (np.eye(2) - np.dot(self.Kk, self.Hk)).dot(self.Pk_minus)
-
-		log_lhoods = np.log(vcalc_poisson_lhood(self.predictions, self.observations))
-		self.tot_log_lhood += np.sum(log_lhoods)
-		self.n_observations += len(log_lhoods)
+		self._run_ekf_update(np.array([home_goals, away_goals]).T.ravel(), home_att, home_def, away_att, away_def)
 
 		self._update_current_ratings(*self.xk, *np.diag(self.Pk))
+		self.version += 1
+
+		if self.sensitivity_params is not None:
+			self._propagate_sensitivities(
+				home_att, home_def, away_att, away_def,
+				np.array([d_l_h, d_l_a]),
+				np.array([d_l_h_var, d_l_a_var]),
+				d_team_ratings
+			)
+
+	def _propagate_sensitivities(self, home_att, home_def, away_att, away_def, d_xk_minus, d_prior_vars, d_team_ratings):
+		""" Pushes the derivatives of the league state and of the team ratings (home_att, home_def, away_att,
+			away_def, each of shape (n_matches, n)) through the update step just run.
+		"""
+		d_home_att, d_home_def, d_away_att, d_away_def = d_team_ratings
+		n_matches, n_params = d_home_att.shape
+
+		dHk = np.zeros((2 * n_matches, 2, n_params))
+		dHk[0::2, 0] = d_home_att * away_def[:, None] + home_att[:, None] * d_away_def
+		dHk[1::2, 1] = d_home_def * away_att[:, None] + home_def[:, None] * d_away_att
+
+		d_predictions = np.einsum('ijn,j->in', dHk, self.xk_minus) + np.dot(self.Hk, d_xk_minus)
+
+		d_update, dPk = d_kalman_update(
+			Pk_minus=self.Pk_minus,
+			dPk_minus=d_diag(d_prior_vars),
+			Hk=self.Hk,
+			dHk=dHk,
+			Sk=self.Sk,
+			dRk=d_diag(d_predictions),
+			Kk=self.Kk,
+			yk=self.yk,
+			dyk=-d_predictions,
+		)
+		d_xk = d_xk_minus + d_update
+
+		self._update_current_sensitivities(*d_xk, *np.diagonal(dPk).T)
+
+		self.d_tot_log_lhood += d_poisson_log_lhood(self.predictions, self.observations, d_predictions)
+
+	def _predict(self, *team_ratings):
+		return np.dot(self.Hk, self.xk_minus)
 
 	def _generate_Hk(self, home_att, home_def, away_att, away_def):
 		home_ratings = np.array([home_att * away_def, np.zeros(len(home_att))]).T.ravel()
@@ -94,3 +145,11 @@ class LeagueRatings:
 	def likelihood(self):
 		return math.exp(self.tot_log_lhood / self.n_observations)
 
+
+profiler.instrument(LeagueRatings, dict(
+	get_ratings='league state read',
+	run_update_step='league update step',
+	_generate_Hk='league predict',
+	_update_current_ratings='league state write',
+	_propagate_sensitivities='league sensitivities',
+))
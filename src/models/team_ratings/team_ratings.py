@@ -3,39 +3,51 @@ from collections import defaultdict
 
 import numpy as np
 
-from src.utils import vcalc_poisson_lhood
+from src.models.ekf import ExtendedKalmanFilter, stacked_diag
+from src.models.sensitivities import d_diag, d_kalman_update, d_poisson_log_lhood, unit_sensitivity
+from src.profiler import profiler
+from src.tuners.tuner_params import get_param
 
 
-class TeamRatings:
+class TeamRatings(ExtendedKalmanFilter):
 
-	def __init__(self, params):
+	def __init__(self, params, sensitivity_params=None):
+		super().__init__()
 		self.current_ratings = defaultdict(dict)
 		self.historical_ratings = defaultdict(dict)
 		self.params = params
 
-		# -- hidden state variables -- #
-		self.xk_minus = None
-		self.xk = None
-		self.Qk = None
-		self.Pk_minus = None
-		self.Pk = None
-
-		# -- observation state variables -- #
-		self.observations = None
-		self.predictions = None
-		self.yk = None
-		self.Rk = None
-		self.Hk = None
-		self.Sk = None
-		self.Kk = None
-
 		self.x0 = None
-		self.Qk = self.params['team_rating_variance'] ** 2
+		rating_variance = get_param(self.params, 'team_rating_variance')
+		self.Qk = rating_variance ** 2
 		# self.P0 = self.params['team_initial_error_var']
 
-		# -- lhood tracking -- #
-		self.tot_log_lhood = 0
-		self.n_observations = 0
+		# -- initial variances for teams we haven't seen yet -- #
+		away_att_var = get_param(self.params, 'team_initial_away_att_rating_var')
+		away_def_var = get_param(self.params, 'team_initial_away_def_rating_var')
+		self.h_att_var_init = get_param(self.params, 'team_initial_home_att_rating_var')
+		self.h_def_var_init = get_param(self.params, 'team_initial_home_def_rating_var')
+		self.a_att_var_init = away_att_var ** 2
+		self.a_def_var_init = away_def_var ** 2
+
+		# -- bumped on every update, so that predictions cached against the ratings know when they are stale -- #
+		self.version = 0
+
+		# -- forward-mode sensitivities wrt sensitivity_params -- #
+		self.sensitivity_params = sensitivity_params
+		if self.sensitivity_params is not None:
+			self.current_sensitivities = defaultdict(dict)
+			self.d_tot_log_lhood = np.zeros(len(self.sensitivity_params))
+			self.d_xk_minus = None
+			self.dQk = unit_sensitivity(self.sensitivity_params, 'team_rating_variance', 2 * rating_variance)
+			self.d_h_var_init = np.array([
+				unit_sensitivity(self.sensitivity_params, 'team_initial_home_att_rating_var'),
+				unit_sensitivity(self.sensitivity_params, 'team_initial_home_def_rating_var'),
+			])
+			self.d_a_var_init = np.array([
+				unit_sensitivity(self.sensitivity_params, 'team_initial_away_att_rating_var', 2 * away_att_var),
+				unit_sensitivity(self.sensitivity_params, 'team_initial_away_def_rating_var', 2 * away_def_var),
+			])
 
 	def _update_current_ratings(self, team_id, att_rat, def_rat, att_var, def_var, ishome):
 		ha = 'h' if ishome else 'a'
@@ -61,8 +73,8 @@ class TeamRatings:
 		except KeyError:
 			h_att = 1  # self.params['team_initial_home_att_rating']
 			h_def = 1  # self.params['team_initial_home_def_rating']
-			h_att_var = self.params['team_initial_home_att_rating_var']
-			h_def_var = self.params['team_initial_home_def_rating_var']
+			h_att_var = self.h_att_var_init
+			h_def_var = self.h_def_var_init
 
 		try:
 			a_att = self.current_ratings[a_id]['a_att_rating']
@@ -72,78 +84,141 @@ class TeamRatings:
 		except KeyError:
 			a_att = 1  # self.params['team_initial_away_att_rating']
 			a_def = 1  # self.params['team_initial_away_def_rating']
-			a_att_var = self.params['team_initial_away_att_rating_var'] ** 2
-			a_def_var = self.params['team_initial_away_def_rating_var'] ** 2
+			a_att_var = self.a_att_var_init
+			a_def_var = self.a_def_var_init
 
 		return h_att, h_def, a_att, a_def, h_att_var, h_def_var, a_att_var, a_def_var
 
-	def run_update_step(self, h_id, a_id, l_h, l_a, h_goals, a_goals, gw):
-		h_att, h_def, a_att, a_def, h_att_var, h_def_var, a_att_var, a_def_var = self.get_ratings(h_id, a_id)
+	def get_sensitivities(self, h_id, a_id):
+		""" Returns the derivatives of the ratings and variances that get_ratings() returns, each as a (4, n) array.
+		"""
+		try:
+			h_d_ratings, h_d_vars = self.current_sensitivities[h_id]['h']
+		except KeyError:
+			h_d_ratings = np.zeros((2, len(self.sensitivity_params)))
+			h_d_vars = self.d_h_var_init
+
+		try:
+			a_d_ratings, a_d_vars = self.current_sensitivities[a_id]['a']
+		except KeyError:
+			a_d_ratings = np.zeros((2, len(self.sensitivity_params)))
+			a_d_vars = self.d_a_var_init
+
+		return np.vstack([h_d_ratings, a_d_ratings]), np.vstack([h_d_vars, a_d_vars])
+
+	def run_update_step(self, h_ids, a_ids, l_h, l_a, h_goals, a_goals, gw, d_l_h=None, d_l_a=None):
+		""" Updates the ratings on a batch of a gameweek's matches, in none of which a team plays twice, leaving their
+			(matches x 4) priors in xk_minus (and their derivatives in d_xk_minus) and posteriors in xk.
+		"""
+		ratings = np.array([self.get_ratings(h_id, a_id) for h_id, a_id in zip(h_ids, a_ids)]).reshape(-1, 8)
+		if self.sensitivity_params is not None:
+			d_ratings, d_vars = zip(*[self.get_sensitivities(h_id, a_id) for h_id, a_id in zip(h_ids, a_ids)])
+			self.d_xk_minus, d_prior_vars = np.array(d_ratings), np.array(d_vars)
 
 		# -- predict -- #
-		self.xk_minus = np.array([h_att, h_def, a_att, a_def])
-		self.Pk_minus = np.diag(np.array([h_att_var, h_def_var, a_att_var, a_def_var]) + self.Qk)
+		self.xk_minus = ratings[:, :4]
+		self.Pk_minus = stacked_diag(ratings[:, 4:] + self.Qk)
 
-		self._update_historical_ratings(h_id, gw, h_att, h_def, 'prior', True)
-		self._update_historical_ratings(a_id, gw, a_att, a_def, 'prior', False)
+		for h_id, a_id, (h_att, h_def, a_att, a_def) in zip(h_ids, a_ids, self.xk_minus):
+			self._update_historical_ratings(h_id, gw, h_att, h_def, 'prior', True)
+			self._update_historical_ratings(a_id, gw, a_att, a_def, 'prior', False)
 
 		# -- update -- #
-		self.predictions = self._predict(l_h, l_a)
-		self.Rk = np.diag(self.predictions)
-		self.observations = np.array([h_goals, a_goals])
-		self.yk = self.observations - self.predictions
-
-		self.Hk = self._generate_Hk(l_h, l_a)
-		self.Sk = self.Hk.dot(self.Pk_minus).dot(self.Hk.T) + self.Rk
-		self.Kk = self.Pk_minus.dot(self.Hk.T).dot(np.linalg.inv(self.Sk))
-
-		self.xk = self.xk_minus + self.Kk.dot(self.yk)
-		self.Pk = (np.eye(4) - self.Kk.dot(self.Hk)).dot(self.Pk_minus)
-
-		h_att, h_def, a_att, a_def = self.xk
-		h_att_var, h_def_var, a_att_var, a_def_var = np.diag(self.Pk)
-
-		self._update_current_ratings(
-			team_id=h_id,
-			att_rat=h_att,
-			def_rat=h_def,
-			att_var=h_att_var,
-			def_var=h_def_var,
-			ishome=True
-		)
-		self._update_current_ratings(
-			team_id=a_id,
-			att_rat=a_att,
-			def_rat=a_def,
-			att_var=a_att_var,
-			def_var=a_def_var,
-			ishome=False
+		self._run_ekf_update(np.stack([h_goals, a_goals], axis=1), l_h, l_a)
+
+		posterior_vars = np.diagonal(self.Pk, axis1=1, axis2=2)
+		for h_id, a_id, (h_att, h_def, a_att, a_def), (h_att_var, h_def_var, a_att_var, a_def_var) in zip(
+				h_ids, a_ids, self.xk, posterior_vars):
+			self._update_current_ratings(
+				team_id=h_id,
+				att_rat=h_att,
+				def_rat=h_def,
+				att_var=h_att_var,
+				def_var=h_def_var,
+				ishome=True
+			)
+			self._update_current_ratings(
+				team_id=a_id,
+				att_rat=a_att,
+				def_rat=a_def,
+				att_var=a_att_var,
+				def_var=a_def_var,
+				ishome=False
+			)
+
+			self._update_historical_ratings(h_id, gw, h_att, h_def, 'posterior', True)
+			self._update_historical_ratings(a_id, gw, a_att, a_def, 'posterior', False)
+		self.version += 1
+
+		if self.sensitivity_params is not None:
+			self._propagate_sensitivities(h_ids, a_ids, l_h, l_a, d_l_h, d_l_a, self.d_xk_minus, d_prior_vars)
+
+	def _propagate_sensitivities(self, h_ids, a_ids, l_h, l_a, d_l_h, d_l_a, d_xk_minus, d_prior_vars):
+		""" Pushes the (matches x 4 x n) derivatives of the prior states through the update step just run, using the
+			intermediate quantities it left on self, and accumulates the derivative of the log likelihood.
+		"""
+		h_att, h_def, a_att, a_def = self.xk_minus.T[..., None]
+		d_h_att, d_h_def, d_a_att, d_a_def = d_xk_minus.transpose(1, 0, 2)
+
+		dPk_minus = d_diag(d_prior_vars + self.dQk)
+
+		d_predictions = np.stack([
+			l_h * a_def * d_h_att + h_att * a_def * d_l_h + h_att * l_h * d_a_def,
+			l_a * a_att * d_h_def + h_def * a_att * d_l_a + h_def * l_a * d_a_att,
+		], axis=1)
+
+		dHk = np.zeros(self.Hk.shape + (len(self.sensitivity_params),))
+		dHk[:, 0, 0] = a_def * d_l_h + l_h * d_a_def
+		dHk[:, 0, 3] = h_att * d_l_h + l_h * d_h_att
+		dHk[:, 1, 1] = a_att * d_l_a + l_a * d_a_att
+		dHk[:, 1, 2] = h_def * d_l_a + l_a * d_h_def
+
+		d_update, dPk = d_kalman_update(
+			Pk_minus=self.Pk_minus,
+			dPk_minus=dPk_minus,
+			Hk=self.Hk,
+			dHk=dHk,
+			Sk=self.Sk,
+			dRk=d_diag(d_predictions),
+			Kk=self.Kk,
+			yk=self.yk,
+			dyk=-d_predictions,
 		)
+		d_xk = d_xk_minus + d_update
+		d_posterior_vars = np.diagonal(dPk, axis1=1, axis2=2).transpose(0, 2, 1)
 
-		self._update_historical_ratings(h_id, gw, h_att, h_def, 'posterior', True)
-		self._update_historical_ratings(a_id, gw, a_att, a_def, 'posterior', False)
+		for h_id, a_id, d_x, d_vars in zip(h_ids, a_ids, d_xk, d_posterior_vars):
+			self.current_sensitivities[h_id]['h'] = (d_x[:2], d_vars[:2])
+			self.current_sensitivities[a_id]['a'] = (d_x[2:], d_vars[2:])
 
-		log_lhoods = np.log(vcalc_poisson_lhood(self.predictions, self.observations))
-		self.tot_log_lhood += np.sum(log_lhoods)
-		self.n_observations += len(log_lhoods)
+		self.d_tot_log_lhood += d_poisson_log_lhood(self.predictions, self.observations, d_predictions)
 
 	def _predict(self, l_h, l_a):
-		h_att, h_def, a_att, a_def = self.xk_minus
-		return np.array([
+		h_att, h_def, a_att, a_def = self.xk_minus.T
+		return np.stack([
 			h_att * l_h * a_def,
 			h_def * l_a * a_att,
-		])
+		], axis=-1)
 
 	def _generate_Hk(self, l_h, l_a):
-		h_att, h_def, a_att, a_def = self.xk_minus
-		return np.array([
-			[l_h * a_def, 0, 0, l_h * h_att],
-			[0, l_a * a_att, l_a * h_def, 0]
-		])
+		h_att, h_def, a_att, a_def = self.xk_minus.T
+		Hk = np.zeros(self.xk_minus.shape[:-1] + (2, 4))
+		Hk[..., 0, 0] = l_h * a_def
+		Hk[..., 0, 3] = l_h * h_att
+		Hk[..., 1, 1] = l_a * a_att
+		Hk[..., 1, 2] = l_a * h_def
+		return Hk
 
 	@property
 	def likelihood(self):
 		return math.exp(self.tot_log_lhood / self.n_observations)
 
 
-
+profiler.instrument(TeamRatings, dict(
+	get_ratings='team state read',
+	run_update_step='team update step',
+	_predict='team predict',
+	_update_current_ratings='team state write',
+	_update_historical_ratings='team history write',
+	_propagate_sensitivities='team sensitivities',
+))
@@ -6,18 +6,28 @@ import pandas as pd
 # from src.load.load import load
 from src.models.team_ratings.team_ratings import TeamRatings
 from src.models.team_ratings.league_ratings import LeagueRatings
+from src.profiler import profiler
 from src.tuners.tuner_params import load_params
 
 
 class TeamRatingsBacktest:
 
-	def __init__(self, params, home_goals, away_goals, home_ids, away_ids, groupby_dict):
+	def __init__(self, params, home_goals, away_goals, home_ids, away_ids, groupby_dict, sensitivity_params=None,
+				 record_gameweeks=False):
+		""" If sensitivity_params (a sequence of parameter names) is supplied, the derivatives of the ratings,
+			variances and log likelihoods with respect to those parameters are propagated alongside the filters, so
+			that cost_gradient is available after a single run of the backtest.
+
+			If record_gameweeks is True, the log likelihood and number of observations are also totalled per
+			gameweek, for use by window_log_lhood.
+		"""
 		self.home_goals = home_goals
 		self.away_goals = away_goals
 		self.home_ids = home_ids
 		self.away_ids = away_ids
-		self.team_ratings = TeamRatings(params)
-		self.league_ratings = LeagueRatings(params)
+		self.sensitivity_params = None if sensitivity_params is None else tuple(sensitivity_params)
+		self.team_ratings = TeamRatings(params, self.sensitivity_params)
+		self.league_ratings = LeagueRatings(params, self.sensitivity_params)
 		self.groupby_dict = groupby_dict
 		self.groupby_list = sorted(self.groupby_dict.keys())
 
@@ -25,6 +35,15 @@ class TeamRatingsBacktest:
 		self.n_team_obs = None
 		self.cum_league_log_lhood = None
 		self.n_league_obs = None
+		self.d_cum_team_log_lhood = None
+		self.d_cum_league_log_lhood = None
+
+		# -- per gameweek (team + league) log likelihoods, for scoring windows of the season -- #
+		self.record_gameweeks = record_gameweeks
+		self.gw_log_lhoods = {}
+		self.gw_n_obs = {}
+		self._recorded_log_lhood = 0
+		self._recorded_n_obs = 0
 
 	def run_backtest(self):
 		for gw in self.groupby_list:
@@ -35,43 +54,51 @@ class TeamRatingsBacktest:
 			gw_a_ids = self.away_ids[gw_ind]
 
 			l_h, l_a, _, __ = self.league_ratings.get_ratings()
-
-			home_att_ratings = []
-			home_def_ratings = []
-			away_att_ratings = []
-			away_def_ratings = []
-
-			for h_goals, a_goals, h_id, a_id in zip(gw_h_goals, gw_a_goals, gw_h_ids, gw_a_ids):
-				h_att, h_def, a_att, a_def, h_att_var, h_def_var, a_att_var, a_def_var = \
-					self.team_ratings.get_ratings(h_id, a_id)
-
-				home_att_ratings.append(h_att)
-				home_def_ratings.append(h_def)
-				away_att_ratings.append(a_att)
-				away_def_ratings.append(a_def)
-
-				self.team_ratings.run_update_step(h_id, a_id, l_h, l_a, h_goals, a_goals, gw)
-
-			home_att_ratings = np.array(home_att_ratings)
-			home_def_ratings = np.array(home_def_ratings)
-			away_att_ratings = np.array(away_att_ratings)
-			away_def_ratings = np.array(away_def_ratings)
+			d_l_h = d_l_a = None
+			if self.sensitivity_params is not None:
+				d_l_h, d_l_a, _, __ = self.league_ratings.get_sensitivities()
+
+			# -- each match's prior team ratings, as the league update takes them -- #
+			priors = np.zeros((len(gw_ind), 4))
+			d_priors = np.zeros((len(gw_ind), 4, len(self.sensitivity_params or ())))
+			for wave in _waves(gw_h_ids, gw_a_ids):
+				self.team_ratings.run_update_step(
+					gw_h_ids[wave], gw_a_ids[wave], l_h, l_a, gw_h_goals[wave], gw_a_goals[wave], gw, d_l_h, d_l_a)
+				priors[wave] = self.team_ratings.xk_minus
+				if self.sensitivity_params is not None:
+					d_priors[wave] = self.team_ratings.d_xk_minus
 
 			self.league_ratings.run_update_step(
-				home_att_ratings,
-				home_def_ratings,
-				away_att_ratings,
-				away_def_ratings,
+				*priors.T,
 				gw_h_goals,
 				gw_a_goals,
-				gw
+				gw,
+				d_priors.transpose(1, 0, 2) if self.sensitivity_params is not None else None
 			)
 
+			if self.record_gameweeks:
+				self._record_gameweek(gw)
+
 		# -- store likelihoods -- #
 		self.cum_team_log_lhood = self.team_ratings.tot_log_lhood
 		self.n_team_obs = self.team_ratings.n_observations
 		self.cum_league_log_lhood = self.league_ratings.tot_log_lhood
 		self.n_league_obs = self.league_ratings.n_observations
+		if self.sensitivity_params is not None:
+			self.d_cum_team_log_lhood = self.team_ratings.d_tot_log_lhood
+			self.d_cum_league_log_lhood = self.league_ratings.d_tot_log_lhood
+
+	def _record_gameweek(self, gw):
+		log_lhood = self.team_ratings.tot_log_lhood + self.league_ratings.tot_log_lhood
+		n_obs = self.team_ratings.n_observations + self.league_ratings.n_observations
+		self.gw_log_lhoods[gw] = log_lhood - self._recorded_log_lhood
+		self.gw_n_obs[gw] = n_obs - self._recorded_n_obs
+		self._recorded_log_lhood, self._recorded_n_obs = log_lhood, n_obs
+
+	def window_log_lhood(self, gameweeks):
+		""" Returns the total log likelihood and number of observations over the given gameweeks.
+		"""
+		return sum(self.gw_log_lhoods[gw] for gw in gameweeks), sum(self.gw_n_obs[gw] for gw in gameweeks)
 
 	@property
 	def team_prop(self):
@@ -88,6 +115,33 @@ class TeamRatingsBacktest:
 		cost = math.exp(self.team_prop * team_cost + self.league_prop * league_cost)
 		return cost
 
+	@property
+	def cost_gradient(self):
+		""" Exact gradient of cost wrt the sensitivity params. As the cost is the exponential of the total log
+			likelihood divided by the total number of observations, this is just a rescaling of the summed
+			log likelihood derivatives.
+		"""
+		if self.sensitivity_params is None:
+			raise ValueError('Backtest was run without sensitivity_params, so has no gradient')
+		d_log_lhood = self.d_cum_team_log_lhood + self.d_cum_league_log_lhood
+		return self.cost * d_log_lhood / (self.n_team_obs + self.n_league_obs)
+
+
+def _waves(home_ids, away_ids):
+	""" Splits a gameweek's matches into waves in which no team plays twice, a match going in the wave after the last
+		one with an earlier match of either of its teams, so that updating the filter a wave at a time is the same as
+		updating it a match at a time.
+	"""
+	last_wave = {}
+	waves = np.zeros(len(home_ids), dtype=int)
+	for i, (h_id, a_id) in enumerate(zip(home_ids, away_ids)):
+		waves[i] = max(last_wave.get(h_id, -1), last_wave.get(a_id, -1)) + 1
+		last_wave[h_id] = last_wave[a_id] = waves[i]
+	return [np.flatnonzero(waves == wave) for wave in range(waves.max() + 1 if len(waves) else 0)]
+
+
+profiler.instrument(TeamRatingsBacktest, dict(run_backtest='team backtest'))
+
 
 # def run_backtest():
 # 	data = load()['match_scores']
@@ -117,4 +171,4 @@ class TeamRatingsBacktest:
 #
 # if __name__ == '__main__':
 #
-# 	run_backtest()
\ No newline at end of file
+# 	run_backtest()
@@ -6,6 +6,11 @@ paths = dict(
 	# output='output/',
 	logging_base='logging/',
 	plots='analysis/plots',
+	benchmarks='benchmarks/',
+	team_kf_params='params/team_kf_params.py',
+	league_kf_params='params/league_kf_params.py',
+	player_goal_params='params/player_goal_params.py',
+	player_assist_params='params/player_assist_params.py',
 )
 # Make the paths dictionary relative to root
 paths = {k: project_directory + v for k, v in paths.items()}
\ No newline at end of file
@@ -0,0 +1,190 @@
+""" A hierarchical profiler. Spans nest, and each distinct path of span names accumulates a call count, cumulative
+	time, self time (cumulative less that of its children) and, optionally, the peak traced memory above what was
+	allocated when the span was entered.
+
+	Spans come from utils.timer blocks, from `profiler.span`, and from methods registered with `profiler.instrument`,
+	which are only wrapped while the profiler is enabled, so that instrumenting hot backtest code costs nothing
+	otherwise. The profiler only sees the process it is enabled in, not pool workers.
+"""
+import functools
+import json
+import time
+import tracemalloc
+
+from src.logger import logger, validate_path
+
+
+class _Node:
+
+	def __init__(self):
+		self.calls = 0
+		self.cumulative = 0.
+		self.peak_memory = 0
+		self.children = {}
+
+	@property
+	def self_time(self):
+		return self.cumulative - sum(child.cumulative for child in self.children.values())
+
+	def to_dict(self, with_memory):
+		output = dict(calls=self.calls, cumulative=self.cumulative, self=self.self_time)
+		if with_memory:
+			output.update(peak_memory=self.peak_memory)
+		output.update(children={name: child.to_dict(with_memory) for name, child in self.children.items()})
+		return output
+
+
+class _NullSpan:
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+
+	def __init__(self, profiler, name):
+		self.profiler = profiler
+		self.name = name
+
+	def __enter__(self):
+		self.profiler.push(self.name)
+		return self
+
+	def __exit__(self, *args):
+		self.profiler.pop()
+		return False
+
+
+class Profiler:
+
+	def __init__(self):
+		self.enabled = False
+		self.trace_memory = False
+		self.root = _Node()
+		self._stack = []
+		self._instrumented = []
+		self._originals = {}
+
+	def enable(self, trace_memory=False):
+		""" Starts recording spans (and, with trace_memory, tracemalloc peaks, which slows everything down a lot), and
+			wraps the registered methods.
+		"""
+		if self.enabled:
+			return
+		self.enabled = True
+		self.trace_memory = trace_memory
+		if trace_memory and not tracemalloc.is_tracing():
+			tracemalloc.start()
+		self._stack = [[self.root, None, 0, 0]]
+		for cls, method_name, span_name in self._instrumented:
+			self._wrap(cls, method_name, span_name)
+
+	def disable(self):
+		if not self.enabled:
+			return
+		for (cls, method_name), original in self._originals.items():
+			setattr(cls, method_name, original)
+		self._originals = {}
+		if self.trace_memory:
+			tracemalloc.stop()
+		self.enabled = False
+
+	def reset(self):
+		self.root = _Node()
+		self._stack = [[self.root, None, 0, 0]] if self.enabled else []
+
+	def span(self, name):
+		""" A context manager recording a span called name, or a do-nothing one while the profiler is disabled.
+		"""
+		return _Span(self, name) if self.enabled else NULL_SPAN
+
+	def instrument(self, cls, spans):
+		""" Registers methods of cls ({method name: span name}) to be recorded as spans whenever the profiler is
+			enabled.
+		"""
+		for method_name, span_name in spans.items():
+			self._instrumented.append((cls, method_name, span_name))
+			if self.enabled:
+				self._wrap(cls, method_name, span_name)
+
+	def _wrap(self, cls, method_name, span_name):
+		if (cls, method_name) in self._originals:
+			return
+		original = cls.__dict__[method_name]
+		profiler = self
+
+		@functools.wraps(original)
+		def wrapped(*args, **kwargs):
+			profiler.push(span_name)
+			try:
+				return original(*args, **kwargs)
+			finally:
+				profiler.pop()
+
+		self._originals[(cls, method_name)] = original
+		setattr(cls, method_name, wrapped)
+
+	def push(self, name):
+		parent = self._stack[-1]
+		node = parent[0].children.get(name)
+		if node is None:
+			node = parent[0].children[name] = _Node()
+
+		start_memory = peak_memory = 0
+		if self.trace_memory:
+			start_memory, peak_memory = tracemalloc.get_traced_memory()
+			# the parent's peak so far is kept aside, as the child resets the tracemalloc peak
+			parent[3] = max(parent[3], peak_memory)
+			tracemalloc.reset_peak()
+		self._stack.append([node, time.perf_counter(), start_memory, 0])
+
+	def pop(self):
+		node, start, start_memory, peak_memory = self._stack.pop()
+		node.calls += 1
+		node.cumulative += time.perf_counter() - start
+		if self.trace_memory:
+			peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1])
+			node.peak_memory = max(node.peak_memory, peak_memory - start_memory)
+			self._stack[-1][3] = max(self._stack[-1][3], peak_memory)
+
+	def to_dict(self):
+		return {name: child.to_dict(self.trace_memory) for name, child in self.root.children.items()}
+
+	def save_json(self, path):
+		validate_path(path)
+		with open(path, 'w') as file:
+			json.dump(self.to_dict(), file, indent=4)
+		logger.info('Saved profile to {}'.format(path))
+
+	def save_collapsed(self, path):
+		""" Writes one 'outer;inner;innermost <self time in microseconds>' line per span path, the collapsed-stack
+			format flame graph tools read.
+		"""
+		validate_path(path)
+		with open(path, 'w') as file:
+			for stack, node in self._walk(self.root, ()):
+				file.write('{} {}\n'.format(';'.join(stack), int(round(1e6 * node.self_time))))
+		logger.info('Saved collapsed stacks to {}'.format(path))
+
+	def log_summary(self, min_fraction=0.001):
+		total = sum(child.cumulative for child in self.root.children.values())
+		logger.info('{:60} {:>10} {:>12} {:>12}'.format('span', 'calls', 'cumulative', 'self'))
+		for stack, node in self._walk(self.root, ()):
+			if total and node.cumulative / total < min_fraction:
+				continue
+			logger.info('{:60} {:>10} {:>12.4f} {:>12.4f}'.format(
+				'  ' * (len(stack) - 1) + stack[-1], node.calls, node.cumulative, node.self_time))
+
+	def _walk(self, node, stack):
+		for name, child in node.children.items():
+			yield stack + (name,), child
+			yield from self._walk(child, stack + (name,))
+
+
+profiler = Profiler()
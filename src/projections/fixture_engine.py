@@ -0,0 +1,107 @@
+""" Predicted outcomes of fixtures from the current state of the team and league rating filters: each side's expected
+	goals as in TeamRatings._predict, and from them, taking the sides' goals as independent Poissons as the filters'
+	likelihood does, the scoreline probabilities, 1X2 probabilities and each side's chance of a clean sheet.
+
+	A scoreline matrix is truncated at max_goals, with its last row and column holding the probabilities of max_goals
+	or more, so that it sums to one, and the 1X2 probabilities are read off it (counting a side's max_goals or more
+	against the other's as a draw, which is negligible at the default). Each fixture's prediction is held in an LRU
+	cache keyed by the filters' versions, which every update bumps, so repeated queries are free until the next one.
+"""
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from scipy.stats import poisson
+
+from src.profiler import profiler
+
+MAX_GOALS = 10
+CACHE_SIZE = 10000
+
+FixturePredictions = namedtuple('FixturePredictions', [
+	'home_ids', 'away_ids', 'gameweeks', 'home_xg', 'away_xg', 'scorelines', 'home_win', 'draw', 'away_win',
+	'home_clean_sheet', 'away_clean_sheet'])
+
+
+class FixtureEngine:
+
+	def __init__(self, team_ratings, league_ratings, max_goals=MAX_GOALS, cache_size=CACHE_SIZE):
+		self.team_ratings = team_ratings
+		self.league_ratings = league_ratings
+		self.max_goals = max_goals
+		self.cache_size = cache_size
+		self.memory = OrderedDict()
+
+		self.hits = 0
+		self.misses = 0
+
+	def version(self):
+		return self.team_ratings.version, self.league_ratings.version
+
+	def predict(self, home_ids, away_ids, gameweeks=None):
+		""" Predictions for each fixture, with (fixtures x goals x goals) scorelines indexed by the home then the away
+			goals. The ratings do not move between updates, so the gameweeks are only carried through.
+		"""
+		home_ids, away_ids = np.asarray(home_ids), np.asarray(away_ids)
+		version = self.version()
+		keys = [(version, h_id, a_id) for h_id, a_id in zip(home_ids.tolist(), away_ids.tolist())]
+
+		found = {}
+		for key in dict.fromkeys(keys):
+			try:
+				found[key] = self.memory[key]
+			except KeyError:
+				continue
+			self.memory.move_to_end(key)
+		missing = [key for key in dict.fromkeys(keys) if key not in found]
+		self.hits += len(keys) - len(missing)
+		self.misses += len(missing)
+
+		if missing:
+			xg, scorelines = self.predict_fixtures([key[1] for key in missing], [key[2] for key in missing])
+			for key, fixture_xg, fixture_scorelines in zip(missing, xg.T, scorelines):
+				found[key] = fixture_xg, fixture_scorelines
+				self._remember(key, found[key])
+
+		rows = [found[key] for key in keys]
+		home_xg, away_xg = np.array([row[0] for row in rows]).reshape(-1, 2).T
+		scorelines = np.array([row[1] for row in rows]).reshape(-1, self.max_goals + 1, self.max_goals + 1)
+		return FixturePredictions(
+			home_ids, away_ids, None if gameweeks is None else np.asarray(gameweeks), home_xg, away_xg, scorelines,
+			np.tril(scorelines, -1).sum(axis=(1, 2)),
+			np.trace(scorelines, axis1=1, axis2=2),
+			np.triu(scorelines, 1).sum(axis=(1, 2)),
+			np.exp(-away_xg),
+			np.exp(-home_xg),
+		)
+
+	def predict_fixtures(self, home_ids, away_ids):
+		""" The (2 x fixtures) expected goals and the scoreline matrices of the fixtures, in one pass, reading each
+			team's ratings once.
+		"""
+		l_h, l_a, _, __ = self.league_ratings.get_ratings()
+		teams, index = np.unique(np.concatenate([home_ids, away_ids]), return_inverse=True)
+		# a team's home ratings, as the home side, and its away ratings, as the away side
+		ratings = np.array([self.team_ratings.get_ratings(team, team)[:4] for team in teams.tolist()]).reshape(-1, 4)
+		home_index, away_index = np.split(index, 2)
+		h_att, h_def = ratings[home_index, :2].T
+		a_att, a_def = ratings[away_index, 2:].T
+		xg = np.array([h_att * l_h * a_def, h_def * l_a * a_att])
+
+		goals = np.arange(self.max_goals + 1)
+		probabilities = poisson.pmf(goals, xg[..., None])
+		probabilities[..., -1] = poisson.sf(self.max_goals - 1, xg)
+		return xg, probabilities[0, :, :, None] * probabilities[1, :, None, :]
+
+	def summary(self):
+		n_lookups = self.hits + self.misses
+		return 'Fixture cache: {} hits, {} misses ({:.1f}% hit rate)'.format(
+			self.hits, self.misses, 100 * self.hits / n_lookups if n_lookups else 0.)
+
+	def _remember(self, key, value):
+		self.memory[key] = value
+		self.memory.move_to_end(key)
+		if len(self.memory) > self.cache_size:
+			self.memory.popitem(last=False)
+
+
+profiler.instrument(FixtureEngine, dict(predict_fixtures='fixture prediction'))
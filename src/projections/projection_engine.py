@@ -0,0 +1,154 @@
+""" Expected FPL points of every player over upcoming fixtures, from the current state of the rating filters. A
+	team's expected goals and chance of a clean sheet in a fixture come from the FixtureEngine, and a player's expected
+	goals and assists are their team's times their goal and assist ratings, which are their expected shares, less the
+	goals they assist but score themselves, which count as no one's assist:
+
+		player_xG = team_xG * player_goal_rating
+		player_xA = team_xG * assists_per_goal * player_assist_rating * (1 - player_goal_rating)
+
+	Everything is computed per (team, gameweek) and then broadcast to the players, so a double gameweek sums both
+	fixtures and a blank one is zero. The player ratings are shares of the team's goals while on the pitch, so each
+	player's projections are weighted by the probability that they play, which recent_appearance_rates estimates. The
+	filters rate each player on their own, so a team's expected shares on the pitch can add up to more than one, in
+	which case team_shares scales them down to one, as the GameweekSimulator does when it credits each goal.
+"""
+from collections import namedtuple
+
+import numpy as np
+from scipy.stats import poisson
+
+from src.profiler import profiler
+from src.projections.fixture_engine import FixtureEngine
+from src.projections.scoring import APPEARANCE_POINTS, ASSIST_POINTS, CLEAN_SHEET_POINTS, GOAL_POINTS, \
+	GOALS_CONCEDED_POINTS
+
+# roughly three in four goals are credited with an assist
+ASSISTS_PER_GOAL = 0.75
+
+Projections = namedtuple('Projections', ['pids', 'gameweeks', 'xg', 'xa', 'clean_sheets', 'goals_conceded', 'xfpl'])
+
+
+class ProjectionEngine:
+
+	def __init__(self, team_ratings, league_ratings, goal_ratings, assist_ratings, pid_to_pos,
+				 assists_per_goal=ASSISTS_PER_GOAL):
+		self.team_ratings = team_ratings
+		self.league_ratings = league_ratings
+		self.goal_ratings = goal_ratings
+		self.assist_ratings = assist_ratings
+		self.pid_to_pos = pid_to_pos
+		self.assists_per_goal = assists_per_goal
+		self.fixtures = FixtureEngine(team_ratings, league_ratings)
+
+	@classmethod
+	def from_backtests(cls, team_backtest, player_backtest, pid_to_pos, **kwargs):
+		""" An engine projecting from where a team and a player backtest finished.
+		"""
+		return cls(team_backtest.team_ratings, team_backtest.league_ratings, player_backtest.goal_ratings,
+				   player_backtest.assist_ratings, pid_to_pos, **kwargs)
+
+	def team_expectations(self, home_ids, away_ids):
+		""" Expected goals of the home and away sides of each fixture.
+		"""
+		predictions = self.fixtures.predict(home_ids, away_ids)
+		return predictions.home_xg, predictions.away_xg
+
+	def player_rates(self, pids):
+		""" Each player's position and their current goal and assist ratings, or their position's x0 if the filters
+			have not seen them.
+		"""
+		positions = np.array([self.pid_to_pos[pid] for pid in pids], dtype=int)
+		goal_rates = self.goal_ratings._get_player_data(pids, positions)[0]
+		assist_rates = self.assist_ratings._get_player_data(pids, positions)[0]
+		return positions, goal_rates, assist_rates
+
+	def project(self, pids, player_team_ids, home_ids, away_ids, gameweeks, play_probabilities=None):
+		""" Projects the players (with their current teams) over the given fixtures, returning (players x gameweeks)
+			matrices, with a column for each distinct gameweek of the fixtures, in order. Without play_probabilities,
+			every player is assumed to play every fixture.
+		"""
+		home_ids, away_ids, gameweeks = np.asarray(home_ids), np.asarray(away_ids), np.asarray(gameweeks)
+		predictions = self.fixtures.predict(home_ids, away_ids, gameweeks)
+		home_xg, away_xg = predictions.home_xg, predictions.away_xg
+
+		# -- per team and gameweek -- #
+		team_ids, team_index = np.unique(np.concatenate([home_ids, away_ids, player_team_ids]), return_inverse=True)
+		home_index, away_index, player_index = np.split(team_index, [len(home_ids), 2 * len(home_ids)])
+		gameweek_list, gw_index = np.unique(gameweeks, return_inverse=True)
+		shape = (len(team_ids), len(gameweek_list))
+
+		team_xg = np.zeros(shape)
+		team_clean_sheets = np.zeros(shape)
+		team_conceded_pairs = np.zeros(shape)
+		for index, scored, conceded, clean_sheets in ((home_index, home_xg, away_xg, predictions.home_clean_sheet),
+													  (away_index, away_xg, home_xg, predictions.away_clean_sheet)):
+			np.add.at(team_xg, (index, gw_index), scored)
+			np.add.at(team_clean_sheets, (index, gw_index), clean_sheets)
+			np.add.at(team_conceded_pairs, (index, gw_index), _expected_pairs(conceded))
+		team_fixtures = np.zeros(shape)
+		np.add.at(team_fixtures, (np.concatenate([home_index, away_index]), np.tile(gw_index, 2)), 1)
+
+		# -- per player -- #
+		positions, goal_rates, assist_rates = self.player_rates(pids)
+		plays = np.ones(len(pids)) if play_probabilities is None else np.asarray(play_probabilities, dtype=float)
+		goal_shares = team_shares(goal_rates, player_index, plays)
+		assist_shares = team_shares(self.assists_per_goal * assist_rates, player_index, plays)
+		xg = team_xg[player_index] * (plays * goal_shares)[:, None]
+		# the scorer and assister of a goal are drawn independently, and a player cannot assist their own goal
+		xa = team_xg[player_index] * (plays * assist_shares * (1 - goal_shares))[:, None]
+		clean_sheets = team_clean_sheets[player_index] * plays[:, None]
+		goals_conceded = team_conceded_pairs[player_index] * plays[:, None]
+
+		xfpl = (
+			APPEARANCE_POINTS * team_fixtures[player_index] * plays[:, None]
+			+ GOAL_POINTS[positions, None] * xg
+			+ ASSIST_POINTS[positions, None] * xa
+			+ CLEAN_SHEET_POINTS[positions, None] * clean_sheets
+			+ GOALS_CONCEDED_POINTS[positions, None] * goals_conceded
+		)
+		return Projections(np.asarray(pids), gameweek_list, xg, xa, clean_sheets, goals_conceded, xfpl)
+
+
+def team_shares(rates, team_index, plays):
+	""" The players' shares of their team's goals (or assists), scaled down for any team whose players' shares, each
+		weighted by the probability that they play, add up to more than one.
+	"""
+	expected = np.bincount(team_index, weights=plays * rates)
+	return rates / np.maximum(expected, 1.)[team_index]
+
+
+def _expected_pairs(rates, max_pairs=10):
+	""" E[floor(X / 2)] for X Poisson with the given rates, the expected number of two goal blocks conceded, as the sum
+		over k of P(X >= 2k).
+	"""
+	k = np.arange(1, max_pairs + 1)
+	return poisson.sf(2 * k - 1, np.asarray(rates)[..., None]).sum(axis=-1)
+
+
+def upcoming_fixtures(match_scores, gameweek, horizon):
+	""" The home ids, away ids and gameweeks of the loader's match_scores from gameweek for horizon gameweeks.
+	"""
+	upcoming = match_scores[(match_scores.gw >= gameweek) & (match_scores.gw < gameweek + horizon)]
+	return upcoming.home_id.values, upcoming.away_id.values, upcoming.gw.values
+
+
+def current_teams(all_player_data, gameweek=None):
+	""" Each player's id and team id as of their last row (before gameweek, if given) in the loader's player data.
+	"""
+	data = all_player_data if gameweek is None else all_player_data[all_player_data.gameweek < gameweek]
+	last = data.sort_values('gameweek', kind='mergesort').groupby('player_id').last()
+	return last.index.values, last.player_team_id.values.astype(int)
+
+
+def recent_appearance_rates(all_player_data, pids, player_team_ids, gameweek, n_gameweeks=6):
+	""" The fraction of their team's fixtures in the n_gameweeks before gameweek that each player has a row for in the
+		loader's player data, which only keeps rows where they played over 30 minutes.
+	"""
+	recent = all_player_data[(all_player_data.gameweek < gameweek) & (all_player_data.gameweek >= gameweek - n_gameweeks)]
+	team_fixtures = recent.drop_duplicates(['player_team_id', 'gameweek', 'opponent_team_id']).groupby('player_team_id').size()
+	appearances = recent.groupby('player_id').size()
+	rates = appearances.reindex(pids).fillna(0).values / team_fixtures.reindex(player_team_ids).fillna(np.inf).values
+	return np.minimum(rates, 1.)
+
+
+profiler.instrument(ProjectionEngine, dict(project='projection'))
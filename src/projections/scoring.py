@@ -0,0 +1,11 @@
+""" FPL points per event, by position id (1: gks, 2: def, 3: mid, 4: att). Each table is indexed by position id, so
+	that table[positions] gives the points of an array of players.
+"""
+import numpy as np
+
+APPEARANCE_POINTS = 2
+GOAL_POINTS = np.array([0, 6, 6, 5, 4])
+ASSIST_POINTS = np.array([0, 3, 3, 3, 3])
+CLEAN_SHEET_POINTS = np.array([0, 4, 4, 1, 0])
+# per two goals conceded
+GOALS_CONCEDED_POINTS = np.array([0, -1, -1, 0, 0])
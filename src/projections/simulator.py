@@ -0,0 +1,193 @@
+""" Monte Carlo distributions of a gameweek's FPL points, for the decisions (captaincy, differentials) that expected
+	points cannot make. Each simulation draws:
+
+		- every fixture's scoreline from a common shock bivariate Poisson, home = X1 + X3 and away = X2 + X3 with X3 a
+			shared Poisson(common_fraction * min(home xG, away xG)), which keeps the ProjectionEngine's expected goals
+			while correlating the sides' scores
+		- which of each team's players play, from their play probabilities
+		- the scorer of each goal from the players on the pitch, in proportion to their goal ratings, and with
+			probability assists_per_goal an assister in proportion to their assist ratings (shares that add up to less
+			than one leave the rest of the goals or assists to no one in the pool, and an assist drawn for the goal's
+			scorer goes to no one, as the ProjectionEngine's expected assists have it)
+
+	The shares are the ProjectionEngine's team_shares, so that the means agree with its expected points. Only when more
+	of a team's players are on the pitch than expected can their shares add up to more than one, and then they are
+	scaled down for that goal.
+
+	All draws are numpy arrays over (simulations x sides x players), a chunk of simulations at a time to bound memory,
+	and the chunks can be spread over a process pool. The points of each player are tallied into histograms, from which
+	the means and quantiles are read.
+"""
+from collections import namedtuple
+from multiprocessing import Pool
+
+import numpy as np
+
+from src.logger import logger
+from src.profiler import profiler
+from src.projections.projection_engine import team_shares
+from src.projections.scoring import APPEARANCE_POINTS, ASSIST_POINTS, CLEAN_SHEET_POINTS, GOAL_POINTS, \
+	GOALS_CONCEDED_POINTS
+
+# lowest and highest points tallied, outside of which a player's points are clipped
+MIN_POINTS, MAX_POINTS = -10, 60
+
+PointsDistribution = namedtuple('PointsDistribution', ['pids', 'points', 'histograms', 'mean', 'n_simulations'])
+
+
+class GameweekSimulator:
+
+	def __init__(self, engine, pids, player_team_ids, play_probabilities=None, common_fraction=0.1):
+		""" engine is a ProjectionEngine, from which the teams' expected goals and the players' ratings are taken.
+		"""
+		self.engine = engine
+		self.pids = np.asarray(pids)
+		self.common_fraction = common_fraction
+
+		positions, goal_rates, assist_rates = engine.player_rates(self.pids)
+		plays = np.ones(len(self.pids)) if play_probabilities is None else np.asarray(play_probabilities, dtype=float)
+
+		# each team's players padded out to the biggest squad, with no chance of playing in the padding, and an empty
+		# squad last for the teams without players in the pool
+		self.team_ids, team_index = np.unique(player_team_ids, return_inverse=True)
+		goal_rates = team_shares(goal_rates, team_index, plays)
+		assist_rates = team_shares(engine.assists_per_goal * assist_rates, team_index, plays)
+		squad_sizes = np.bincount(team_index, minlength=len(self.team_ids) + 1)
+		slot = np.zeros(len(self.pids), dtype=int)
+		order = np.argsort(team_index, kind='mergesort')
+		slot[order] = np.arange(len(order)) - np.repeat(np.cumsum(squad_sizes) - squad_sizes, squad_sizes)
+
+		shape = (len(self.team_ids) + 1, squad_sizes.max())
+		self.squad_players = np.full(shape, len(self.pids))
+		self.squad_players[team_index, slot] = np.arange(len(self.pids))
+		self.squad_plays = np.zeros(shape)
+		self.squad_plays[team_index, slot] = plays
+		self.squad_goal_rates = np.zeros(shape)
+		self.squad_goal_rates[team_index, slot] = goal_rates
+		self.squad_assist_rates = np.zeros(shape)
+		self.squad_assist_rates[team_index, slot] = assist_rates
+
+		# per squad slot points, with the padding's position being 0, which scores nothing
+		squad_positions = np.zeros(shape, dtype=int)
+		squad_positions[team_index, slot] = positions
+		self.squad_goal_points = GOAL_POINTS[squad_positions].astype(np.int16)
+		self.squad_assist_points = ASSIST_POINTS[squad_positions].astype(np.int16)
+		self.squad_clean_sheet_points = CLEAN_SHEET_POINTS[squad_positions].astype(np.int16)
+		self.squad_conceded_points = GOALS_CONCEDED_POINTS[squad_positions].astype(np.int16)
+
+	def __getstate__(self):
+		# the workers only need the squad arrays, not the filters behind the engine
+		state = dict(self.__dict__)
+		state['engine'] = None
+		return state
+
+	def simulate(self, home_ids, away_ids, n_simulations=100000, chunk_size=10000, n_processes=1, seed=0):
+		""" Simulates a gameweek's fixtures n_simulations times, in chunks of chunk_size simulations spread over
+			n_processes processes, returning each player's distribution of points.
+		"""
+		home_xg, away_xg = self.engine.team_expectations(home_ids, away_ids)
+		home_sides = np.searchsorted(self.team_ids, home_ids)
+		away_sides = np.searchsorted(self.team_ids, away_ids)
+		# teams without players in the pool still play, but with the empty squad, so no one scores points for them
+		home_sides = np.where(np.isin(home_ids, self.team_ids), home_sides, len(self.team_ids))
+		away_sides = np.where(np.isin(away_ids, self.team_ids), away_sides, len(self.team_ids))
+
+		chunks = [min(chunk_size, n_simulations - start) for start in range(0, n_simulations, chunk_size)]
+		seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+		jobs = [(self, home_xg, away_xg, home_sides, away_sides, n, s) for n, s in zip(chunks, seeds)]
+		if n_processes == 1:
+			histograms = sum(map(_simulate_chunk, jobs))
+		else:
+			with Pool(n_processes) as pool:
+				histograms = sum(pool.imap_unordered(_simulate_chunk, jobs))
+		logger.info('Simulated {} fixtures {} times in {} chunks'.format(len(home_xg), n_simulations, len(chunks)))
+
+		points = np.arange(MIN_POINTS, MAX_POINTS + 1)
+		return PointsDistribution(self.pids, points, histograms, histograms @ points / n_simulations, n_simulations)
+
+	def simulate_chunk(self, home_xg, away_xg, home_sides, away_sides, n_simulations, rng):
+		""" Points of every player in each of n_simulations simulations.
+		"""
+		n_fixtures = len(home_xg)
+
+		# -- scorelines -- #
+		common = self.common_fraction * np.minimum(home_xg, away_xg)
+		shared = rng.poisson(common, (n_simulations, n_fixtures))
+		home_goals = rng.poisson(home_xg - common, (n_simulations, n_fixtures)) + shared
+		away_goals = rng.poisson(away_xg - common, (n_simulations, n_fixtures)) + shared
+
+		# -- each side's squad -- #
+		sides = np.concatenate([home_sides, away_sides])
+		goals = np.concatenate([home_goals, away_goals], axis=1)
+		conceded = np.concatenate([away_goals, home_goals], axis=1)
+
+		def squad(array):
+			return array[sides][None, :, :]
+
+		played = rng.random_sample((n_simulations, len(sides), self.squad_plays.shape[1])) < squad(self.squad_plays)
+
+		# -- scorers and assisters of each goal -- #
+		goal_rows = np.repeat(np.arange(goals.size), goals.ravel())
+		goal_teams = np.tile(sides, n_simulations)[goal_rows]
+		on_pitch = played.reshape(-1, played.shape[-1])[goal_rows]
+		scorers = _draw_slots(on_pitch * self.squad_goal_rates[goal_teams], rng)
+		assisters = _draw_slots(on_pitch * self.squad_assist_rates[goal_teams], rng)
+		assisters[assisters == scorers] = -1
+
+		# -- points -- #
+		points = played * (
+			APPEARANCE_POINTS
+			+ squad(self.squad_clean_sheet_points) * (conceded == 0)[:, :, None]
+			+ squad(self.squad_conceded_points) * (conceded // 2).astype(np.int16)[:, :, None]
+		)
+
+		# a player's points summed over each of their fixtures, of which there are several in a double gameweek
+		points = points.reshape(n_simulations, -1)
+		totals = np.zeros((n_simulations, len(self.pids)), dtype=int)
+		side_players = self.squad_players[sides].ravel()
+		columns = np.arange(len(side_players))
+		while len(columns):
+			players, first = np.unique(side_players[columns], return_index=True)
+			in_pool = players < len(self.pids)
+			totals[:, players[in_pool]] += points[:, columns[first[in_pool]]]
+			columns = np.delete(columns, first)
+
+		goal_simulations = goal_rows // len(sides)
+		for slots, slot_points in ((scorers, self.squad_goal_points), (assisters, self.squad_assist_points)):
+			credited = slots >= 0
+			np.add.at(totals, (goal_simulations[credited], self.squad_players[goal_teams[credited], slots[credited]]),
+					  slot_points[goal_teams[credited], slots[credited]])
+		return totals
+
+	def quantiles(self, distribution, levels=(0.05, 0.25, 0.5, 0.75, 0.95)):
+		""" Each player's points quantiles at the given levels, as a (players x levels) array.
+		"""
+		cumulative = np.cumsum(distribution.histograms, axis=1) / distribution.n_simulations
+		return np.array([distribution.points[np.argmax(cumulative >= level, axis=1)] for level in levels]).T
+
+
+def _draw_slots(shares, rng):
+	""" For each goal, given the (goals x squad slots) shares of the players on the pitch for the team that scored
+		it, the squad slot of the player credited with it, or -1 for no one in the pool, which is where any shortfall
+		of the shares on one goes.
+	"""
+	cumulative = np.cumsum(shares, axis=1)
+	cumulative /= np.maximum(cumulative[:, -1:], 1.)
+	slots = np.sum(cumulative <= rng.random_sample(len(shares))[:, None], axis=1)
+	slots[slots == shares.shape[1]] = -1
+	return slots
+
+
+def _simulate_chunk(job):
+	simulator, home_xg, away_xg, home_sides, away_sides, n_simulations, seed = job
+	totals = simulator.simulate_chunk(
+		home_xg, away_xg, home_sides, away_sides, n_simulations, np.random.RandomState(seed.generate_state(1)))
+	totals = np.clip(totals, MIN_POINTS, MAX_POINTS) - MIN_POINTS
+
+	# a histogram row per player, of how many simulations they scored each number of points in
+	n_points = MAX_POINTS - MIN_POINTS + 1
+	index = np.arange(totals.shape[1])[None, :] * n_points + totals
+	return np.bincount(index.ravel(), minlength=totals.shape[1] * n_points).reshape(-1, n_points)
+
+
+profiler.instrument(GameweekSimulator, dict(simulate='gameweek simulation', simulate_chunk='simulation chunk'))
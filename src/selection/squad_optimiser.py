@@ -0,0 +1,412 @@
+""" Picks the FPL squad of 15 that maximises projected points under the budget, the position quotas and the limit of
+	three players per club, along with its starting eleven and captain. Each player is out, on the bench, starting or
+	captain, worth bench_weight, one and two times their points:
+
+		maximise   sum_i points_i * (bench_weight * squad_i + (1 - bench_weight) * starting_i + captain_i)
+		subject to squad quotas by position, starting formation bounds by position, price . squad <= budget,
+		           at most max_per_club squad players per club, captain_i <= starting_i <= squad_i, one captain
+
+	Before solving, players that cannot be in some optimal squad are dropped: a player is dominated when enough others
+	of their position are at least as good and no dearer that one of them could always be swapped in, which drops well
+	over half of a full pool (most of which barely plays). Two exact solvers then pick from the rest:
+
+		- milp, the integer program above solved by scipy's milp (scipy >= 1.9)
+		- branch_and_bound, which needs only numpy: without the club limit, the best squad is a dynamic programme over
+			whole prices, per position over each player's role and then across positions over the formations. With
+			each club's players charged a Lagrange multiplier, its value bounds the squads within the limit, and while
+			its squad breaks the limit, the search branches on which of the club's players is the first left out.
+"""
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from scipy import sparse
+from scipy.optimize import Bounds, LinearConstraint
+
+try:
+	from scipy.optimize import milp
+except ImportError:
+	milp = None
+
+from src.logger import logger
+from src.profiler import profiler
+
+# by position id (1: gks, 2: def, 3: mid, 4: att)
+SQUAD_QUOTAS = np.array([0, 2, 5, 5, 3])
+STARTING_MIN = np.array([0, 1, 3, 2, 1])
+STARTING_MAX = np.array([0, 1, 5, 5, 3])
+SQUAD_SIZE, STARTING_SIZE = 15, 11
+# in tenths of a million, as the fpl data's prices are
+BUDGET = 1000
+MAX_PER_CLUB = 3
+# the bench only scores for players that do not play, so is worth a fraction of its projected points
+BENCH_WEIGHT = 0.1
+# position tables the branch and bound solver keeps, each a few MB
+MAX_TABLES = 32
+
+# a player's roles in the dynamic programme
+OUT, BENCH, STARTING, CAPTAIN = range(4)
+
+Squad = namedtuple('Squad', ['pids', 'positions', 'starting', 'captain', 'points', 'cost', 'value'])
+
+
+class SquadOptimiser:
+
+	def __init__(self, pids, positions, team_ids, prices, points, budget=BUDGET, max_per_club=MAX_PER_CLUB,
+				 bench_weight=BENCH_WEIGHT):
+		""" points are each player's projected points over the horizon being picked for, e.g. their xfpl summed over
+			the ProjectionEngine's gameweeks.
+		"""
+		self.pids = np.asarray(pids)
+		self.positions = np.asarray(positions, dtype=int)
+		self.team_ids = np.asarray(team_ids)
+		self.prices = np.asarray(prices, dtype=float)
+		self.points = np.asarray(points, dtype=float)
+		self.budget = budget
+		self.max_per_club = max_per_club
+		self.bench_weight = bench_weight
+
+	@classmethod
+	def from_projections(cls, projections, pid_to_pos, player_team_ids, prices, gameweeks=None, **kwargs):
+		""" An optimiser over a ProjectionEngine's projections, with points summed over the given gameweeks, or all of
+			them.
+		"""
+		columns = slice(None) if gameweeks is None else np.isin(projections.gameweeks, gameweeks)
+		points = projections.xfpl[:, columns].sum(axis=1)
+		positions = [pid_to_pos[pid] for pid in projections.pids]
+		return cls(projections.pids, positions, player_team_ids, prices, points, **kwargs)
+
+	def solve(self, solver=None, include=(), exclude=(), prune=True):
+		""" The best squad, with the players in include forced into it and those in exclude left out. solver is
+			'milp' or 'branch_and_bound', by default milp if scipy has it.
+		"""
+		solver = solver or ('milp' if milp is not None else 'branch_and_bound')
+		if solver not in ('milp', 'branch_and_bound'):
+			raise ValueError('Unknown solver {}'.format(solver))
+		if solver == 'milp' and milp is None:
+			raise ValueError('The milp solver needs scipy >= 1.9')
+
+		forced = np.isin(self.pids, include)
+		candidates = np.flatnonzero(~np.isin(self.pids, exclude))
+		if prune:
+			candidates = candidates[self.undominated(candidates, forced[candidates])]
+
+		if solver == 'milp':
+			solution = self.solve_milp(candidates, forced[candidates])
+		else:
+			solution = self.solve_branch_and_bound(candidates, forced[candidates])
+		if solution is None:
+			raise ValueError('No squad satisfies the constraints')
+
+		logger.info('Picked a squad from {} of {} players with the {} solver'.format(
+			len(candidates), len(self.pids), solver))
+		return self.squad(*solution)
+
+	def solve_milp(self, candidates, forced):
+		""" The players, starters and captain (indices) of the best squad of the candidates, or None if there is none.
+		"""
+		n = len(candidates)
+		objective, constraints = self.program(candidates)
+		lower = np.concatenate([forced, np.zeros(2 * n)])
+		result = milp(-objective, constraints=constraints, integrality=np.ones(3 * n), bounds=Bounds(lower, 1),
+					  options=dict(mip_rel_gap=0))
+		if not result.success:
+			return None
+		squad, starting, captain = np.round(result.x).astype(bool).reshape(3, n)
+		return candidates[squad], candidates[starting], candidates[captain][0]
+
+	def solve_branch_and_bound(self, candidates, forced):
+		""" As solve_milp, by depth first branch and bound on the club limit over dynamic programme relaxations. The
+			relaxations charge each player their club's Lagrange multiplier, from club_multipliers, and credit
+			max_per_club of each back, which bounds the squads that keep to the limit much more tightly than dropping
+			it does. When a relaxation's squad has too many players of a club, those players are ordered and the k-th
+			branch leaves the k-th out and keeps the ones before it, so that the branches split the squads between
+			them. When it keeps to the limit but a club with room is still charged, the node is solved again without
+			that club's charge, until its bound is its squad's value.
+		"""
+		prices = np.round(self.prices).astype(int)
+		if not np.allclose(prices, self.prices):
+			raise ValueError('The branch and bound solver needs whole prices, such as the fpl data\'s tenths of a million')
+
+		clubs = np.unique(self.team_ids, return_inverse=True)[1]
+		tables = OrderedDict()
+		included = frozenset(candidates[forced])
+		root_multipliers = self.club_multipliers(candidates, prices, included, clubs)
+
+		best_value, best = -np.inf, None
+		nodes = [(frozenset(), included, root_multipliers)]
+		while nodes:
+			excluded, included, multipliers = nodes.pop()
+			solution = self.dynamic_programme(candidates, prices, excluded, included, multipliers[clubs], tables)
+			if solution is None or solution[3] + self.max_per_club * multipliers.sum() <= best_value:
+				continue
+			players = solution[0]
+			excess = np.bincount(clubs[players], minlength=len(multipliers)) - self.max_per_club
+			if excess.max() <= 0:
+				value = self.squad(*solution[:3]).value
+				if value > best_value:
+					best_value, best = value, solution[:3]
+				charged = (excess < 0) & (multipliers > 0)
+				if charged.any():
+					nodes.append((excluded, included, np.where(charged, 0., multipliers)))
+				continue
+			# the branches go back to the root's charges, which are tighter than any dropped here
+			club_players = players[clubs[players] == np.argmax(excess)]
+			for k, player in enumerate(club_players[:self.max_per_club + 1]):
+				if player not in included:
+					nodes.append((excluded | {player}, included | set(club_players[:k]), root_multipliers))
+		return best
+
+	def club_multipliers(self, candidates, prices, included, clubs, n_iterations=10):
+		""" Lagrange multipliers of the club limits, by a few steps of subgradient descent on the relaxation's bound:
+			the clubs with too many players in the relaxation's squad are charged more, and those with room less.
+		"""
+		multipliers = np.zeros(clubs.max() + 1)
+		best_bound, best_multipliers = np.inf, multipliers
+		for iteration in range(n_iterations):
+			solution = self.dynamic_programme(candidates, prices, frozenset(), included, multipliers[clubs],
+											   OrderedDict())
+			if solution is None:
+				break
+			bound = solution[3] + self.max_per_club * multipliers.sum()
+			if bound < best_bound:
+				best_bound, best_multipliers = bound, multipliers
+			excess = np.bincount(clubs[solution[0]], minlength=len(multipliers)) - self.max_per_club
+			if excess.max() <= 0 and not np.any(multipliers[excess < 0]):
+				break
+			if iteration == 0:
+				# steps on the scale of the squad's players' points
+				step = np.mean(self.points[solution[0]]) / 4
+			multipliers = np.maximum(0., multipliers + step / (iteration + 1) * excess)
+		return best_multipliers
+
+	def dynamic_programme(self, candidates, prices, excluded, included, charges, tables):
+		""" The players, starters, captain and value of the best squad of the candidates that are not excluded, with
+			the included ones, if the club limit is ignored, or None if there is none. Each player's charge is taken
+			off their value in any role. tables caches the position tables between calls.
+		"""
+		size = int(np.floor(self.budget)) + 1
+		stage = {(0, 0): np.where(np.arange(size) == 0, 0., -np.inf)}
+		history = []
+		for position in range(1, len(SQUAD_QUOTAS)):
+			players = candidates[(self.positions[candidates] == position) & ~np.isin(candidates, list(excluded))]
+			forced = np.isin(players, list(included))
+			key = (position, tuple(players), tuple(forced), tuple(charges[players]))
+			if key in tables:
+				tables.move_to_end(key)
+			else:
+				tables[key] = self.position_table(position, players, prices, forced, charges, size)
+				if len(tables) > MAX_TABLES:
+					tables.popitem(last=False)
+			best, choices = tables[key]
+
+			# -- every formation with this position's starters, and with or without the captain -- #
+			quota, last = SQUAD_QUOTAS[position], position == len(SQUAD_QUOTAS) - 1
+			merged, sources = {}, {}
+			for (n_starting, n_captains), spent in stage.items():
+				for starting in range(STARTING_MIN[position], STARTING_MAX[position] + 1):
+					for captains in range(2 - n_captains):
+						merged_key = (n_starting + starting, n_captains + captains)
+						if last and merged_key != (STARTING_SIZE, 1):
+							continue
+						value, split, position_spend = _max_plus(spent, best[starting, quota - starting, captains], last)
+						if merged_key not in merged:
+							merged[merged_key] = np.full(size, -np.inf)
+							sources[merged_key] = ([], np.zeros(size, dtype=int), np.zeros(size, dtype=int),
+												   np.zeros(size, dtype=int))
+						options, option, splits, spends = sources[merged_key]
+						better = value > merged[merged_key]
+						merged[merged_key][better] = value[better]
+						option[better] = len(options)
+						splits[better] = split[better]
+						spends[better] = position_spend[better]
+						options.append(((n_starting, n_captains), starting, captains))
+			history.append((position, players, choices, sources))
+			stage = merged
+
+		# the last stage holds the best squad within the budget at its last spend
+		final = stage.get((STARTING_SIZE, 1), np.full(size, -np.inf))[-1]
+		if final == -np.inf:
+			return None
+
+		# -- back through the positions to the players -- #
+		squad, starters, captain, state, spend = [], [], None, (STARTING_SIZE, 1), size - 1
+		for position, players, choices, sources in reversed(history):
+			options, option, splits, spends = sources[state]
+			previous, starting, captains = options[option[spend]]
+			roles = _roles(choices, prices[players], starting, SQUAD_QUOTAS[position] - starting, captains, spends[spend])
+			squad.extend(players[roles != OUT])
+			starters.extend(players[(roles == STARTING) | (roles == CAPTAIN)])
+			if np.any(roles == CAPTAIN):
+				captain = players[roles == CAPTAIN][0]
+			state, spend = previous, splits[spend]
+		return np.array(squad), np.array(starters), captain, final
+
+	def position_table(self, position, players, prices, forced, charges, size):
+		""" best[s, t, c, b], the most value from s starters (c of them captain) and t on the bench of one position's
+			players, costing exactly b, and choices[k, s, t, c, b], the k-th player's role there, by which the
+			players are found again.
+		"""
+		points = self.points[players]
+		shape = (STARTING_MAX[position] + 1, SQUAD_QUOTAS[position] - STARTING_MIN[position] + 1, 2, size)
+		best = np.full(shape, -np.inf)
+		best[0, 0, 0, 0] = 0
+		choices = np.zeros((len(players),) + shape, dtype=np.int8)
+		for k, (price, player_points, charge) in enumerate(zip(prices[players], points, charges[players])):
+			updated = np.full(shape, -np.inf) if forced[k] else best.copy()
+			if price < size:
+				rest = size - price
+				for role, target, source, value in (
+						(BENCH, np.s_[:, 1:, :, price:], np.s_[:, :-1, :, :rest], self.bench_weight * player_points - charge),
+						(STARTING, np.s_[1:, :, :, price:], np.s_[:-1, :, :, :rest], player_points - charge),
+						(CAPTAIN, np.s_[1:, :, 1, price:], np.s_[:-1, :, 0, :rest], 2 * player_points - charge)):
+					candidate = best[source] + value
+					better = candidate > updated[target]
+					updated[target] = np.where(better, candidate, updated[target])
+					choices[k][target][better] = role
+			best = updated
+		return best, choices
+
+	def undominated(self, candidates, forced):
+		""" A mask of the candidates that are not dominated. One player dominates another of their position if they
+			score at least as many points for no more money (ties going to the earlier). An optimal squad's dominated
+			player can be swapped for one of their dominators that is not in it, and whose club is not full, so it is
+			safe to drop players with enough dominators: at most quota - 1 of them can be in the squad, the rest of the
+			squad can fill at most (SQUAD_SIZE - 1) // max_per_club other clubs, and a dominator in the player's own
+			club always has room.
+		"""
+		keep = np.ones(len(candidates), dtype=bool)
+		max_full_clubs = (SQUAD_SIZE - 1) // self.max_per_club
+		for position in np.unique(self.positions[candidates]):
+			group = np.flatnonzero(self.positions[candidates] == position)
+			players = candidates[group]
+			points, prices, teams = self.points[players], self.prices[players], self.team_ids[players]
+			earlier = np.arange(len(players))[:, None] < np.arange(len(players))[None, :]
+			# dominates[j, i]: j dominates i
+			dominates = (points[:, None] >= points[None, :]) & (prices[:, None] <= prices[None, :]) & (
+				(points[:, None] > points[None, :]) | (prices[:, None] < prices[None, :]) | earlier)
+
+			same_club = teams[:, None] == teams[None, :]
+			own_club = np.sum(dominates & same_club, axis=0)
+			other_clubs = np.array([len(np.unique(teams[dominates[:, i] & ~same_club[:, i]])) for i in range(len(players))])
+			dominated = own_club + other_clubs >= SQUAD_QUOTAS[position] + max_full_clubs
+			keep[group] = ~dominated | forced[group]
+		return keep
+
+	def program(self, candidates):
+		""" The objective and constraints of the integer program over the candidates' squad, starting and captain
+			indicators, stacked in that order.
+		"""
+		n = len(candidates)
+		points, positions = self.points[candidates], self.positions[candidates]
+		objective = np.concatenate([self.bench_weight * points, (1 - self.bench_weight) * points, points])
+
+		position_ids = np.arange(1, len(SQUAD_QUOTAS))
+		by_position = sparse.csr_matrix((positions[None, :] == position_ids[:, None]).astype(float))
+		clubs, club_index = np.unique(self.team_ids[candidates], return_inverse=True)
+		by_club = sparse.csr_matrix((np.ones(n), (club_index, np.arange(n))), shape=(len(clubs), n))
+		ones, zeros, identity = np.ones((1, n)), sparse.csr_matrix((1, n)), sparse.identity(n, format='csr')
+		empty = sparse.csr_matrix((len(position_ids), n))
+
+		rows = [
+			# squad size, quotas, budget and clubs
+			(sparse.hstack([ones, zeros, zeros]), SQUAD_SIZE, SQUAD_SIZE),
+			(sparse.hstack([by_position, empty, empty]), SQUAD_QUOTAS[1:], SQUAD_QUOTAS[1:]),
+			(sparse.hstack([self.prices[candidates][None, :], zeros, zeros]), -np.inf, self.budget),
+			(sparse.hstack([by_club, sparse.csr_matrix((len(clubs), 2 * n))]), 0, self.max_per_club),
+			# starting eleven and formation
+			(sparse.hstack([zeros, ones, zeros]), STARTING_SIZE, STARTING_SIZE),
+			(sparse.hstack([empty, by_position, empty]), STARTING_MIN[1:], STARTING_MAX[1:]),
+			# captain among the starters, who are among the squad
+			(sparse.hstack([zeros, zeros, ones]), 1, 1),
+			(sparse.hstack([-identity, identity, sparse.csr_matrix((n, n))]), -np.inf, 0),
+			(sparse.hstack([sparse.csr_matrix((n, n)), -identity, identity]), -np.inf, 0),
+		]
+		constraints = [LinearConstraint(matrix.tocsr(), lb, ub) for matrix, lb, ub in rows]
+		return objective, constraints
+
+	def squad(self, players, starting, captain):
+		""" The Squad of the given player indices.
+		"""
+		value = (
+			self.bench_weight * self.points[players].sum()
+			+ (1 - self.bench_weight) * self.points[starting].sum()
+			+ self.points[captain]
+		)
+		return Squad(self.pids[players], self.positions[players], np.isin(players, starting), self.pids[captain],
+					 self.points[players], self.prices[players].sum(), value)
+
+
+def best_lineup(points, positions, bench_weight=BENCH_WEIGHT):
+	""" The starting mask, captain index and value of a squad's best lineup: the best goalkeeper, the best players of
+		each outfield position up to its minimum, and then the best of the rest, with the best starter as captain.
+	"""
+	points, positions = np.asarray(points, dtype=float), np.asarray(positions)
+	order = np.argsort(-points, kind='mergesort')
+	starting = np.zeros(len(points), dtype=bool)
+	for position in range(1, len(SQUAD_QUOTAS)):
+		starting[order[positions[order] == position][:STARTING_MIN[position]]] = True
+	n_left = STARTING_SIZE - starting.sum()
+	rest = order[~starting[order] & (positions[order] != 1)]
+	starting[rest[:n_left]] = True
+	captain = order[starting[order]][0]
+	value = bench_weight * points.sum() + (1 - bench_weight) * points[starting].sum() + points[captain]
+	return starting, captain, value
+
+
+def current_prices(all_player_data, pids, gameweek=None):
+	""" Each player's price (the value column, in tenths of a million) as of their last row before gameweek, if given,
+		in the loader's player data.
+	"""
+	data = all_player_data if gameweek is None else all_player_data[all_player_data.gameweek < gameweek]
+	last = data.sort_values('gameweek', kind='mergesort').groupby('player_id').value.last()
+	return last.reindex(pids).values
+
+
+def _roles(choices, prices, starting, bench, captains, spend):
+	""" Each player's role in the position table's best choice of starting starters, bench on the bench and captains
+		captains, costing spend.
+	"""
+	roles = np.full(len(prices), OUT)
+	for k in range(len(prices) - 1, -1, -1):
+		roles[k] = choices[k, starting, bench, captains, spend]
+		if roles[k] != OUT:
+			spend -= prices[k]
+			starting -= roles[k] != BENCH
+			bench -= roles[k] == BENCH
+			captains -= roles[k] == CAPTAIN
+	return roles
+
+
+def _max_plus(a, b, at_most=False):
+	""" The max plus convolution c[k] = max over i of a[i] + b[k - i] of two vectors of the most value by exact
+		spend, with the maximising i and k - i, or with at_most, just its best over every spend, in c's last entry.
+	"""
+	size = len(a)
+	value, split, spent = np.full(size, -np.inf), np.zeros(size, dtype=int), np.zeros(size, dtype=int)
+	finite_a, finite_b = np.flatnonzero(a > -np.inf), np.flatnonzero(b > -np.inf)
+	if not len(finite_a) or not len(finite_b) or finite_a[0] + finite_b[0] >= size:
+		return value, split, spent
+
+	if at_most:
+		# the best of b costing at most each spend, and where it is
+		best_b = np.maximum.accumulate(b)
+		where_b = np.maximum.accumulate(np.where(b == best_b, np.arange(size), 0))
+		totals = a + best_b[::-1]
+		i = np.argmax(totals)
+		value[-1], split[-1], spent[-1] = totals[i], i, where_b[size - 1 - i]
+		return value, split, spent
+
+	# only over the spends where each is possible, with b padded by -inf so every k - i indexes it
+	i = np.arange(finite_a[0], finite_a[-1] + 1)
+	k = np.arange(finite_a[0] + finite_b[0], min(finite_a[-1] + finite_b[-1] + 1, size))
+	padding = np.full(len(i), -np.inf)
+	padded = np.concatenate([padding, b, padding])
+	sums = a[i][None, :] + padded[k[:, None] - i[None, :] + len(i)]
+	best = np.argmax(sums, axis=1)
+	value[k] = sums[np.arange(len(k)), best]
+	split[k] = i[best]
+	spent[k] = k - i[best]
+	return value, split, spent
+
+
+profiler.instrument(SquadOptimiser, dict(solve='squad selection', dynamic_programme='squad dynamic programme'))
@@ -0,0 +1,323 @@
+""" Plans transfers over the next few gameweeks. Each gameweek the squad can make up to max_transfers transfers (each
+	swapping a player for another of the same position, within the bank and the club limit), of which those beyond the
+	free transfers cost hit_cost points each. An unused free transfer is banked, up to max_free_transfers. A gameweek is
+	worth the best lineup of its squad, valued as the SquadOptimiser values squads, and a plan the sum over the horizon
+	less its hits.
+
+	The search is a depth first recursion over gameweeks, memoised on (gameweek, squad, bank, free transfers), so that
+	the same state reached by different transfer orders is only solved once. From each state it tries making no
+	transfers, the max_moves single transfers (from the whole pool) that add the most to the squad's lineups over the
+	gameweeks left, and the max_moves best pairs of them, the first of which is one of the best singles and the second
+	any other, so that a downgrade can pay for an upgrade. The moves are tried best bound first, until no bound can beat
+	the best plan found (by more than tolerance points), and a state whose own bound cannot is not expanded at all.
+
+	A bound on a gameweek is a bound on any squad reachable with the transfers that could have been made by then. With
+	the points floored at zero, a lineup's value is submodular in its players (its starters are a matroid's best
+	basis), so that a reachable squad is worth at most the current squad plus the marginal values of its incoming
+	players. Their prices are dualised with a Lagrange multiplier, which leaves a small max-plus combination of each
+	position's best incoming marginals and dearest outgoing prices. Summed over the gameweeks, for the best number of
+	transfers less their hits beyond the free ones, these bound the plans from a state, and from each of its moves.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from src.logger import logger
+from src.profiler import profiler
+from src.selection.squad_optimiser import BENCH_WEIGHT, MAX_PER_CLUB, SQUAD_QUOTAS, SQUAD_SIZE, STARTING_MIN, \
+	STARTING_SIZE
+
+HIT_COST = 4
+MAX_FREE_TRANSFERS = 2
+# each position's slots in a squad, which is kept in position order
+SLOT_BOUNDS = np.cumsum(SQUAD_QUOTAS)
+# multipliers on the prices tried by the bound, as quantiles of the incoming players' marginal points per price
+MULTIPLIER_QUANTILES = np.array([0.25, 0.5, 0.75, 1.])
+
+PlanStep = namedtuple('PlanStep', ['gameweek', 'transfers_out', 'transfers_in', 'free_transfers', 'hits', 'bank',
+								   'squad', 'points'])
+Plan = namedtuple('Plan', ['value', 'steps', 'n_states'])
+
+
+class TransferPlanner:
+
+	def __init__(self, pids, positions, team_ids, prices, points, gameweeks, max_moves=8, max_transfers=2,
+				 max_free_transfers=MAX_FREE_TRANSFERS, hit_cost=HIT_COST, max_per_club=MAX_PER_CLUB,
+				 bench_weight=BENCH_WEIGHT, tolerance=0.):
+		""" points is a (players x gameweeks) matrix of projected points, such as a ProjectionEngine's xfpl, and prices
+			are in whole units (the fpl data's tenths of a million), with a player sold for what they cost.
+		"""
+		if max_transfers not in (0, 1, 2):
+			raise ValueError('The planner makes at most two transfers a gameweek, not {}'.format(max_transfers))
+		self.pids = np.asarray(pids)
+		self.positions = np.asarray(positions, dtype=int)
+		self.team_ids = np.unique(team_ids, return_inverse=True)[1]
+		self.prices = np.round(prices).astype(int)
+		self.points = np.asarray(points, dtype=float)
+		self.gameweeks = np.asarray(gameweeks)
+		self.max_moves = max_moves
+		self.max_transfers = max_transfers
+		self.max_free_transfers = max_free_transfers
+		self.hit_cost = hit_cost
+		self.max_per_club = max_per_club
+		self.bench_weight = bench_weight
+		self.tolerance = tolerance
+
+	@classmethod
+	def from_projections(cls, projections, pid_to_pos, player_team_ids, prices, **kwargs):
+		""" A planner over a ProjectionEngine's projections, over all of their gameweeks.
+		"""
+		positions = [pid_to_pos[pid] for pid in projections.pids]
+		return cls(projections.pids, positions, player_team_ids, prices, projections.xfpl, projections.gameweeks,
+				   **kwargs)
+
+	def plan(self, squad_pids, bank, free_transfers=1, prune=True):
+		""" The best plan for the squad of the given pids, with bank left to spend and free_transfers for the first
+			gameweek. Without prune, every move is tried.
+		"""
+		squad = np.flatnonzero(np.isin(self.pids, squad_pids))
+		if len(squad) != SQUAD_SIZE or np.any(np.bincount(self.positions[squad], minlength=5) != SQUAD_QUOTAS):
+			raise ValueError('The squad must be {} players of the position quotas, in the pool'.format(SQUAD_SIZE))
+
+		# points still to come from each gameweek on, by which transfers are dominated
+		self.future_points = np.cumsum(self.points[:, ::-1], axis=1)[:, ::-1]
+		self.prune = prune
+		self.memo = {}
+		value, steps = self.best_plan(0, self.canonical(squad), int(round(bank)), free_transfers)
+		logger.info('Planned {} gameweeks over {} players, solving {} states'.format(
+			len(self.gameweeks), len(self.pids), len(self.memo)))
+		return Plan(value, [self.step(*step) for step in steps], len(self.memo))
+
+	def canonical(self, squad):
+		""" The squad in position order (which is its slot order), and by index within each position.
+		"""
+		return tuple(squad[np.lexsort((squad, self.positions[squad]))])
+
+	def best_plan(self, g, squad, bank, free_transfers, floor=-np.inf):
+		""" The value of the best plan from the g-th gameweek on, with its steps as (g, squad before, squad after, slots
+			transferred, bank, free transfers, hits, points), for a canonical squad. Plans worth no more than floor are
+			not searched for, so that a value at most floor only bounds the best, and comes without steps.
+		"""
+		key = (g, squad, bank, free_transfers)
+		if key in self.memo:
+			value, steps = self.memo[key]
+			if steps is not None or value <= floor:
+				return value, steps
+
+		squad_array = np.array(squad)
+		if self.prune:
+			values, marginals, budgeted, unbudgeted = self.bounds(g, squad_array, bank)
+			bound = _best_transfers(values[:, None] + budgeted, free_transfers, self.max_transfers, self.hit_cost)
+			if bound <= floor + self.tolerance:
+				self.memo[key] = min(bound, floor), None
+				return self.memo[key]
+
+		moves, gains, points = self.moves(g, squad_array, bank)
+		n_moves = np.sum(moves[:, :, 0] >= 0, axis=1)
+		hits = self.hit_cost * np.maximum(n_moves - free_transfers, 0)
+		next_free = np.minimum(self.max_free_transfers, np.maximum(free_transfers - n_moves, 0) + 1)
+		squads = _apply(squad_array, moves)
+
+		# -- each move's bound on the gameweeks after this one, from its incoming players' marginal values -- #
+		future_bounds = np.zeros(len(moves)) if self.prune else np.full(len(moves), np.inf)
+		if self.prune and g < len(self.gameweeks) - 1:
+			added = np.where(moves[:, :, 1, None] >= 0, marginals.T[moves[:, :, 1]], 0).sum(axis=1)
+			width = np.arange(self.max_transfers * (len(values) - 1) + 1)
+			with_moves = budgeted[1:][:, np.minimum(n_moves[:, None] + width, SQUAD_SIZE)].transpose(1, 0, 2)
+			after_moves = added[:, 1:, None] + unbudgeted[1:][:, np.minimum(width, SQUAD_SIZE)][None, :, :]
+			future_bounds = _best_transfers(values[1:, None] + np.minimum(with_moves, after_moves), next_free,
+											self.max_transfers, self.hit_cost)
+		bounds = points[:, 0] - hits + future_bounds
+
+		best_value, best_steps = -np.inf, None
+		for m in np.argsort(-bounds, kind='mergesort'):
+			if bounds[m] <= max(best_value, floor) + self.tolerance:
+				break
+			step = (g, squad_array, squads[m], moves[m, :n_moves[m], 0], bank + gains[m], free_transfers, hits[m],
+					points[m, 0])
+			if g == len(self.gameweeks) - 1:
+				value, steps = points[m, 0] - hits[m], (step,)
+			else:
+				future_value, future_steps = self.best_plan(
+					g + 1, self.canonical(squads[m]), bank + gains[m], next_free[m],
+					max(best_value, floor) - points[m, 0] + hits[m])
+				value, steps = points[m, 0] - hits[m] + future_value, future_steps and (step,) + future_steps
+			# the plans from the move only bound a value at most the floor, unless they come with their steps
+			if steps is not None and value > best_value:
+				best_value, best_steps = value, steps
+
+		if best_value <= floor:
+			best_value, best_steps = floor, None
+		self.memo[key] = best_value, best_steps
+		return best_value, best_steps
+
+	def moves(self, g, squad, bank):
+		""" The transfers tried for the squad in the g-th gameweek, as a (moves x max_transfers x 2) array of (squad
+			slot, incoming player) pairs, padded with -1, along with what each adds to the bank and the (moves x
+			gameweeks left) values of its squad's lineups. The first move makes no transfers.
+		"""
+		# -- single transfers: any slot for a player of its position not in the squad, unless dominated -- #
+		slots, players = np.nonzero(self.positions[squad][:, None] == self.positions[None, :])
+		keep = ~np.isin(players, squad)
+		slots, players = slots[keep], players[keep]
+		outgoing = squad[slots]
+		gains = self.prices[outgoing] - self.prices[players]
+		better = (gains > 0) | np.any(self.future_points[players, g:] > self.future_points[outgoing, g:], axis=1)
+		slots, players, outgoing, gains = slots[better], players[better], outgoing[better], gains[better]
+		singles = np.full((len(slots), self.max_transfers, 2), -1)
+		if self.max_transfers:
+			singles[:, 0] = np.column_stack([slots, players])
+		points = self.lineups(g, np.concatenate([squad[None, :], _apply(squad, singles)]))
+		no_move, points = points[:1], points[1:]
+		order = np.argsort(-points.sum(axis=1), kind='mergesort')
+
+		club_counts = np.bincount(self.team_ids[squad], minlength=self.team_ids.max() + 1)
+		clubs_in, clubs_out = self.team_ids[players], self.team_ids[outgoing]
+		fits = club_counts[clubs_in] + 1 - (clubs_out == clubs_in) <= self.max_per_club
+		best_singles = order[((bank + gains >= 0) & fits)[order]][:self.max_moves if self.max_transfers else 0]
+		moves = [np.full((1, self.max_transfers, 2), -1), singles[best_singles]]
+		move_gains, move_points = [[0], gains[best_singles]], [no_move, points[best_singles]]
+
+		# -- pairs of one of the best singles and any other, ranked by the sum of what each adds alone -- #
+		if self.max_transfers == 2:
+			first = np.repeat(order[:self.max_moves], len(order))
+			second = np.tile(np.arange(len(order)), min(self.max_moves, len(order)))
+			rank = np.empty(len(order), dtype=int)
+			rank[order] = np.arange(len(order))
+			feasible = (slots[first] != slots[second]) & (players[first] != players[second]) \
+				& (bank + gains[first] + gains[second] >= 0) & ((rank[second] >= self.max_moves) | (first < second))
+			for this, other in ((first, second), (second, first)):
+				club = clubs_in[this]
+				feasible &= club_counts[club] + 1 + (clubs_in[other] == club) - (clubs_out[this] == club) \
+					- (clubs_out[other] == club) <= self.max_per_club
+			first, second = first[feasible], second[feasible]
+			best_pairs = np.argsort(-(points[first] + points[second]).sum(axis=1), kind='mergesort')[:self.max_moves]
+			first, second = first[best_pairs], second[best_pairs]
+			pairs = singles[first]
+			pairs[:, 1] = singles[second, 0]
+			moves.append(pairs)
+			move_gains.append(gains[first] + gains[second])
+			move_points.append(self.lineups(g, _apply(squad, pairs)))
+		return np.concatenate(moves), np.concatenate(move_gains).astype(int), np.concatenate(move_points)
+
+	def lineups(self, g, squads):
+		""" The (squads x gameweeks left) values of the squads' best lineups in each gameweek from the g-th on.
+		"""
+		points = self.points[squads, g:].transpose(0, 2, 1).reshape(-1, SQUAD_SIZE)
+		return _lineup_values(_slot_blocks(points), self.bench_weight).reshape(len(squads), -1)
+
+	def bounds(self, g, squad, bank):
+		""" The squad's value in each gameweek from the g-th on, the marginal values of players added to it, as a
+			(gameweeks x players) array, and bounds on what transfers from it add in each gameweek, with the budget and
+			without, as (gameweeks x number of transfers) arrays.
+		"""
+		incoming = np.flatnonzero(~np.isin(np.arange(len(self.pids)), squad))
+		values, incoming_marginals = self.marginals(g, squad, incoming)
+		budgeted, unbudgeted = self.transfer_bound(squad, incoming, incoming_marginals, bank)
+		marginals = np.zeros((len(values), len(self.pids)))
+		marginals[:, incoming] = incoming_marginals
+		return values, marginals, budgeted, unbudgeted
+
+	def marginals(self, g, squad, incoming):
+		""" The squad's value in each gameweek from the g-th on, and each incoming player's marginal value added to it,
+			as a (gameweeks x incoming) array, with the points floored at zero.
+		"""
+		points = np.maximum(self.points[:, g:], 0)
+		n_left = points.shape[1]
+		squad_blocks = _slot_blocks(points[squad].T)
+		values = _lineup_values(squad_blocks, self.bench_weight)
+		marginals = np.zeros((n_left, len(incoming)))
+		incoming_positions = self.positions[incoming]
+		for position in range(1, len(SQUAD_QUOTAS)):
+			adding = np.flatnonzero(incoming_positions == position)
+			blocks = [np.repeat(block, len(adding), axis=0) for block in squad_blocks]
+			blocks[position - 1] = np.column_stack([blocks[position - 1], points[incoming[adding]].T.ravel()])
+			marginals[:, adding] = _lineup_values(blocks, self.bench_weight).reshape(n_left, -1) - values[:, None]
+		return values, marginals
+
+	def transfer_bound(self, squad, incoming, marginals, bank):
+		""" For each gameweek and number of transfers, a bound on what they add to the squad's value: the incoming
+			players' marginal values, with their prices, less the outgoing players', dualised by each of a few
+			multipliers, the first of which is zero and so gives the bound without the budget.
+		"""
+		squad_positions, incoming_positions = self.positions[squad], self.positions[incoming]
+		prices = self.prices[incoming]
+		# (gameweeks x multipliers)
+		multipliers = np.concatenate([
+			np.zeros((len(marginals), 1)), np.percentile(marginals / prices, 100 * MULTIPLIER_QUANTILES, axis=1).T
+		], axis=1)
+		combined = None
+		for position in range(1, len(SQUAD_QUOTAS)):
+			adding = incoming_positions == position
+			net = -np.sort(-(marginals[:, None, adding] - multipliers[:, :, None] * prices[adding]), axis=2)
+			sold = -np.sort(-self.prices[squad[squad_positions == position]])[:net.shape[2]]
+			net = np.cumsum(net[:, :, :len(sold)], axis=2) + multipliers[:, :, None] * np.cumsum(sold)
+			net = np.maximum.accumulate(np.concatenate([np.zeros(net.shape[:2] + (1,)), net], axis=2), axis=2)
+			combined = net if combined is None else _max_plus(combined, net)
+		counts = np.minimum(np.arange(SQUAD_SIZE + 1), combined.shape[2] - 1)
+		return np.min(multipliers[:, :, None] * bank + combined, axis=1)[:, counts], combined[:, 0, counts]
+
+	def step(self, g, squad, new_squad, slots, bank, free_transfers, hits, points):
+		""" The PlanStep of a step of best_plan.
+		"""
+		return PlanStep(self.gameweeks[g], self.pids[squad[slots]], self.pids[new_squad[slots]], free_transfers, hits,
+						bank, self.pids[new_squad], points)
+
+
+def _apply(squad, moves):
+	""" The squad after each of a (moves x transfers x 2) array of (squad slot, incoming player) pairs, padded with -1.
+	"""
+	squads = np.repeat(squad[None, :], len(moves), axis=0)
+	for k in range(moves.shape[1]):
+		made = moves[:, k, 0] >= 0
+		squads[made, moves[made, k, 0]] = moves[made, k, 1]
+	return squads
+
+
+def _slot_blocks(points):
+	""" A (squads x slots) array of points split into each position's (squads x quota) block.
+	"""
+	return np.split(points, SLOT_BOUNDS[1:-1], axis=1)
+
+
+def _lineup_values(blocks, bench_weight=BENCH_WEIGHT):
+	""" The value of the best lineup of each squad, given each position's (squads x players) block of points, as
+		best_lineup finds it: each position's best up to its minimum, then the best of the rest of the outfield, with
+		the best starter as captain. Blocks of more than a squad's players give their best fifteen as the squad, which
+		bounds the value of any squad among them.
+	"""
+	blocks = [-np.sort(-block, axis=1) for block in blocks]
+	required = sum(block[:, :STARTING_MIN[position]].sum(axis=1) for position, block in enumerate(blocks, 1))
+	rest = -np.sort(-np.concatenate([block[:, STARTING_MIN[position]:] for position, block in enumerate(blocks, 1)
+									 if position != 1], axis=1), axis=1)
+	starting = required + rest[:, :STARTING_SIZE - STARTING_MIN.sum()].sum(axis=1)
+	squad = np.concatenate(blocks, axis=1)
+	squad = squad.sum(axis=1) if squad.shape[1] == SQUAD_SIZE else -np.sort(-squad, axis=1)[:, :SQUAD_SIZE].sum(axis=1)
+	captain = np.max([block[:, 0] for block in blocks], axis=0)
+	return bench_weight * squad + (1 - bench_weight) * starting + captain
+
+
+def _best_transfers(gameweek_bounds, free_transfers, max_transfers, hit_cost):
+	""" Given (... x gameweeks x transfers) bounds on each gameweek's value with as many transfers made by then, a bound
+		on their sum over the best number of transfers, each gameweek reaching at most max_transfers more than the
+		last, less the hits beyond the free transfers and one more each later gameweek.
+	"""
+	n = gameweek_bounds.shape[-2]
+	transfers = np.arange(max_transfers * n + 1)
+	reachable = np.minimum(transfers[:, None], max_transfers * np.arange(1, n + 1)[None, :])
+	reachable = np.minimum(reachable, gameweek_bounds.shape[-1] - 1)
+	totals = gameweek_bounds[..., np.arange(n)[None, :], reachable].sum(axis=-1)
+	hits = hit_cost * np.maximum(transfers - np.asarray(free_transfers)[..., None] - (n - 1), 0)
+	return np.max(totals - hits, axis=-1)
+
+
+def _max_plus(a, b):
+	""" The max-plus convolution along the last axes of a and b: c[..., n] = max over k of a[..., k] + b[..., n - k].
+	"""
+	c = np.full(a.shape[:-1] + (a.shape[-1] + b.shape[-1] - 1,), -np.inf)
+	for k in range(b.shape[-1]):
+		c[..., k:k + a.shape[-1]] = np.maximum(c[..., k:k + a.shape[-1]], a + b[..., k:k + 1])
+	return c
+
+
+profiler.instrument(TransferPlanner, dict(plan='transfer planning'))
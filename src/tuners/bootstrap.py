@@ -0,0 +1,169 @@
+""" Block bootstrap of the tuned parameters. Each replicate resamples the season in blocks of consecutive gameweeks
+	(keeping the within-block dynamics the filters rely on), re-tunes from the current optimum as a warm start, and
+	records the parameters it ends up at. Replicates run in parallel across a TunerPool.
+"""
+import os
+from collections import namedtuple
+
+import numpy as np
+from scipy.optimize import minimize
+
+from src.logger import logger, validate_path
+from src.paths import paths
+from src.tuners.tuner_pool import TunerPool
+from src.utils import group_indices
+
+BootstrapResult = namedtuple('BootstrapResult', ['names', 'draws', 'costs', 'mean', 'std', 'quantiles', 'path'])
+
+SUMMARY_QUANTILES = (0.025, 0.5, 0.975)
+
+
+def sample_gameweek_blocks(gameweek_list, block_length, rng):
+	""" A moving block bootstrap resample of gameweek_list: blocks of block_length consecutive gameweeks, with
+		uniformly random starts, are concatenated up to the original length.
+	"""
+	n_gameweeks = len(gameweek_list)
+	block_length = min(block_length, n_gameweeks)
+	n_blocks = -(-n_gameweeks // block_length)
+	starts = rng.randint(0, n_gameweeks - block_length + 1, size=n_blocks)
+	indices = (starts[:, None] + np.arange(block_length)).ravel()[:n_gameweeks]
+	return np.asarray(gameweek_list)[indices]
+
+
+def resample_arrays(arrays, gameweek_array, sampled_gameweeks):
+	""" Builds the backtest arrays of a resampled season, where sampled_gameweeks[i] is the original gameweek played
+		as gameweek i + 1. Gameweeks are relabelled so that a gameweek drawn twice is seen as two separate ones.
+	"""
+	groups = group_indices(arrays[gameweek_array])
+	rows = [groups[gw] for gw in sampled_gameweeks]
+	index = np.concatenate(rows)
+
+	resampled = {name: array[index] for name, array in arrays.items()}
+	resampled[gameweek_array] = np.repeat(
+		np.arange(1, len(rows) + 1), [len(r) for r in rows]).astype(arrays[gameweek_array].dtype)
+	return resampled
+
+
+class Bootstrap:
+
+	def __init__(self, tuner, n_replicates=200, block_length=4, seed=0, name=None,
+				 folder=paths['cache'] + 'bootstrap/'):
+		""" Draws are saved to folder/name.npz (name defaulting to the tuner's class name and fingerprint) as each
+			replicate finishes, so an interrupted run can be resumed with the same seed, tuner and starting point.
+		"""
+		self.tuner = tuner
+		self.n_replicates = n_replicates
+		self.block_length = block_length
+		# the data, fixed params and code the draws are made with, by which a previous run's are checked
+		self.fingerprint = tuner.fingerprint()
+		self.path = folder + ('{}_{}'.format(type(tuner).__name__, self.fingerprint) if name is None else name) + '.npz'
+		validate_path(self.path)
+
+		rng = np.random.RandomState(seed)
+		self.samples = np.array([
+			sample_gameweek_blocks(tuner.gameweek_list, block_length, rng) for _ in range(n_replicates)
+		])
+
+	def run(self, opt_array=None, n_processes=None, tol=None, maxiter=None, resume=True):
+		""" Re-tunes each (not yet finished) replicate with Nelder-Mead from opt_array, by default the tuner's current
+			parameters, and returns the draws along with their summary statistics.
+		"""
+		names = list(self.tuner.tuner_params.optimise_params)
+		opt_array = np.asarray(self.tuner.tuner_params.x0 if opt_array is None else opt_array, dtype=float)
+		tol = self.tuner.tol if tol is None else tol
+
+		draws = np.full((self.n_replicates, len(opt_array)), np.nan)
+		costs = np.full(self.n_replicates, np.nan)
+		if resume:
+			self._restore(names, opt_array, draws, costs)
+
+		to_run = np.flatnonzero(np.isnan(costs))
+		logger.info('Running {} of {} bootstrap replicates in blocks of {} gameweeks'.format(
+			len(to_run), self.n_replicates, self.block_length))
+
+		jobs = [(i, self.samples[i], opt_array, tol, maxiter) for i in to_run]
+		try:
+			with TunerPool(self.tuner, n_processes=n_processes) as pool:
+				for n_done, (i, x, cost) in enumerate(pool.apply_unordered(_tune_replicate, jobs), 1):
+					draws[i], costs[i] = x, cost
+					self._save(names, opt_array, draws, costs)
+					logger.info('Bootstrap replicate {} finished ({} of {}), cost {:.7f}'.format(
+						i, n_done, len(jobs), cost))
+		finally:
+			self.tuner.release_arrays()
+
+		return self._summarise(names, opt_array, draws, costs)
+
+	def _summarise(self, names, opt_array, draws, costs):
+		""" Summarises the replicates that finished with a finite cost, saving the summary along with the raw draws.
+			With none, the summary is all NaN.
+		"""
+		finished = np.isfinite(costs)
+		if not finished.any():
+			logger.info('No bootstrap replicate finished, saving the draws without a summary')
+			mean = std = np.full(len(names), np.nan)
+			quantiles = np.full((len(SUMMARY_QUANTILES), len(names)), np.nan)
+			self._save(names, opt_array, draws, costs, mean=mean, std=std, quantiles=quantiles)
+			return BootstrapResult(names, draws, costs, mean, std, quantiles, self.path)
+
+		mean = draws[finished].mean(axis=0)
+		std = draws[finished].std(axis=0, ddof=1) if finished.sum() > 1 else np.full(len(names), np.nan)
+		quantiles = np.quantile(draws[finished], SUMMARY_QUANTILES, axis=0)
+
+		logger.info('{:40} {:>14} {:>14} {:>14} {:>14}'.format('param', 'mean', 'std', '2.5%', '97.5%'))
+		for k, name in enumerate(names):
+			logger.info('{:40} {:>14.6g} {:>14.6g} {:>14.6g} {:>14.6g}'.format(
+				name, mean[k], std[k], quantiles[0, k], quantiles[-1, k]))
+
+		self._save(names, opt_array, draws, costs, mean=mean, std=std, quantiles=quantiles)
+		return BootstrapResult(names, draws, costs, mean, std, quantiles, self.path)
+
+	def _save(self, names, opt_array, draws, costs, **summary):
+		temp_path = self.path[:-len('.npz')] + '.tmp.npz'
+		np.savez(
+			temp_path,
+			names=np.array(names),
+			fingerprint=np.array(self.fingerprint),
+			opt_array=opt_array,
+			draws=draws,
+			costs=costs,
+			samples=self.samples,
+			quantile_levels=np.array(SUMMARY_QUANTILES),
+			**summary
+		)
+		os.replace(temp_path, self.path)
+
+	def _restore(self, names, opt_array, draws, costs):
+		""" Fills in the replicates already finished by a previous run of the same tuner (on the same data, with the
+			same fixed params), from the same starting point, with the same parameters and resamples.
+		"""
+		try:
+			with np.load(self.path) as saved:
+				if 'fingerprint' not in saved or str(saved['fingerprint']) != self.fingerprint \
+						or not np.array_equal(saved['opt_array'], opt_array):
+					logger.info('Ignoring bootstrap draws in {} made with another tuner or starting point'.format(
+						self.path))
+					return
+				if list(saved['names']) != names or not np.array_equal(saved['samples'], self.samples):
+					logger.info('Ignoring bootstrap draws in {} made with other params or resamples'.format(self.path))
+					return
+				draws[:], costs[:] = saved['draws'], saved['costs']
+		except FileNotFoundError:
+			return
+		logger.info('Restored {} finished bootstrap replicates from {}'.format(np.sum(~np.isnan(costs)), self.path))
+
+
+def _tune_replicate(tuner, job):
+	i, sampled_gameweeks, opt_array, tol, maxiter = job
+
+	def fun(x):
+		cost = tuner.evaluate_cost(x)
+		return np.inf if np.isnan(cost) else cost
+
+	full_arrays = tuner.arrays
+	tuner.bind_arrays(resample_arrays(full_arrays, tuner.gameweek_array, sampled_gameweeks))
+	try:
+		optimal = minimize(fun, x0=opt_array, method='Nelder-Mead', tol=tol, options=dict(maxiter=maxiter))
+	finally:
+		tuner.bind_arrays(full_arrays)
+	return i, optimal.x, optimal.fun
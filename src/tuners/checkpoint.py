@@ -0,0 +1,45 @@
+""" Periodic on-disk checkpoints of a tuner's optimiser state, so that long tunes can be resumed after an interruption.
+"""
+import os
+import time
+
+import numpy as np
+
+from src.logger import logger, validate_path
+from src.paths import paths
+
+
+class TunerCheckpoint:
+
+	def __init__(self, name, every=300., folder=paths['cache'] + 'checkpoints/'):
+		""" Checkpoints are written to folder/name.npz at most once every `every` seconds, unless forced.
+		"""
+		self.path = folder + name + '.npz'
+		self.every = every
+		self.last_saved = time.time()
+		validate_path(self.path)
+
+	def due(self):
+		return time.time() - self.last_saved >= self.every
+
+	def save(self, **state):
+		""" Atomically replaces the checkpoint with the arrays (or scalars) in state.
+		"""
+		temp_path = self.path[:-len('.npz')] + '.tmp.npz'
+		np.savez(temp_path, **state)
+		os.replace(temp_path, self.path)
+		self.last_saved = time.time()
+		logger.info('Checkpointed optimiser state after {} evaluations to {}'.format(state.get('nfev'), self.path))
+
+	def load(self):
+		""" Returns the checkpointed state as a dict, or None if there is no checkpoint.
+		"""
+		try:
+			with np.load(self.path) as checkpoint:
+				return {k: checkpoint[k] for k in checkpoint.files}
+		except FileNotFoundError:
+			return None
+
+	def clear(self):
+		if os.path.exists(self.path):
+			os.remove(self.path)
@@ -0,0 +1,118 @@
+""" Memoises tuner cost evaluations. An in-memory LRU layer sits in front of an append-only store on disk, which later
+	runs against the same data, fixed parameters and model code warm-start from.
+"""
+import collections
+import functools
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from src.logger import logger, validate_path
+from src.paths import paths
+
+# the packages whose code the costs come from, relative to src
+COST_SOURCES = ('models', 'tuners')
+
+
+class EvaluationCache:
+
+	def __init__(self, fingerprint, sig_figs=10, max_size=100000, folder=paths['cache'] + 'evaluations/'):
+		""" Evaluations are keyed by the parameter vector rounded to sig_figs significant figures, within a store
+			identified by fingerprint (see data_fingerprint).
+		"""
+		self.sig_figs = sig_figs
+		self.max_size = max_size
+		self.path = folder + fingerprint + '.jsonl'
+		self.memory = collections.OrderedDict()
+
+		self.hits = 0
+		self.misses = 0
+		self.n_loaded = self._load()
+
+	def key(self, opt_array):
+		return tuple(float('{:.{}g}'.format(x, self.sig_figs)) for x in opt_array)
+
+	def get(self, opt_array):
+		""" Returns the cached (emll, pen_str) of opt_array, or None.
+		"""
+		key = self.key(opt_array)
+		try:
+			value = self.memory[key]
+		except KeyError:
+			self.misses += 1
+			return None
+		self.memory.move_to_end(key)
+		self.hits += 1
+		return value
+
+	def put(self, opt_array, emll, pen_str):
+		self._remember(self.key(opt_array), (emll, pen_str))
+		with open(self.path, 'a') as file:
+			file.write(json.dumps(dict(x=[float(x) for x in opt_array], emll=emll, pen_str=pen_str)) + '\n')
+
+	def summary(self):
+		n_lookups = self.hits + self.misses
+		return 'Evaluation cache: {} hits, {} misses ({:.1f}% hit rate), {} evaluations loaded from {}'.format(
+			self.hits,
+			self.misses,
+			100 * self.hits / n_lookups if n_lookups else 0.,
+			self.n_loaded,
+			self.path
+		)
+
+	def _remember(self, key, value):
+		self.memory[key] = value
+		self.memory.move_to_end(key)
+		if len(self.memory) > self.max_size:
+			self.memory.popitem(last=False)
+
+	def _load(self):
+		""" Warm-starts the LRU layer from the store, most recent evaluations last. A line cut short by a killed run
+			is skipped.
+		"""
+		validate_path(self.path)
+		n_loaded = 0
+		try:
+			with open(self.path, 'r') as file:
+				for line in file:
+					try:
+						record = json.loads(line)
+					except ValueError:
+						continue
+					self._remember(self.key(record['x']), (record['emll'], record['pen_str']))
+					n_loaded += 1
+		except FileNotFoundError:
+			pass
+		if n_loaded:
+			logger.info('Loaded {} cached evaluations from {}'.format(n_loaded, self.path))
+		return n_loaded
+
+
+def data_fingerprint(arrays, *extras):
+	""" md5 of a dict of numpy arrays (names, dtypes, shapes and contents) together with any extra json-able values,
+		e.g. the names of the optimised parameters and the values of everything else.
+	"""
+	hash_md5 = hashlib.md5()
+	for name in sorted(arrays):
+		array = np.ascontiguousarray(arrays[name])
+		hash_md5.update('{}{}{}'.format(name, array.dtype.str, array.shape).encode())
+		hash_md5.update(array.tobytes())
+	hash_md5.update(json.dumps(extras, sort_keys=True, default=str).encode())
+	return hash_md5.hexdigest()
+
+
+@functools.lru_cache()
+def source_fingerprint(packages=COST_SOURCES):
+	""" md5 of the python files of the packages under src, so that a store is only reused by the code that filled it.
+	"""
+	src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	hash_md5 = hashlib.md5()
+	for package in packages:
+		for path in sorted(glob.glob(os.path.join(src, package, '**', '*.py'), recursive=True)):
+			hash_md5.update(os.path.relpath(path, src).encode())
+			with open(path, 'rb') as file:
+				hash_md5.update(file.read())
+	return hash_md5.hexdigest()
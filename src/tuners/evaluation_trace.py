@@ -0,0 +1,43 @@
+""" A compact binary trace of every cost evaluation a tuner makes: rows of float64s holding the wall time, the cost and
+	the optimised parameter values, appended through a buffered file. The column names are written alongside as json.
+"""
+import json
+import time
+
+import numpy as np
+
+from src.logger import logging_path, validate_path
+
+
+class EvaluationTrace:
+
+	def __init__(self, name, names, path=None, buffer_size=1 << 16):
+		""" By default the trace is written next to this run's log, as <log>.<name>.trace.
+		"""
+		self.path = '{}.{}.trace'.format(logging_path, name) if path is None else path
+		validate_path(self.path)
+		self.columns = ['time', 'cost'] + list(names)
+		with open(self.path + '.json', 'w') as file:
+			json.dump(self.columns, file)
+		self.file = open(self.path, 'ab', buffering=buffer_size)
+
+	def write(self, opt_array, cost):
+		row = np.empty(len(self.columns))
+		row[0] = time.time()
+		row[1] = cost
+		row[2:] = opt_array
+		self.file.write(row.tobytes())
+
+	def close(self):
+		if not self.file.closed:
+			self.file.close()
+
+
+def load_trace(path):
+	""" Reads a trace back as a structured array with a field per column.
+	"""
+	with open(path + '.json', 'r') as file:
+		columns = json.load(file)
+	rows = np.fromfile(path, dtype=np.float64)
+	rows = rows[:len(rows) - len(rows) % len(columns)].reshape(-1, len(columns))
+	return np.rec.fromarrays(rows.T, names=columns)
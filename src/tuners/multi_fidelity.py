@@ -0,0 +1,108 @@
+""" Multi-fidelity optimiser backends for the tuners. Candidates are first scored on a short prefix of the season's
+	gameweeks and only the most promising fraction advance to longer horizons, so that obviously bad parameters never
+	cost a full season replay.
+"""
+import math
+
+import numpy as np
+from scipy.optimize import OptimizeResult
+
+from src.logger import logger
+from src.tuners.population_optimiser import latin_hypercube
+
+MULTI_FIDELITY_METHODS = ('successive-halving', 'hyperband')
+
+
+def successive_halving(tuner, pool=None, eta=3, min_gameweeks=4, n_candidates=None, seed=None):
+	""" A single successive halving bracket: n_candidates points of a latin hypercube over the search box (plus the
+		current parameters) are scored at the shortest horizon, the best 1 / eta of them advance to a horizon eta
+		times longer, and so on up to the full season.
+	"""
+	rng = np.random.RandomState(seed)
+	horizons = _rung_horizons(len(tuner.gameweek_list), eta, min_gameweeks)
+	if n_candidates is None:
+		n_candidates = eta ** (len(horizons) - 1) * max(len(tuner.tuner_params.x0), 3)
+	candidates = _sample_candidates(tuner, n_candidates, rng)
+	return _run_brackets(tuner, pool, [(candidates, horizons)], eta)
+
+
+def hyperband(tuner, pool=None, eta=3, min_gameweeks=4, seed=None):
+	""" Hyperband: successive halving brackets that trade off the number of candidates against how short the
+		horizon they start at is, from many candidates on min_gameweeks down to a few scored on the full season only.
+	"""
+	rng = np.random.RandomState(seed)
+	horizons = _rung_horizons(len(tuner.gameweek_list), eta, min_gameweeks)
+	s_max = len(horizons) - 1
+	n_params = max(len(tuner.tuner_params.x0), 3)
+
+	brackets = []
+	for s in range(s_max, -1, -1):
+		n_candidates = int(math.ceil(n_params * (s_max + 1) / (s + 1) * eta ** s))
+		brackets.append((_sample_candidates(tuner, n_candidates, rng), horizons[s_max - s:]))
+	return _run_brackets(tuner, pool, brackets, eta)
+
+
+def _run_brackets(tuner, pool, brackets, eta):
+	n_full = len(tuner.gameweek_list)
+	best_x, best_cost = None, np.inf
+	nfev = 0
+	n_full_replays = 0.
+
+	try:
+		for bracket, (candidates, horizons) in enumerate(brackets):
+			for rung, horizon in enumerate(horizons):
+				tuner.set_horizon(None if horizon == n_full else horizon)
+				costs = tuner.evaluate_population(candidates, pool)
+				nfev += len(candidates)
+				n_full_replays += len(candidates) * horizon / n_full
+
+				order = np.argsort(costs)
+				logger.info('Bracket {} rung {}: scored {} candidates on {} of {} gameweeks, best cost {:.7f}'.format(
+					bracket, rung, len(candidates), horizon, n_full, costs[order[0]]))
+
+				if horizon == n_full:
+					if costs[order[0]] < best_cost:
+						best_x, best_cost = candidates[order[0]], costs[order[0]]
+				else:
+					candidates = candidates[order[:max(1, len(candidates) // eta)]]
+	finally:
+		tuner.set_horizon(None)
+
+	logger.info('Ran {} evaluations, equivalent to {:.1f} full season replays'.format(nfev, n_full_replays))
+	if best_x is None:
+		# every candidate scored on the full season failed, so there is nothing better than where we started
+		logger.info('No candidate ran on the full season, keeping the initial parameters')
+		return OptimizeResult(
+			x=np.array(tuner.tuner_params.x0, dtype=float),
+			fun=best_cost,
+			nfev=nfev,
+			nit=len(brackets),
+			n_full_replays=n_full_replays,
+			success=False,
+			message='No candidate ran on the full season in {} bracket(s)'.format(len(brackets)),
+		)
+
+	tuner.log_population_best(best_x, best_cost)
+	return OptimizeResult(
+		x=best_x,
+		fun=best_cost,
+		nfev=nfev,
+		nit=len(brackets),
+		n_full_replays=n_full_replays,
+		success=True,
+		message='Finished {} bracket(s)'.format(len(brackets)),
+	)
+
+
+def _rung_horizons(n_full, eta, min_gameweeks):
+	""" Horizons (numbers of gameweeks) growing by a factor eta from at least min_gameweeks to the full season.
+	"""
+	n_rungs = 1 + max(0, int(math.floor(math.log(n_full / min_gameweeks, eta)))) if n_full > min_gameweeks else 1
+	return [int(round(n_full / eta ** (n_rungs - 1 - k))) for k in range(n_rungs)]
+
+
+def _sample_candidates(tuner, n_candidates, rng):
+	lower, upper = np.array(tuner.tuner_params.get_search_bounds()).T
+	candidates = latin_hypercube(n_candidates, len(lower), rng) * (upper - lower) + lower
+	candidates[0] = np.clip(tuner.tuner_params.x0, lower, upper)
+	return candidates
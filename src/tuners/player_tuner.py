@@ -1,9 +1,14 @@
+import math
+
 import numpy as np
+from scipy.optimize import minimize, OptimizeResult
 
 from src.load.load import load
+from src.models.player_percentages.player_particle_backtest import PlayerParticleBacktest
 from src.models.player_percentages.player_ratings_backtest import PlayerRatingsBacktest
 from src.logger import logger
 from src.tuners.tuner import Tuner
+from src.tuners.tuner_params import PARAM_LAYOUT
 from src.utils import CrazyParameters
 
 
@@ -25,31 +30,154 @@ class PlayerTuner(Tuner):
 		"player_goal_P0",
 	)
 
-	def __init__(self, data, fixed_params, only_do, method, tol, use_multi_grad, save_output):
-		super().__init__(data, fixed_params, only_do, method, tol, use_multi_grad, save_output)
-
-		self.pids = data.player_id.values
-		self.team_goals = data.player_team_goals_scored.values
-		self.team_assists = data.player_team_assists.values
-		self.player_goals = data.goals_scored.values
-		self.player_assists = data.assists.values
-		self.positions = data.position_id.values
+	# Name of the backtest array holding each row's gameweek
+	gameweek_array = 'gameweeks'
+
+	# Goalkeepers never reach the filters, so the x0_gks parameters have no blocks
+	block_positions = {2: 'def', 3: 'mid', 4: 'att'}
+
+	backtest_class = PlayerRatingsBacktest
+
+	@staticmethod
+	def extract_arrays(data):
+		return dict(
+			pids=data.player_id.values,
+			team_goals=data.player_team_goals_scored.values,
+			# assists are mapped in with dict.get, so can come through as an object array
+			team_assists=data.player_team_assists.values.astype(float),
+			player_goals=data.goals_scored.values,
+			player_assists=data.assists.values,
+			positions=data.position_id.values,
+			gameweeks=data.gameweek.values,
+		)
+
+	def bind_arrays(self, arrays):
+		super().bind_arrays(arrays)
+		self.horizon_arrays = arrays
+		self.block_rows = self._get_block_rows()
+
+	def _get_block_rows(self):
+		""" The rows each (model, position) block of the cost is made up of, where a player belongs to the block of
+			the position they had when the model's filter first saw them, and (model, None) is all of the model's rows.
+		"""
+		updated = (self.positions != 1) & (self.team_goals > 0)
+		block_rows = {}
+		for model, model_updated in (('goal', updated), ('assist', updated & (self.team_assists > 0))):
+			rows = np.flatnonzero(model_updated)
+			_, first, inverse = np.unique(self.pids[rows], return_index=True, return_inverse=True)
+			player_positions = self.positions[rows][first][inverse]
+
+			block_rows[(model, None)] = rows
+			for position in self.block_positions:
+				block_rows[(model, position)] = rows[player_positions == position]
+		return block_rows
+
+	@property
+	def gameweek_list(self):
+		return sorted(np.unique(self.gameweeks).tolist())
+
+	def set_horizon(self, n_gameweeks):
+		""" Each player's filter only ever looks at their own rows, in order, so restricting to the rows in the first
+			n_gameweeks is equivalent to stopping the season there.
+		"""
+		super().set_horizon(n_gameweeks)
+		if n_gameweeks is None:
+			self.horizon_arrays = self.arrays
+		else:
+			keep = self.gameweeks <= self.gameweek_list[n_gameweeks - 1]
+			self.horizon_arrays = {k: v[keep] for k, v in self.arrays.items()}
+
+	def run_backtest(self, params, record_gameweeks=False):
+		arrays = self.horizon_arrays
+		bt = self.backtest_class(
+			params=params,
+			pids=arrays['pids'],
+			player_goals=arrays['player_goals'],
+			player_assists=arrays['player_assists'],
+			team_goals=arrays['team_goals'],
+			team_assists=arrays['team_assists'],
+			positions=arrays['positions'],
+			gameweeks=arrays['gameweeks'],
+			record_gameweeks=record_gameweeks
+		)
+		bt.run_backtest()
+		return bt
+
+	def run_block_backtest(self, params, model, position=None):
+		""" Runs only the model's filters of the players in the given position's block (or all of them), which on
+			their own make up that block's part of the log likelihood.
+		"""
+		rows = self.block_rows[(model, position)]
+		bt = self.backtest_class(
+			params=params,
+			pids=self.pids[rows],
+			player_goals=self.player_goals[rows],
+			player_assists=self.player_assists[rows],
+			team_goals=self.team_goals[rows],
+			team_assists=self.team_assists[rows],
+			positions=self.positions[rows],
+			gameweeks=self.gameweeks[rows],
+			models=(model,)
+		)
+		bt.run_backtest()
+		return getattr(bt, model + '_ratings')
+
+	def parameter_blocks(self):
+		""" The independent blocks of optimised parameters: each model's x0 for each position, which only its own
+			players' filters see, and then each model's P0 and Q, which are shared across positions.
+		"""
+		optimise_params = self.tuner_params.optimise_params
+		x0_blocks = [
+			(['player_{}_x0_{}'.format(model, name)], model, position)
+			for model in ('goal', 'assist') for position, name in self.block_positions.items()
+			if 'player_{}_x0_{}'.format(model, name) in optimise_params
+		]
+		shared_blocks = [
+			([k for k in ('player_{}_P0'.format(model), 'player_{}_Q'.format(model)) if k in optimise_params], model, None)
+			for model in ('goal', 'assist')
+		]
+		return x0_blocks, [block for block in shared_blocks if block[0]]
+
+	def run_decomposed(self, pool, n_sweeps=10, maxiter=None):
+		""" Block coordinate descent over parameter_blocks: all of the x0 blocks are tuned in parallel with P0 and Q
+			held, then each model's P0 and Q in parallel with the x0s held, until a sweep no longer improves the cost by
+			more than tol. The log likelihood is a sum over the blocks and the number of observations does not depend on
+			the parameters, so each block can be tuned on its own part of the cost.
+		"""
+		x = np.array(self.tuner_params.x0, dtype=float)
+		cost = self.evaluate_cost(x)
+		self.record_evaluation(x, cost)
+		logger.info('Decomposed tuning from cost {:.7f}'.format(cost))
+
+		nfev = 1
+		for sweep in range(n_sweeps):
+			for blocks in self.parameter_blocks():
+				jobs = [(x, names, model, position, self.tol, maxiter) for names, model, position in blocks]
+				for names, values, block_nfev in pool.apply(_tune_block, jobs):
+					x[[self.tuner_params.optimise_params.index(k) for k in names]] = values
+					nfev += block_nfev
+
+			new_cost = self.evaluate_cost(x)
+			nfev += 1
+			self.record_evaluation(x, new_cost)
+			self.to_save_params.update_using_opt_array(x)
+			self.save_checkpoint()
+			logger.info('Decomposed sweep {}: cost {:.7f}'.format(sweep, new_cost))
+
+			improvement = cost - new_cost
+			cost = new_cost
+			if improvement <= self.tol:
+				break
+
+		return OptimizeResult(x=x, fun=cost, nfev=nfev, nit=sweep + 1, success=True,
+							  message='Finished {} block coordinate sweep(s)'.format(sweep + 1))
 
 	def compute_emll(self, params):
 		try:
-			bt = PlayerRatingsBacktest(
-				params=params,
-				pids=self.pids,
-				player_goals=self.player_goals,
-				player_assists=self.player_assists,
-				team_goals=self.team_goals,
-				team_assists=self.team_assists,
-				positions=self.positions
-			)
-			bt.run_backtest()
+			bt = self.run_backtest(params)
 		except CrazyParameters:
 			logger.info('Following params produced math error, change param bounds!!')
-			for k, v in params.items():
+			for k, v in PARAM_LAYOUT.to_dict(params).items():
 				logger.info('\t\t{:20} {}'.format(k, v))
 
 			raise ValueError
@@ -64,10 +192,43 @@ class PlayerTuner(Tuner):
 		return np.NaN
 
 
-def optimise_players(method='Nelder-Mead', only_do=[], fixed_params=[], tol=1e-7, use_multigrad=False):
+class PlayerParticleTuner(PlayerTuner):
+	""" Tunes the particle filter versions of the player models, with the same parameters. Each backtest draws from
+		the same seed, so that the cost is a deterministic function of the parameters.
+	"""
+
+	backtest_class = PlayerParticleBacktest
+
+
+def _tune_block(tuner, job):
+	x, names, model, position, tol, maxiter = job
+	columns = [tuner.tuner_params.optimise_params.index(k) for k in names]
+
+	def fun(values):
+		opt_array = x.copy()
+		opt_array[columns] = values
+		params = tuner.tuner_params.bind(opt_array)
+		try:
+			ratings = tuner.run_block_backtest(params, model, position)
+		except (ValueError, ArithmeticError, CrazyParameters):
+			return np.inf
+		emll, _ = tuner.penalise_boundaries(math.exp(ratings.tot_log_lhood / ratings.n_obs), params)
+		return -emll
+
+	optimal = minimize(fun, x0=x[columns], method='Nelder-Mead', tol=tol, options=dict(maxiter=maxiter))
+	return names, optimal.x, optimal.nfev
+
+
+def optimise_players(method='Nelder-Mead', only_do=[], fixed_params=[], tol=1e-7, use_multigrad=False, n_processes=None,
+					 use_cache=True, save_policy='prompt', resume=False):
 	data = load()['all_player_data']
 
-	tuner = PlayerTuner(data, fixed_params, only_do, method, tol, use_multigrad, save_output=True)
+	tuner = PlayerTuner(
+		data, fixed_params, only_do, method, tol, use_multigrad, save_output=True, n_processes=n_processes,
+		use_cache=use_cache,
+		save_policy=save_policy,
+		resume=resume
+	)
 
 	tuner.run_tuner()
 
@@ -0,0 +1,121 @@
+""" Population based optimiser backends for the tuners. Unlike the scipy.optimize.minimize methods these propose a whole
+	population of parameter vectors at a time, which are then evaluated concurrently.
+"""
+import time
+
+import numpy as np
+from scipy.optimize import OptimizeResult
+
+from src.logger import logger
+
+POPULATION_METHODS = ('differential-evolution',)
+
+
+def differential_evolution(tuner, pool=None, popsize=15, mutation=(0.5, 1.), recombination=0.7, maxiter=1000,
+						   tol=None, atol=0., seed=None, initial_population=None, initial_costs=None):
+	""" DE/rand/1/bin with 'deferred' updating: each generation's trial vectors are all proposed before any of them is
+		evaluated, so that the whole generation can be farmed out to the TunerPool in one go. The search box comes from
+		TunerParams.get_search_bounds and the initial population always contains the current parameters.
+
+			:param tuner:           Tuner whose evaluate_population() is minimised
+			:param pool:            Optional TunerPool to evaluate populations with
+			:param popsize:         Population size as a multiple of the number of optimised parameters
+			:param mutation:        Differential weight, dithered uniformly within the range each generation
+			:param recombination:   Crossover probability
+			:param tol:             Relative convergence tolerance on the spread of the population's costs
+			:param initial_population:  Population (and its costs) to carry on from, e.g. from a checkpoint
+			:return:                scipy OptimizeResult
+	"""
+	rng = np.random.RandomState(seed)
+	tol = tuner.tol if tol is None else tol
+
+	lower, upper = np.array(tuner.tuner_params.get_search_bounds()).T
+	n_params = len(lower)
+	n_members = max(5, popsize * n_params)
+
+	if initial_population is None:
+		population = latin_hypercube(n_members, n_params, rng) * (upper - lower) + lower
+		population[0] = np.clip(tuner.tuner_params.x0, lower, upper)
+		costs = tuner.evaluate_population(population, pool)
+		nfev = n_members
+	else:
+		population, costs = np.array(initial_population), np.array(initial_costs)
+		n_members = len(population)
+		nfev = 0
+
+	nit = 0
+	message = 'Maximum number of iterations has been exceeded.'
+	for nit in range(1, maxiter + 1):
+		weight = rng.uniform(*mutation) if isinstance(mutation, tuple) else mutation
+
+		# pick three distinct donors for each member, none of which is the member itself
+		donors = np.argsort(rng.random_sample((n_members, n_members)) + np.eye(n_members), axis=1)[:, :3]
+		mutants = population[donors[:, 0]] + weight * (population[donors[:, 1]] - population[donors[:, 2]])
+
+		crossover = rng.random_sample((n_members, n_params)) < recombination
+		crossover[np.arange(n_members), rng.randint(n_params, size=n_members)] = True
+		trials = np.clip(np.where(crossover, mutants, population), lower, upper)
+
+		trial_costs = tuner.evaluate_population(trials, pool)
+		nfev += n_members
+
+		improved = trial_costs <= costs
+		population[improved] = trials[improved]
+		costs[improved] = trial_costs[improved]
+
+		tuner.log_population_best(population[np.argmin(costs)], costs.min())
+		tuner.save_checkpoint(population=population, population_costs=costs)
+
+		if np.std(costs) <= atol + tol * np.abs(np.mean(costs)):
+			message = 'Optimization terminated successfully.'
+			break
+
+	best = np.argmin(costs)
+	return OptimizeResult(
+		x=population[best],
+		fun=costs[best],
+		nfev=nfev,
+		nit=nit,
+		success=message.startswith('Optimization terminated'),
+		message=message,
+	)
+
+
+def latin_hypercube(n_samples, n_dims, rng):
+	""" Latin hypercube sample of the unit cube.
+	"""
+	strata = np.argsort(rng.random_sample((n_samples, n_dims)), axis=0)
+	return (strata + rng.random_sample((n_samples, n_dims))) / n_samples
+
+
+def compare_optimisers(tuner_class, data, methods=('Nelder-Mead', 'differential-evolution'), **tuner_kwargs):
+	""" Runs each of the methods from the same starting parameters on the same data, without writing anything to
+		file, and logs the wall clock time, number of evaluations and cost each one reached.
+	"""
+	fixed_params = tuner_kwargs.pop('fixed_params', [])
+	only_do = tuner_kwargs.pop('only_do', [])
+	tol = tuner_kwargs.pop('tol', 1e-7)
+
+	results = {}
+	for method in methods:
+		tuner = tuner_class(
+			data=data,
+			fixed_params=fixed_params,
+			only_do=only_do,
+			method=method,
+			tol=tol,
+			use_multi_grad=False,
+			save_output=False,
+			**tuner_kwargs
+		)
+		took = -time.time()
+		tuner.run_tuner()
+		took += time.time()
+		results[method] = dict(wall_time=took, nfev=tuner.last_result.nfev, cost=tuner.last_result.fun)
+
+	logger.info('')
+	logger.info('{:>25} {:>12} {:>10} {:>14}'.format('method', 'wall time', 'nfev', 'cost'))
+	for method, result in results.items():
+		logger.info('{:>25} {:>11.1f}s {:>10} {:>14.7f}'.format(
+			method, result['wall_time'], result['nfev'], result['cost']))
+	return results
@@ -0,0 +1,57 @@
+""" A small registry for publishing the tuners' backtest arrays into shared memory, so that worker processes can
+	attach them zero-copy and only parameter vectors have to cross process boundaries.
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedArrays:
+
+	def __init__(self, arrays):
+		""" Copies each array of the dict `arrays` into its own shared memory block. The picklable `spec` is all a
+			worker needs to attach them again with `attach_shared_arrays`.
+		"""
+		self.blocks = {}
+		self.spec = {}
+		for name, array in arrays.items():
+			array = np.ascontiguousarray(array)
+			if array.dtype.hasobject:
+				raise ValueError('Cannot publish array {} with object dtype to shared memory'.format(name))
+			block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+			shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+			shared[...] = array
+			self.blocks[name] = block
+			self.spec[name] = (block.name, array.shape, array.dtype.str)
+
+	def close(self):
+		""" Releases and unlinks all of the blocks. Only the publishing process should call this.
+		"""
+		for block in self.blocks.values():
+			block.close()
+			block.unlink()
+		self.blocks = {}
+		self.spec = {}
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+
+def attach_shared_arrays(spec):
+	""" Attaches to the blocks described by `spec`. Returns the dict of arrays together with the block handles, which
+		must be kept alive for as long as the arrays are in use. Workers are expected to be children of the publisher
+		so that they share its resource tracker, and hence never unlink the blocks themselves.
+	"""
+	arrays = {}
+	handles = []
+	for name, (block_name, shape, dtype) in spec.items():
+		block = shared_memory.SharedMemory(name=block_name)
+		array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+		array.flags.writeable = False
+		arrays[name] = array
+		handles.append(block)
+	return arrays, handles
+
@@ -0,0 +1,227 @@
+""" Surrogate model optimiser backend for the tuners, for when each backtest replay is expensive. A Gaussian process
+	is fitted to the costs evaluated around the best parameters so far, and the next batch of parameters is chosen by
+	maximising expected improvement within a trust region around them, with the batch filled out by the constant liar
+	heuristic so that it can be evaluated in parallel. The trust region grows while batches improve on the best cost
+	and shrinks while they do not, which is what lets the search home in on the optimum to the tuner's tolerance.
+"""
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve, solve_triangular
+from scipy.optimize import minimize, OptimizeResult
+from scipy.spatial.distance import cdist
+from scipy.stats import norm
+
+from src.logger import logger
+from src.tuners.population_optimiser import latin_hypercube
+
+SURROGATE_METHODS = ('surrogate',)
+
+
+class GaussianProcess:
+	""" Zero mean Gaussian process on the unit cube with a Matern 5/2 kernel, one length scale per dimension, and
+		hyperparameters fitted by maximising the marginal likelihood of the (standardised) targets.
+	"""
+
+	def __init__(self, n_dims):
+		self.n_dims = n_dims
+		# log length scales, log signal variance and log noise variance
+		self.theta = np.concatenate([np.full(n_dims, np.log(0.3)), [0., np.log(1e-4)]])
+		self.theta_bounds = [(np.log(1e-2), np.log(1e1))] * n_dims + [(np.log(1e-2), np.log(1e2)), (np.log(1e-8), np.log(1e-1))]
+
+	def kernel(self, A, B, theta=None):
+		theta = self.theta if theta is None else theta
+		length_scales = np.exp(theta[:self.n_dims])
+		s = np.sqrt(5.) * cdist(A / length_scales, B / length_scales)
+		return np.exp(theta[self.n_dims]) * (1 + s + s ** 2 / 3) * np.exp(-s)
+
+	def fit(self, X, y, fit_hyperparameters=True):
+		self.X = np.array(X, dtype=float)
+		self.y_mean = y.mean()
+		self.y_std = y.std() if y.std() > 0 else 1.
+		self.z = (y - self.y_mean) / self.y_std
+
+		if fit_hyperparameters:
+			starts = [self.theta, GaussianProcess(self.n_dims).theta]
+			fits = [minimize(self._neg_log_marginal_likelihood, start, method='L-BFGS-B', bounds=self.theta_bounds)
+					for start in starts]
+			self.theta = min(fits, key=lambda fit: fit.fun).x
+		self._factorise()
+		return self
+
+	def add_points(self, X, y):
+		""" Conditions on extra points without refitting the hyperparameters, or the standardisation.
+		"""
+		self.X = np.vstack([self.X, X])
+		self.z = np.concatenate([self.z, (np.asarray(y) - self.y_mean) / self.y_std])
+		self._factorise()
+
+	def predict(self, X):
+		""" Posterior mean and standard deviation at the rows of X.
+		"""
+		K_star = self.kernel(X, self.X)
+		mean = K_star @ self.alpha
+		v = solve_triangular(self.L, K_star.T, lower=True)
+		var = np.maximum(np.exp(self.theta[self.n_dims]) - np.sum(v ** 2, axis=0), 1e-12)
+		return self.y_mean + self.y_std * mean, self.y_std * np.sqrt(var)
+
+	def _covariance(self, theta):
+		return self.kernel(self.X, self.X, theta) + (np.exp(theta[-1]) + 1e-10) * np.eye(len(self.X))
+
+	def _factorise(self):
+		self.L = np.linalg.cholesky(self._covariance(self.theta))
+		self.alpha = cho_solve((self.L, True), self.z)
+
+	def _neg_log_marginal_likelihood(self, theta):
+		try:
+			factor = cho_factor(self._covariance(theta), lower=True)
+		except np.linalg.LinAlgError:
+			return 1e10
+		alpha = cho_solve(factor, self.z)
+		return 0.5 * self.z @ alpha + np.sum(np.log(np.diag(factor[0])))
+
+
+def expected_improvement(mean, std, best, xi=0.):
+	""" Expected improvement on best (a minimum) of a normal with the given mean and standard deviation.
+	"""
+	improvement = best - mean - xi
+	z = improvement / std
+	return improvement * norm.cdf(z) + std * norm.pdf(z)
+
+
+def surrogate(tuner, pool=None, batch_size=None, n_initial=None, maxfev=None, n_candidates=2000, seed=None,
+			  initial_x=None, initial_costs=None):
+	""" Bayesian optimisation starting from a latin hypercube over the tuner's search box (plus the current
+		parameters). Each iteration proposes batch_size points and evaluates them in parallel, until maxfev evaluations
+		or the trust region has shrunk to nothing. Where the best point lies at the edge of the search box, and that
+		edge is not one of the parameter's bounds, the box is widened on that side.
+	"""
+	rng = np.random.RandomState(seed)
+	lower, upper = np.array(tuner.tuner_params.get_search_bounds()).T
+	hard_lower, hard_upper = np.array([
+		(-np.inf if lo is None else lo, np.inf if hi is None else hi) for lo, hi in tuner.tuner_params.optimise_bounds
+	]).T
+	n_dims = len(lower)
+	batch_size = (pool.n_processes if pool is not None else 1) if batch_size is None else batch_size
+	n_initial = 2 * n_dims + 1 if n_initial is None else n_initial
+	maxfev = 100 * (n_dims + 1) if maxfev is None else maxfev
+
+	if initial_x is None:
+		X = lower + latin_hypercube(n_initial, n_dims, rng) * (upper - lower)
+		X[0] = np.clip(tuner.tuner_params.x0, lower, upper)
+		costs = tuner.evaluate_population(X, pool)
+	else:
+		X, costs = np.asarray(initial_x), np.asarray(initial_costs)
+		lower, upper = np.minimum(lower, X.min(axis=0)), np.maximum(upper, X.max(axis=0))
+
+	region = TrustRegion(n_dims, batch_size, tol=0. if tuner.tol is None else tuner.tol)
+	gp = GaussianProcess(n_dims)
+	n_iterations = 0
+	while len(costs) < maxfev and not region.converged:
+		tuner.save_checkpoint(surrogate_x=X, surrogate_costs=costs)
+		lower, upper = _widen_box(X[np.argmin(costs)], lower, upper, hard_lower, hard_upper)
+
+		U = (X - lower) / (upper - lower)
+		batch = _propose_batch(gp, U, costs, region.length, min(batch_size, maxfev - len(costs)), n_candidates, rng)
+		batch = lower + batch * (upper - lower)
+		batch_costs = tuner.evaluate_population(batch, pool)
+
+		region.update(costs.min(), batch_costs.min())
+		X, costs = np.vstack([X, batch]), np.concatenate([costs, batch_costs])
+		n_iterations += 1
+		logger.info('Surrogate iteration {}: {} evaluations, best cost {:.7f}, trust region {:.2e}'.format(
+			n_iterations, len(costs), costs.min(), region.length))
+
+	best = np.argmin(costs)
+	tuner.log_population_best(X[best], costs[best])
+	return OptimizeResult(
+		x=X[best],
+		fun=costs[best],
+		nfev=len(costs),
+		nit=n_iterations,
+		success=np.isfinite(costs[best]),
+		message='Trust region converged' if region.converged else 'Reached maxfev',
+	)
+
+
+class TrustRegion:
+	""" Side length (on the unit cube) of the box around the best point that proposals are drawn from. It doubles
+		after successive improving batches and halves after successive failing ones.
+	"""
+
+	def __init__(self, n_dims, batch_size, tol, length=0.8, min_length=2 ** -10, max_length=1.6):
+		self.length = length
+		self.min_length = min_length
+		self.max_length = max_length
+		self.tol = tol
+		self.success_tolerance = 3
+		self.failure_tolerance = max(4, int(np.ceil(n_dims / batch_size)))
+		self.n_successes = 0
+		self.n_failures = 0
+
+	@property
+	def converged(self):
+		return self.length < self.min_length
+
+	def update(self, best_cost, batch_best_cost):
+		if batch_best_cost < best_cost - self.tol:
+			self.n_successes, self.n_failures = self.n_successes + 1, 0
+		else:
+			self.n_successes, self.n_failures = 0, self.n_failures + 1
+
+		if self.n_successes == self.success_tolerance:
+			self.length, self.n_successes = min(2 * self.length, self.max_length), 0
+		elif self.n_failures == self.failure_tolerance:
+			self.length, self.n_failures = self.length / 2, 0
+
+
+def _widen_box(x, lower, upper, hard_lower, hard_upper, edge=0.02):
+	""" Doubles the width of the search box on any side x lies within edge (as a fraction of the width) of, up to the
+		parameters' bounds.
+	"""
+	width = upper - lower
+	at_lower = (x - lower < edge * width) & (lower > hard_lower)
+	at_upper = (upper - x < edge * width) & (upper < hard_upper)
+	lower = np.where(at_lower, np.maximum(lower - width, hard_lower), lower)
+	upper = np.where(at_upper, np.minimum(upper + width, hard_upper), upper)
+	return lower, upper
+
+
+def _propose_batch(gp, U, costs, length, batch_size, n_candidates, rng):
+	""" Maximises expected improvement over the trust region for the first point, then conditions the process on it
+		having the best cost seen so far (the constant liar) before choosing the next, and so on. The process is
+		fitted to the points nearest the incumbent only, which both keeps the fit local and bounds its cost.
+	"""
+	n_dims = U.shape[1]
+	# failed backtests are inf, which the process cannot fit, so they are treated as the worst finite cost
+	finite = np.isfinite(costs)
+	y = np.where(finite, costs, costs[finite].max() if finite.any() else 0.)
+	incumbent = U[np.argmin(y)]
+
+	nearest = np.argsort(np.abs(U - incumbent).max(axis=1))[:20 * (n_dims + 1)]
+	gp.fit(U[nearest], y[nearest])
+
+	# the region's shape follows the fitted length scales, as in TuRBO
+	weights = np.exp(gp.theta[:n_dims])
+	weights = weights / np.prod(weights) ** (1 / n_dims)
+	region_lower = np.clip(incumbent - weights * length / 2, 0., 1.)
+	region_upper = np.clip(incumbent + weights * length / 2, 0., 1.)
+
+	best = y.min()
+	batch = []
+	for _ in range(batch_size):
+		candidates = region_lower + latin_hypercube(n_candidates, n_dims, rng) * (region_upper - region_lower)
+		mean, std = gp.predict(candidates)
+		acquisition = expected_improvement(mean, std, best)
+
+		def neg_acquisition(u):
+			mean, std = gp.predict(u[None, :])
+			return -expected_improvement(mean, std, best)[0]
+
+		polished = [
+			minimize(neg_acquisition, candidates[i], method='L-BFGS-B', bounds=list(zip(region_lower, region_upper)))
+			for i in np.argsort(-acquisition)[:3]
+		]
+		proposal = min(polished, key=lambda fit: fit.fun).x
+
+		batch.append(proposal)
+		gp.add_points(proposal[None, :], [best])
+	return np.array(batch)
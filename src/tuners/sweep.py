@@ -0,0 +1,121 @@
+""" Sweeps of the tuners' cost surface over a subset of the optimised parameters, the rest being held at their current
+	values. Costs are written to a memory-mapped .npy array as each chunk of the design is evaluated, NaN marking the
+	points still to do, so that a crashed sweep picks up where it stopped. The array is keyed, like the evaluation
+	caches, on the tuner's fingerprint and the held values, so a sweep only resumes one over the same cost surface.
+"""
+import itertools
+import os
+
+import numpy as np
+
+from src.logger import logger, validate_path
+from src.paths import paths
+from src.tuners.evaluation_cache import data_fingerprint
+from src.tuners.population_optimiser import latin_hypercube
+from src.tuners.tuner_pool import TunerPool
+
+
+class ParameterSweep:
+
+	def __init__(self, tuner, names, design='grid', n_points=11, ranges=None, spread=1., seed=0, name=None,
+				 folder=paths['cache'] + 'sweeps/'):
+		""" The design is either a 'grid' of n_points per parameter, or a 'latin-hypercube' of n_points in total, over
+			ranges ({name: (lower, upper)}) or else the tuner's search bounds with the given spread.
+		"""
+		optimise_params = list(tuner.tuner_params.optimise_params)
+		unknown = [k for k in names if k not in optimise_params]
+		if unknown:
+			raise ValueError('Can only sweep optimised parameters (see only_do), not {}'.format(unknown))
+
+		self.tuner = tuner
+		self.names = list(names)
+		self.columns = [optimise_params.index(k) for k in self.names]
+		# the values the other parameters are held at, and everything else the costs depend on
+		self.x0 = np.array(tuner.tuner_params.x0, dtype=float)
+		self.key = data_fingerprint(dict(held=np.delete(self.x0, self.columns)), tuner.fingerprint())
+
+		search_bounds = tuner.tuner_params.get_search_bounds(spread)
+		ranges = {} if ranges is None else ranges
+		self.bounds = np.array([ranges.get(k, search_bounds[c]) for k, c in zip(self.names, self.columns)], dtype=float)
+		self.points = self._design(design, n_points, np.random.RandomState(seed))
+
+		name = '_'.join([type(tuner).__name__, design] + self.names + [self.key]) if name is None else name
+		self.costs_path = folder + name + '.npy'
+		self.points_path = folder + name + '.points.npy'
+		self.key_path = folder + name + '.key.npy'
+		validate_path(self.costs_path)
+
+	def _design(self, design, n_points, rng):
+		lower, upper = self.bounds.T
+		if design == 'grid':
+			axes = [np.linspace(lo, hi, n_points) for lo, hi in self.bounds]
+			return np.array(list(itertools.product(*axes)))
+		if design == 'latin-hypercube':
+			return latin_hypercube(n_points, len(self.names), rng) * (upper - lower) + lower
+		raise ValueError('Unknown sweep design {}, must be grid or latin-hypercube'.format(design))
+
+	def opt_arrays(self, points):
+		""" Full optimiser vectors for the design points, other parameters held at the tuner's values when the sweep
+			was made.
+		"""
+		opt_arrays = np.tile(self.x0, (len(points), 1))
+		opt_arrays[:, self.columns] = points
+		return opt_arrays
+
+	def run(self, n_processes=None, chunk_size=None):
+		""" Evaluates the points of the design not yet in the result array, chunk by chunk, and returns the design
+			points along with the (memory-mapped) array of costs (i.e. -emll, inf where the backtest failed).
+		"""
+		costs = self._open_costs()
+		to_run = np.flatnonzero(np.isnan(costs))
+		logger.info('Sweeping {} over {} of {} points'.format(', '.join(self.names), len(to_run), len(self.points)))
+		if len(to_run):
+			self._evaluate(costs, to_run, n_processes, chunk_size)
+
+		best = np.argmin(costs)
+		logger.info('Best swept point: {}, cost {:.7f}'.format(
+			', '.join('{}={:.6g}'.format(k, v) for k, v in zip(self.names, self.points[best])), costs[best]))
+		return self.points, costs
+
+	def _evaluate(self, costs, to_run, n_processes, chunk_size):
+		""" Evaluates the design points to_run across a TunerPool, writing their costs as each chunk finishes.
+		"""
+		try:
+			with TunerPool(self.tuner, n_processes=n_processes) as pool:
+				chunk_size = 8 * pool.n_processes if chunk_size is None else chunk_size
+				for start in range(0, len(to_run), chunk_size):
+					chunk = to_run[start:start + chunk_size]
+					result = pool.map(self.opt_arrays(self.points[chunk]))
+					# a failed backtest is recorded as inf, so that it is not retried on resuming
+					costs[chunk] = np.where(np.isnan(result), np.inf, result)
+					costs.flush()
+					logger.info('Swept {} of {} points'.format(start + len(chunk), len(to_run)))
+		finally:
+			self.tuner.release_arrays()
+
+	def _open_costs(self):
+		""" Reopens the result array of an earlier sweep with the same design and key, or else starts a new one.
+		"""
+		if all(os.path.exists(path) for path in (self.costs_path, self.points_path, self.key_path)):
+			if np.array_equal(np.load(self.points_path), self.points) and str(np.load(self.key_path)) == self.key:
+				costs = np.load(self.costs_path, mmap_mode='r+')
+				logger.info('Resuming sweep from {}, {} points already done'.format(
+					self.costs_path, np.sum(~np.isnan(costs))))
+				return costs
+			logger.info('Overwriting sweep in {} made with a different design, tuner or held values'.format(
+				self.costs_path))
+
+		np.save(self.points_path, self.points)
+		np.save(self.key_path, np.array(self.key))
+		costs = np.lib.format.open_memmap(self.costs_path, mode='w+', dtype=float, shape=(len(self.points),))
+		costs[:] = np.nan
+		costs.flush()
+		return costs
+
+	def surface(self):
+		""" For grid sweeps, the costs reshaped to one axis per swept parameter, along with the axes' values.
+		"""
+		n_points = int(round(len(self.points) ** (1 / len(self.names))))
+		costs = np.load(self.costs_path)
+		axes = [np.linspace(lo, hi, n_points) for lo, hi in self.bounds]
+		return axes, costs.reshape([n_points] * len(self.names))
@@ -4,7 +4,8 @@ from src.load.load import load
 from src.models.team_ratings.team_ratings_backtest import TeamRatingsBacktest
 from src.logger import logger
 from src.tuners.tuner import Tuner
-from src.utils import CrazyParameters
+from src.tuners.tuner_params import PARAM_LAYOUT
+from src.utils import CrazyParameters, group_indices
 
 
 class TeamTuner(Tuner):
@@ -23,30 +24,53 @@ class TeamTuner(Tuner):
 		"team_rating_variance",
 	)
 
-	def __init__(self, data, fixed_params, only_do, method, tol, use_multi_grad, save_output):
-		super().__init__(data, fixed_params, only_do, method, tol, use_multi_grad, save_output)
-
-		self.home_ids = data.home_id.values
-		self.away_ids = data.away_id.values
-		self.home_goals = data.fthg.values
-		self.away_goals = data.ftag.values
-
-		self.groupby_dict = data.groupby('gw').indices
+	# Name of the backtest array holding each row's gameweek
+	gameweek_array = 'gws'
+
+	@staticmethod
+	def extract_arrays(data):
+		return dict(
+			home_ids=data.home_id.values,
+			away_ids=data.away_id.values,
+			home_goals=data.fthg.values,
+			away_goals=data.ftag.values,
+			gws=data.gw.values,
+		)
+
+	def bind_arrays(self, arrays):
+		super().bind_arrays(arrays)
+		self.groupby_dict = group_indices(self.gws)
+		self.horizon_groupby_dict = self.groupby_dict
+
+	@property
+	def gameweek_list(self):
+		return sorted(self.groupby_dict.keys())
+
+	def set_horizon(self, n_gameweeks):
+		super().set_horizon(n_gameweeks)
+		gameweeks = self.gameweek_list if n_gameweeks is None else self.gameweek_list[:n_gameweeks]
+		self.horizon_groupby_dict = {gw: self.groupby_dict[gw] for gw in gameweeks}
+
+	def run_backtest(self, params, sensitivity_params=None, record_gameweeks=False):
+		bt = TeamRatingsBacktest(
+			params=params,
+			home_goals=self.home_goals,
+			away_goals=self.away_goals,
+			home_ids=self.home_ids,
+			away_ids=self.away_ids,
+			groupby_dict=self.horizon_groupby_dict,
+			sensitivity_params=sensitivity_params,
+			record_gameweeks=record_gameweeks
+		)
+		bt.run_backtest()
+		return bt
 
 	def compute_emll(self, params):
 		try:
-			bt = TeamRatingsBacktest(
-				params=params,
-				home_goals=self.home_goals,
-				away_goals=self.away_goals,
-				home_ids=self.home_ids,
-				away_ids=self.away_ids,
-				groupby_dict=self.groupby_dict
-			)
-			bt.run_backtest()
+			bt = self.run_backtest(params)
 		except CrazyParameters:
 			logger.info('Following params produced math error, change param bounds!!')
-			for k, v in params.items():
+			for k, v in PARAM_LAYOUT.to_dict(params).items():
 				logger.info('\t\t{:20} {}'.format(k, v))
 
 			raise ValueError
@@ -57,11 +81,19 @@ class TeamTuner(Tuner):
 		cost, pen_str = self.penalise_boundaries(cost, params, pen_str='')
 		return cost, pen_str
 
+	def compute_emll_and_gradient(self, params):
+		bt = self.run_backtest(params, sensitivity_params=self.tuner_params.optimise_params)
+
+		cost, pen_str = self.penalise_boundaries(bt.cost, params, pen_str='')
+		grad = self.penalise_boundaries_gradient(bt.cost_gradient, params)
+		return cost, pen_str, grad
+
 	def _get_null_model_likelihood(self):
 		return np.NaN
 
 
-def optimise_teams(method='Nelder-Mead', only_do=[], fixed_params=[], tol=1e-7, use_multigrad=False):
+def optimise_teams(method='Nelder-Mead', only_do=[], fixed_params=[], tol=1e-7, use_multigrad=False, use_exact_grad=False,
+				   n_processes=None, use_cache=True, save_policy='prompt', resume=False):
 	data = load()['match_scores']
 
 	tuner = TeamTuner(
@@ -71,7 +103,12 @@ def optimise_teams(method='Nelder-Mead', only_do=[], fixed_params=[], tol=1e-7,
 		method=method,
 		tol=tol,
 		use_multi_grad=use_multigrad,
-		save_output=True
+		save_output=True,
+		use_exact_grad=use_exact_grad,
+		n_processes=n_processes,
+		use_cache=use_cache,
+		save_policy=save_policy,
+		resume=resume
 	)
 
 	tuner.run_tuner()
@@ -1,5 +1,7 @@
 """ Runs the model to find optimal parameters and writes these to file.
 """
+import signal
+import threading
 import time
 from abc import ABC, abstractmethod
 
@@ -7,18 +9,32 @@ import numpy as np
 from scipy.optimize import minimize
 
 from src.logger import logger
-from src.tuners.tuner_params import TunerParams
+from src.profiler import profiler
+from src.tuners import multi_fidelity
+from src.tuners.checkpoint import TunerCheckpoint
+from src.tuners.evaluation_cache import EvaluationCache, data_fingerprint, source_fingerprint
+from src.tuners.evaluation_trace import EvaluationTrace
+from src.tuners.population_optimiser import POPULATION_METHODS, differential_evolution
+from src.tuners.shared_arrays import SharedArrays, attach_shared_arrays
+from src.tuners.surrogate_optimiser import SURROGATE_METHODS, surrogate
+from src.tuners.tuner_params import PARAM_LAYOUT, TunerParams, get_param
+from src.tuners.tuner_pool import TunerPool
 from src.utils import timer, multioptimiser
 
 
 class Tuner(ABC):
 
 	init_params = NotImplemented
+	gameweek_array = NotImplemented
 
-	def __init__(self, data, fixed_params, only_do, method, tol, use_multi_grad, save_output):
+	def __init__(self, data, fixed_params, only_do, method, tol, use_multi_grad, save_output, arrays=None,
+				 use_exact_grad=False, n_processes=None, use_cache=False, save_policy='prompt', checkpoint_every=300.,
+				 resume=False):
 
 		self.data = data
 		self.use_multicore_gradient = use_multi_grad
+		self.use_exact_gradient = use_exact_grad
+		self.n_processes = n_processes
 		self.method = method
 		self.tol = tol
 
@@ -28,47 +44,295 @@ class Tuner(ABC):
 		# prematurely we dont write some speculative (possibly bad) set of parameters to file
 		self.to_save_params = self.tuner_params.__copy__()
 		self.save_output = save_output
+		self.save_policy = save_policy
 		self.bounds_dict = self.tuner_params.get_bounds_dict()
+		self.last_result = None
+
+		# The backtest arrays are only published to shared memory once a parallel path asks for them
+		self.shared_arrays = None
+		self._shared_handles = []
+		self.bind_arrays(self.extract_arrays(data) if arrays is None else arrays)
+
+		# Number of leading gameweeks the backtest is restricted to, None being the full season
+		self.horizon = None
+		self.use_cache = use_cache
+		self.evaluation_caches = {}
+
+		# -- checkpointing -- #
+		self.checkpoint_every = checkpoint_every
+		self.resume = resume
+		self.checkpoint = None
+		self.trace = None
+		self.nfev = 0
+		self.best_x = None
+		self.best_cost = np.inf
+		self._best_points = []
+		self._optimiser_state = {}
+
+	@classmethod
+	def from_shared(cls, spec, fixed_params):
+		""" Builds a tuner inside a worker process from the arrays published by `publish_arrays`.
+		"""
+		arrays, handles = attach_shared_arrays(spec)
+		tuner = cls(
+			data=None,
+			fixed_params=fixed_params,
+			only_do=[],
+			method=None,
+			tol=None,
+			use_multi_grad=False,
+			save_output=False,
+			arrays=arrays
+		)
+		tuner._shared_handles = handles
+		return tuner
+
+	@staticmethod
+	@abstractmethod
+	def extract_arrays(data):
+		""" Should return a dict of the numpy arrays the backtest needs from the data frame.
+		"""
+		return NotImplemented
+
+	def bind_arrays(self, arrays):
+		""" Exposes each of the backtest arrays as an attribute of the tuner.
+		"""
+		self.arrays = arrays
+		for name, array in arrays.items():
+			setattr(self, name, array)
+
+	def fingerprint(self):
+		""" Identifies everything other than the optimised parameter values that the cost depends on, including the
+			code of the models and tuners.
+		"""
+		params = self.tuner_params.all_params
+		fixed = {k: v for k, v in params.items() if k not in self.tuner_params.optimise_params}
+		return data_fingerprint(
+			self.arrays, type(self).__name__, self.tuner_params.optimise_params, fixed, self.horizon,
+			source_fingerprint())
+
+	@property
+	@abstractmethod
+	def gameweek_list(self):
+		""" Should return the sorted gameweeks the backtest runs over.
+		"""
+		return NotImplemented
+
+	def set_horizon(self, n_gameweeks):
+		""" Restricts the backtest to the first n_gameweeks of gameweek_list, or the full season if None.
+		"""
+		self.horizon = n_gameweeks
+
+	@property
+	def evaluation_cache(self):
+		""" The evaluation cache for the current horizon, or None if caching is off.
+		"""
+		if not self.use_cache:
+			return None
+		if self.horizon not in self.evaluation_caches:
+			self.evaluation_caches[self.horizon] = EvaluationCache(self.fingerprint())
+		return self.evaluation_caches[self.horizon]
+
+	def publish_arrays(self):
+		""" Publishes the backtest arrays into shared memory (once) and returns the spec workers attach with.
+		"""
+		if self.shared_arrays is None:
+			self.shared_arrays = SharedArrays(self.arrays)
+		return self.shared_arrays.spec
+
+	def release_arrays(self):
+		if self.shared_arrays is not None:
+			self.shared_arrays.close()
+			self.shared_arrays = None
 
 	def run_tuner(self):
 		with timer('Optimising with method {}'.format(self.method), __file__):
 			logger.info("Null model likelihood: {:.4E}".format(self._get_null_model_likelihood()))
 			self.tuner_params.log_initial()
+			file_x0 = self.tuner_params.x0
+			backend_kwargs = self.restore_checkpoint()
 			minimise_kwargs = self.minimize_args()
+			self.trace = EvaluationTrace(
+				'{}_{}'.format(type(self).__name__, self.method), self.tuner_params.optimise_params)
+
+			previous_handler = None
+			if threading.current_thread() is threading.main_thread():
+				# batch schedulers pre-empt with SIGTERM, which we want to handle like a KeyboardInterrupt
+				previous_handler = signal.signal(signal.SIGTERM, _raise_system_exit)
 
 			try:
-				if self.use_multicore_gradient:
-					optimal = multioptimiser(**minimise_kwargs)
+				if self.method in POPULATION_METHODS:
+					with TunerPool(self, n_processes=self.n_processes) as pool:
+						optimal = differential_evolution(self, pool, **backend_kwargs)
+				elif self.method in multi_fidelity.MULTI_FIDELITY_METHODS:
+					with TunerPool(self, n_processes=self.n_processes) as pool:
+						optimal = getattr(multi_fidelity, self.method.replace('-', '_'))(self, pool, **backend_kwargs)
+				elif self.method in SURROGATE_METHODS:
+					with TunerPool(self, n_processes=self.n_processes) as pool:
+						optimal = surrogate(self, pool, **backend_kwargs)
+				elif self.method == 'decomposed':
+					with TunerPool(self, n_processes=self.n_processes) as pool:
+						optimal = self.run_decomposed(pool, **backend_kwargs)
+				elif self.use_multicore_gradient:
+					with TunerPool(self, n_processes=len(self.tuner_params.x0)) as pool:
+						optimal = multioptimiser(pool=pool, **minimise_kwargs)
 				else:
 					optimal = minimize(**minimise_kwargs)
 			except (KeyboardInterrupt, SystemExit) as e:
 				time.sleep(2)
 				logger.info('Cancelling optimisation........')
-				self.teardown_params()
+				self.save_checkpoint(force=True)
+				self.teardown_params(file_x0)
 				raise e
+			finally:
+				self.release_arrays()
+				self.trace.close()
+				self.tuner_params.x0 = file_x0
+				if previous_handler is not None:
+					signal.signal(signal.SIGTERM, previous_handler)
 
 			logger.info('Finished having run {} evaluations over {} iterations'.format(optimal.nfev, optimal.nit))
+			for evaluation_cache in self.evaluation_caches.values():
+				logger.info(evaluation_cache.summary())
+			self.last_result = optimal
+			self.checkpoint.clear()
 			self.tuner_params.update_using_opt_array(optimal.x)
-			self.teardown_params()
+			self.teardown_params(file_x0)
 			return self.tuner_params.nested_params
 
-	def teardown_params(self):
-		""" Performs the housekeeping on the parameters after the optimiser has run.
+	def teardown_params(self, file_x0):
+		""" Performs the housekeeping on the parameters after the optimiser has run. With the 'if_better' save policy
+			the parameters are only written if they beat those on file (file_x0).
 		"""
 		self.to_save_params.log_output()
 		if self.save_output:
-			self.to_save_params.save_to_disk()
+			policy = self.save_policy
+			if policy == 'if_better':
+				new_cost = self.evaluate_cost(self.to_save_params.opt_value_array())
+				file_cost = self.evaluate_cost(file_x0)
+				logger.info('Tuned cost {:.7f} against {:.7f} for the parameters on file'.format(new_cost, file_cost))
+				policy = 'always' if new_cost < file_cost else 'never'
+			self.to_save_params.save_to_disk(policy)
+
+	def restore_checkpoint(self):
+		""" Sets up this run's checkpoint and, when resuming, restores the optimiser state from it. Returns any extra
+			kwargs the optimiser backend needs to carry on from where it left off.
+		"""
+		self.checkpoint = TunerCheckpoint(
+			'{}_{}'.format(self.fingerprint(), self.method),
+			every=self.checkpoint_every
+		)
+		state = self.checkpoint.load() if self.resume else None
+		backend_kwargs = {}
+
+		if state is not None:
+			self.nfev = int(state['nfev'])
+			self.best_x = state['best_x']
+			self.best_cost = float(state['best_cost'])
+			self._best_points = [(cost, x) for cost, x in zip(state['simplex_costs'], state['simplex'])]
+			if self.method not in POPULATION_METHODS + multi_fidelity.MULTI_FIDELITY_METHODS + SURROGATE_METHODS:
+				self.tuner_params.x0 = self.best_x
+			self.to_save_params.update_using_opt_array(self.best_x)
+			logger.info('Resuming from {} after {} evaluations with best cost {:.7f}'.format(
+				self.checkpoint.path, self.nfev, self.best_cost))
+
+		if self.method in POPULATION_METHODS and state is not None and 'population' in state:
+			backend_kwargs.update(
+				initial_population=state['population'],
+				initial_costs=state['population_costs']
+			)
+		elif self.method in SURROGATE_METHODS and state is not None and 'surrogate_x' in state:
+			backend_kwargs.update(
+				initial_x=state['surrogate_x'],
+				initial_costs=state['surrogate_costs']
+			)
+		elif self.method in multi_fidelity.MULTI_FIDELITY_METHODS:
+			# with the evaluation cache on, replaying the same seed makes the completed rungs free
+			seed = int(state['seed']) if state is not None and 'seed' in state else np.random.randint(2 ** 31)
+			self._optimiser_state['seed'] = seed
+			backend_kwargs.update(seed=seed)
+		return backend_kwargs
+
+	def record_evaluation(self, opt_array, cost):
+		""" Keeps track of the number of evaluations, the best point and the n + 1 best distinct points, which can
+			seed a Nelder-Mead simplex on resumption.
+		"""
+		self.nfev += 1
+		if self.trace is not None:
+			self.trace.write(opt_array, cost)
+		if np.isnan(cost):
+			return
+		if cost < self.best_cost:
+			self.best_x, self.best_cost = np.array(opt_array, dtype=float), cost
+		if any(np.array_equal(x, opt_array) for _, x in self._best_points):
+			return
+		self._best_points.append((cost, np.array(opt_array, dtype=float)))
+		self._best_points.sort(key=lambda point: point[0])
+		del self._best_points[len(opt_array) + 1:]
+
+	def save_checkpoint(self, force=False, **optimiser_state):
+		""" Updates the optimiser specific state (e.g. a population) and writes a checkpoint if one is due.
+		"""
+		self._optimiser_state.update(optimiser_state)
+		if self.checkpoint is None or self.best_x is None or not (force or self.checkpoint.due()):
+			return
+		self.checkpoint.save(
+			method=self.method,
+			nfev=self.nfev,
+			best_x=self.best_x,
+			best_cost=self.best_cost,
+			simplex=np.array([x for _, x in self._best_points]),
+			simplex_costs=np.array([cost for cost, _ in self._best_points]),
+			**self._optimiser_state
+		)
 
 	@abstractmethod
 	def _get_null_model_likelihood(self):
 		return NotImplemented
 
+	def evaluate(self, opt_array):
+		""" Computes the (penalised) exp-mean-log-likelihood of the optimiser parameter values without logging.
+		"""
+		self.tuner_params.update_using_opt_array(opt_array)
+		params = self.tuner_params.bind(opt_array)
+		return self.compute_emll(params)
+
+	def evaluate_cost(self, opt_array):
+		""" The minimised cost (-emll) of the optimiser parameter values, or NaN if the backtest fails with them. Unlike
+			evaluate this leaves tuner_params as they are, so candidates can be compared after the optimiser has run.
+		"""
+		try:
+			emll, _ = self.compute_emll(self.tuner_params.bind(opt_array))
+		except (ValueError, ArithmeticError, np.linalg.LinAlgError):
+			return np.nan
+		return -emll
+
+	def evaluate_with_gradient(self, opt_array):
+		""" As evaluate, but also returns the exact gradient of the emll wrt the optimised parameters.
+		"""
+		self.tuner_params.update_using_opt_array(opt_array)
+		params = self.tuner_params.bind(opt_array)
+		return self.compute_emll_and_gradient(params)
+
+	def cached_evaluate(self, opt_array):
+		""" As evaluate, but looks the parameters up in (and adds them to) the evaluation cache if there is one.
+		"""
+		if self.evaluation_cache is None:
+			return self.evaluate(opt_array)
+		cached = self.evaluation_cache.get(opt_array)
+		if cached is not None:
+			self.tuner_params.update_using_opt_array(opt_array)
+			emll, pen_str = cached
+			return emll, pen_str + '\t\t(cached)'
+		emll, pen_str = self.evaluate(opt_array)
+		if not np.isnan(emll):
+			self.evaluation_cache.put(opt_array, emll, pen_str)
+		return emll, pen_str
+
 	def minimise_me(self, opt_array):
 		""" The cost function which maps optimiser parameter values to negative average log likelihood.
 		"""
-		self.tuner_params.update_using_opt_array(opt_array)
-		params = self.tuner_params.all_params
-		emll, pen_str = self.compute_emll(params)
+		emll, pen_str = self.cached_evaluate(opt_array)
 		if np.isnan(emll):
 			logger.info('Error running with params:')
 			self.tuner_params.log_output()
@@ -79,8 +343,58 @@ class Tuner(ABC):
 		# Only update the to_save params after we have logged the internal params so that we can see what we are
 		# writing to file
 		self.to_save_params.update_using_opt_array(opt_array)
+		self.record_evaluation(opt_array, -emll)
+		self.save_checkpoint()
 		return -emll
 
+	def evaluate_population(self, opt_arrays, pool=None):
+		""" Returns the minimised cost (-emll) of each row of opt_arrays, in parallel if given a TunerPool. Failed
+			evaluations cost infinity. Tuners with a parameter-batched backtest can override this.
+		"""
+		opt_arrays = np.asarray(opt_arrays, dtype=float)
+		costs = np.full(len(opt_arrays), np.nan)
+		to_run = np.arange(len(opt_arrays))
+		if self.evaluation_cache is not None:
+			cached = [self.evaluation_cache.get(x) for x in opt_arrays]
+			to_run = np.array([i for i, c in enumerate(cached) if c is None], dtype=int)
+			for i, c in enumerate(cached):
+				if c is not None:
+					costs[i] = -c[0]
+
+		if pool is not None:
+			costs[to_run] = pool.map(opt_arrays[to_run], self.horizon)
+		else:
+			costs[to_run] = [self.evaluate_cost(x) for x in opt_arrays[to_run]]
+
+		if self.evaluation_cache is not None:
+			for i in to_run:
+				if not np.isnan(costs[i]):
+					self.evaluation_cache.put(opt_arrays[i], -costs[i], '')
+		for x, cost in zip(opt_arrays, costs):
+			self.record_evaluation(x, cost)
+		return np.where(np.isnan(costs), np.inf, costs)
+
+	def log_population_best(self, opt_array, cost):
+		""" Logs the best member of a population and makes it the candidate to be written to file.
+		"""
+		self.tuner_params.update_using_opt_array(opt_array)
+		self.tuner_params.log_params_row(-cost, '')
+		self.to_save_params.update_using_opt_array(opt_array)
+
+	def minimise_me_and_jac(self, opt_array):
+		""" As minimise_me, but also returns the exact gradient for optimisers called with jac=True.
+		"""
+		emll, pen_str, grad = self.evaluate_with_gradient(opt_array)
+		if np.isnan(emll) or np.isnan(grad).any():
+			logger.info('Error running with params:')
+			self.tuner_params.log_output()
+			raise ValueError
+		self.tuner_params.log_params_row(emll, pen_str)
+		self.to_save_params.update_using_opt_array(opt_array)
+		self.record_evaluation(opt_array, -emll)
+		self.save_checkpoint()
+		return -emll, -grad
+
 	def minimize_args(self):
 		kwargs = dict(
 			fun=self.minimise_me,
@@ -89,6 +403,12 @@ class Tuner(ABC):
 			tol=self.tol,
 			bounds=self.tuner_params.optimise_bounds
 		)
+		if self.use_exact_gradient:
+			kwargs.update(fun=self.minimise_me_and_jac, jac=True)
+		if self.method == 'Nelder-Mead' and len(self._best_points) == len(self.tuner_params.x0) + 1:
+			simplex = np.array([x for _, x in self._best_points])
+			if np.linalg.matrix_rank(simplex[1:] - simplex[0]) == len(self.tuner_params.x0):
+				kwargs.update(options=dict(initial_simplex=simplex))
 		return kwargs
 
 	@property
@@ -97,7 +417,8 @@ class Tuner(ABC):
 			return {
 				'Nelder-Mead': False, 'Powell': False, 'CG': False, 'BFGS': False,
 				'Newton-CG': False, 'L-BFGS-B': True, 'TNC': True, 'COBYLA': True,
-				'SLSQP': False
+				'SLSQP': False, 'differential-evolution': True, 'successive-halving': True, 'hyperband': True,
+				'surrogate': True, 'decomposed': False
 			}[self.method]
 		except KeyError:
 			raise ValueError('Unknown optimiser method {}'.format(self.method))
@@ -107,14 +428,14 @@ class Tuner(ABC):
 			conditions.
 
 				:param cost:            Original cost returned by the optimiser
-				:param params:          Current parameters being tested
+				:param params:          Current parameters being tested, as a dict or PARAM_LAYOUT vector
 				:param scaling_value:   Amount by which to penalise overstepping bounds
 				:return:                Penalised cost
 		"""
-		for param, value in params.items():
-			if param not in self.bounds_dict:
+		for param, bounds in self.bounds_dict.items():
+			if param not in PARAM_LAYOUT.slots:
 				continue
-			bounds = self.bounds_dict[param]
+			value = get_param(params, param)
 			if bounds[0] is not None:
 				if value < bounds[0]:
 					penalty_factor = scaling_value * (bounds[0] - value)
@@ -127,6 +448,22 @@ class Tuner(ABC):
 					pen_str = '\t\t(penalising {}: {} > {} by a factor of {})'.format(param, value, bounds[1], penalty_factor)
 		return cost, pen_str
 
+	def penalise_boundaries_gradient(self, grad, params, scaling_value=1):
+		""" Applies the derivative of the penalties added by penalise_boundaries to grad, which is ordered as the
+			optimised parameters.
+		"""
+		grad = grad.copy()
+		for i, param in enumerate(self.tuner_params.optimise_params):
+			if param not in self.bounds_dict:
+				continue
+			value = get_param(params, param)
+			bounds = self.bounds_dict[param]
+			if bounds[0] is not None and value < bounds[0]:
+				grad[i] += scaling_value
+			if bounds[1] is not None and value > bounds[1]:
+				grad[i] -= scaling_value
+		return grad
+
 	# def penalise_constraints(self, cost, params, pen_str, scaling_value=1):
 	# 	""" Rudimentary penalties for tier related constraints.
 	# 	"""
@@ -140,8 +477,37 @@ class Tuner(ABC):
 	# 			pen_str = '\t\t(penalising {}: {} < {} by a factor of {})'.format(s, first, second, penalty_factor)
 	# 	return cost, pen_str
 
+	@abstractmethod
+	def run_backtest(self, params, record_gameweeks=False):
+		""" Should build and run the tuner's backtest with a PARAM_LAYOUT vector of params, on the current horizon,
+			and return it.
+		"""
+		return NotImplemented
+
 	@abstractmethod
 	def compute_emll(self, params):
-		""" Should return the exp-mean-log-likelihood.
+		""" Should return the exp-mean-log-likelihood, given a PARAM_LAYOUT vector of all the params.
 		"""
 		return NotImplemented
+
+	def run_decomposed(self, pool, **kwargs):
+		""" Should tune independent blocks of the parameters in parallel over the pool, for the 'decomposed' method,
+			and return an OptimizeResult.
+		"""
+		raise NotImplementedError('{} has no decomposed tuning mode'.format(type(self).__name__))
+
+	def compute_emll_and_gradient(self, params):
+		""" Should return the exp-mean-log-likelihood, the penalty string and the exact gradient of the former wrt the
+			optimised parameters. Only tuners whose backtest propagates sensitivities implement this.
+		"""
+		raise NotImplementedError('{} cannot compute exact gradients'.format(type(self).__name__))
+
+
+profiler.instrument(Tuner, dict(
+	evaluate='tuner evaluation',
+	evaluate_with_gradient='tuner evaluation with gradient',
+))
+
+
+def _raise_system_exit(signum, frame):
+	raise SystemExit('Received signal {}'.format(signum))
@@ -12,12 +12,14 @@ from src.paths import paths
 from src.utils import write_nested_dict_to_file
 
 PARAM_ACRONYMS = {
-	"gir_player": "gir_player",
-	"gir_hole": "gir_hole",
-	"dd_player": "dd_player",
-	"dd_hole": "dd_hole",
+	"team": "team_kf",
+	"league": "league_kf",
+	"player_goal": "player_goal",
+	"player_assist": "player_assist",
 }
 
+SAVE_POLICIES = ('prompt', 'always', 'never', 'if_better')
+
 LOGGER_ABBREVIATIONS = {
 	"team": "tm",
 	"league": "lg",
@@ -50,6 +52,10 @@ class TunerParams:
 		self.flat_params = {k: v for k, v in params.items() if k in self.initial_params}
 		self.x0 = self.opt_value_array()
 
+		# -- compiled layout, so that binding an optimiser array needs no dict churn -- #
+		self.base_vector = PARAM_LAYOUT.vector(params)
+		self.optimise_slots = PARAM_LAYOUT.indices(self.optimise_params)
+
 	def validate_args(self, init_params, fixed, only_do):
 		""" Validates the TunerParams arguments, parses only_do and returns updated fixed_params.
 		"""
@@ -139,6 +145,18 @@ class TunerParams:
 		"""
 		return [self.get_bounds_dict().get(k, (None, None)) for k in self.optimise_params]
 
+	def get_search_bounds(self, spread=1.):
+		""" A finite search box for the optimised parameters, for use by optimisers which sample the parameter space.
+			Where a bound is missing it is placed spread * |x0| (or spread, for parameters near zero) from x0.
+		"""
+		search_bounds = []
+		for (lower, upper), x0 in zip(self.optimise_bounds, self.x0):
+			scale = spread * max(abs(x0), 1e-3)
+			lower = x0 - scale if lower is None else lower
+			upper = x0 + scale if upper is None else upper
+			search_bounds.append((lower, upper))
+		return search_bounds
+
 	def update_using_opt_array(self, opt_params_array):
 		""" Updates the internal params using a params array.
 		"""
@@ -160,14 +178,23 @@ class TunerParams:
 		pretty_output = json.dumps(self.nested_params, sort_keys=False, indent=4, separators=(',', ': '))
 		print(pretty_output)
 
-	def save_to_disk(self):
-		""" Saves the internal array of params to a python dictionary.
+	def save_to_disk(self, policy='prompt'):
+		""" Saves the internal array of params to a python dictionary. With the 'prompt' policy the user is asked
+			first, 'always' and 'never' do what they say so that tunes can run unattended. ('if_better' is resolved
+			to one of those two by the Tuner, which knows the costs.)
 		"""
-		while True:
-			response = input('Would you like to write optimal parameters to file? (y/n)')
-			if response in 'yn':
-				break
-		if response == 'y':
+		if policy == 'prompt':
+			while True:
+				response = input('Would you like to write optimal parameters to file? (y/n)')
+				if response in 'yn':
+					break
+			write = response == 'y'
+		elif policy in ('always', 'never'):
+			write = policy == 'always'
+		else:
+			raise ValueError('Unknown save policy {}, should be one of {}'.format(policy, SAVE_POLICIES))
+
+		if write:
 			logger.info('Writing optimal parameters to their respective files')
 
 			flat_params = flatten_dict(load_params())
@@ -178,17 +205,24 @@ class TunerParams:
 	def log_params_row(self, likelihood, pen_str):
 		""" Logs the likelihood corresponding to the current set of parameter values.
 		"""
-		logging_string = ' '.join(['{:18.3g}'] * len(self.flat_params))
-		likelihood_string = '{:>20.7f}'.format(likelihood)
+		# %-style, so that the row is only formatted by the logging listener thread
+		logging_string = ' '.join(['%18.3g'] * len(self.flat_params)) + '%20.7f%s'
 		# if null_likelihood is not None:
 		# 	likelihood_string += ' {:>20.7f}'.format(likelihood - null_likelihood)
-		logger.info(logging_string.format(*list(self.flat_params.values())) + likelihood_string + pen_str)
+		logger.info(logging_string, *self.flat_params.values(), likelihood, pen_str)
+
+	def bind(self, opt_params_array):
+		""" Returns the PARAM_LAYOUT vector of all params, with the optimised ones taken from opt_params_array. This is
+			what Tuner.minimise_me() hands to the models.
+		"""
+		vector = self.base_vector.copy()
+		vector[self.optimise_slots] = opt_params_array
+		return vector
 
 	@property
 	def all_params(self):
 		""" Returns a nested dictionary of the tuners params combined with those from file.
-			Used by Tuner.minimise_me() to prepare to run whichever cost function it needs
-			to.
+			The optimiser's hot path uses bind() instead, this is for everything else.
 		"""
 		all_params = load_params()
 		flat_params = flatten_dict(all_params)
@@ -268,3 +302,36 @@ def unflatten_dict(flat_dict, flattening_key='.'):
 	return output
 
 
+class ParamLayout:
+
+	def __init__(self, names):
+		""" Maps each parameter name to a fixed slot of a numpy vector, so that the models can be handed all of their
+			parameters as one array.
+		"""
+		self.names = tuple(names)
+		self.slots = {name: i for i, name in enumerate(self.names)}
+
+	def __len__(self):
+		return len(self.names)
+
+	def vector(self, params):
+		""" Packs a flat params dict into a vector.
+		"""
+		return np.array([params[name] for name in self.names], dtype=float)
+
+	def to_dict(self, vector):
+		return dict(zip(self.names, vector.tolist()))
+
+	def indices(self, names):
+		return np.array([self.slots[name] for name in names], dtype=int)
+
+
+PARAM_LAYOUT = ParamLayout(load_params())
+
+
+def get_param(params, name):
+	""" Looks a parameter up in either a params dict or a PARAM_LAYOUT vector.
+	"""
+	if isinstance(params, np.ndarray):
+		return params[PARAM_LAYOUT.slots[name]]
+	return params[name]
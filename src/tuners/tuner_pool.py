@@ -0,0 +1,69 @@
+""" A process pool whose workers each hold a tuner attached to the shared memory backtest arrays, so that only
+	parameter vectors (and costs) are pickled per evaluation.
+"""
+import multiprocessing
+
+import numpy as np
+
+_worker_tuner = None
+
+
+def _initialise_worker(tuner_class, spec, fixed_params):
+	global _worker_tuner
+	_worker_tuner = tuner_class.from_shared(spec, fixed_params)
+
+
+def _evaluate(job):
+	opt_array, horizon = job
+	if horizon != _worker_tuner.horizon:
+		_worker_tuner.set_horizon(horizon)
+	return _worker_tuner.evaluate_cost(opt_array)
+
+
+def _apply(task):
+	function, job = task
+	return function(_worker_tuner, job)
+
+
+class TunerPool:
+
+	def __init__(self, tuner, n_processes=None):
+		self.n_processes = multiprocessing.cpu_count() if n_processes is None else n_processes
+		self.pool = multiprocessing.Pool(
+			processes=self.n_processes,
+			initializer=_initialise_worker,
+			initargs=(type(tuner), tuner.publish_arrays(), tuner.tuner_params.fixed_params)
+		)
+
+	def map(self, opt_arrays, horizon=None):
+		""" Evaluates the minimised cost (i.e. -emll) at each of the optimiser parameter vectors in parallel, on the
+			first horizon gameweeks (or the full season). Vectors whose backtest fails come back as NaN.
+		"""
+		jobs = [(np.asarray(x, dtype=float), horizon) for x in opt_arrays]
+		return np.array(self.pool.map(_evaluate, jobs))
+
+	def apply(self, function, jobs):
+		""" Calls function(worker_tuner, job) for each job in parallel, where function is a module level function.
+		"""
+		return self.pool.map(_apply, [(function, job) for job in jobs])
+
+	def apply_unordered(self, function, jobs):
+		""" As apply, but yields the results lazily in the order they finish.
+		"""
+		return self.pool.imap_unordered(_apply, [(function, job) for job in jobs])
+
+	def gradient(self, x, f0, epsilon=1e-5):
+		""" Forward difference gradient of the minimised cost at x, where f0 is the cost at x itself.
+		"""
+		steps = epsilon * np.eye(len(x))
+		return (self.map(x + steps) - f0) / epsilon
+
+	def close(self):
+		self.pool.close()
+		self.pool.join()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
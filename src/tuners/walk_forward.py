@@ -0,0 +1,88 @@
+""" Walk-forward (out of sample) evaluation of the tuners' backtest cost. After a burn-in of config.BURN_IN_RATIO of the
+	season, the remaining gameweeks are split into consecutive windows which are each scored only on predictions made
+	before their results were seen.
+"""
+from collections import namedtuple
+
+import numpy as np
+from scipy.optimize import minimize
+
+from config import BURN_IN_RATIO
+from src.logger import logger
+from src.tuners.tuner_pool import TunerPool
+
+WalkForwardResult = namedtuple('WalkForwardResult', ['windows', 'costs', 'log_lhoods', 'n_obs', 'aggregate_cost', 'params'])
+
+
+def walk_forward_windows(n_gameweeks, window_length, burn_in_ratio=BURN_IN_RATIO):
+	""" (start, end) indices into the gameweek list of each evaluation window following the burn-in.
+	"""
+	first = max(1, int(n_gameweeks * burn_in_ratio))
+	return [(start, min(start + window_length, n_gameweeks)) for start in range(first, n_gameweeks, window_length)]
+
+
+class WalkForward:
+
+	def __init__(self, tuner, window_length=4, burn_in_ratio=BURN_IN_RATIO):
+		self.tuner = tuner
+		self.gameweek_list = tuner.gameweek_list
+		self.windows = walk_forward_windows(len(self.gameweek_list), window_length, burn_in_ratio)
+
+	def evaluate(self, opt_array=None):
+		""" Scores each window with fixed parameters (by default the tuner's current ones). The filters are causal, so
+			every window's predictions already only depend on the gameweeks before it, and one pass over the season with
+			per-gameweek likelihoods gives all of the windows at once.
+		"""
+		opt_array = self.tuner.tuner_params.x0 if opt_array is None else opt_array
+		bt = self.tuner.run_backtest(self.tuner.tuner_params.bind(opt_array), record_gameweeks=True)
+		log_lhoods, n_obs = zip(*[
+			bt.window_log_lhood(self.gameweek_list[start:end]) for start, end in self.windows
+		])
+		return self._result(log_lhoods, n_obs, np.tile(opt_array, (len(self.windows), 1)))
+
+	def evaluate_refit(self, opt_array=None, n_processes=None, tol=None, maxiter=None):
+		""" Proper held-out scoring: for each window the parameters are re-tuned (with Nelder-Mead, warm started from
+			opt_array) on the gameweeks before it only, and the window is then scored from the filters' state at its
+			start under those parameters. Windows are independent, so they run in parallel.
+		"""
+		opt_array = self.tuner.tuner_params.x0 if opt_array is None else opt_array
+		tol = self.tuner.tol if tol is None else tol
+		jobs = [(opt_array, start, end, tol, maxiter) for start, end in self.windows]
+		try:
+			with TunerPool(self.tuner, n_processes=n_processes) as pool:
+				outputs = pool.apply(_refit_and_score_window, jobs)
+		finally:
+			self.tuner.release_arrays()
+		params, log_lhoods, n_obs = zip(*outputs)
+		return self._result(log_lhoods, n_obs, np.array(params))
+
+	def _result(self, log_lhoods, n_obs, params):
+		log_lhoods = np.array(log_lhoods, dtype=float)
+		n_obs = np.array(n_obs, dtype=float)
+		costs = np.exp(log_lhoods / n_obs)
+		aggregate_cost = np.exp(log_lhoods.sum() / n_obs.sum())
+
+		logger.info('{:>10} {:>10} {:>10} {:>14}'.format('from gw', 'to gw', 'n obs', 'cost'))
+		for (start, end), n, cost in zip(self.windows, n_obs, costs):
+			logger.info('{:>10} {:>10} {:>10.0f} {:>14.7f}'.format(
+				self.gameweek_list[start], self.gameweek_list[end - 1], n, cost))
+		logger.info('Walk-forward cost over {} windows: {:.7f}'.format(len(self.windows), aggregate_cost))
+
+		windows = [(self.gameweek_list[start], self.gameweek_list[end - 1]) for start, end in self.windows]
+		return WalkForwardResult(windows, costs, log_lhoods, n_obs, aggregate_cost, params)
+
+
+def _refit_and_score_window(tuner, job):
+	opt_array, start, end, tol, maxiter = job
+
+	def fun(x):
+		cost = tuner.evaluate_cost(x)
+		return np.inf if np.isnan(cost) else cost
+
+	tuner.set_horizon(start)
+	optimal = minimize(fun, x0=opt_array, method='Nelder-Mead', tol=tol, options=dict(maxiter=maxiter))
+
+	tuner.set_horizon(end)
+	bt = tuner.run_backtest(tuner.tuner_params.bind(optimal.x), record_gameweeks=True)
+	log_lhood, n_obs = bt.window_log_lhood(tuner.gameweek_list[start:end])
+	return optimal.x, log_lhood, n_obs
@@ -5,7 +5,6 @@ import contextlib
 import datetime
 import hashlib
 import math
-import multiprocessing
 import os
 import time
 
@@ -14,11 +13,12 @@ import scipy.optimize
 
 from config import project_directory, BURN_IN_RATIO
 from src.logger import logger, validate_path, TimerLogger
+from src.profiler import profiler
 
 
 @contextlib.contextmanager
 def timer(msg='', file=None):
-	""" Log how long something takes to run.
+	""" Log how long something takes to run, and record it as a span if the profiler is enabled.
 	"""
 	if file is None:
 		raise ValueError('Must pass __file__ to timer')
@@ -27,7 +27,8 @@ def timer(msg='', file=None):
 	if msg:
 		timer_logger.info(msg, module)
 	took = -time.time()
-	yield
+	with profiler.span(msg or module):
+		yield
 	took += time.time()
 	timer_logger.info('{} took {:.2f}s'.format(msg, took), module)
 
@@ -162,43 +163,27 @@ def filter_burn_in(data, filter_tier):
 	return data
 
 
-def multioptimiser(fun, bounds, method, x0, tol):
-	return scipy.optimize.minimize(fun, jac=lambda x: _jac_multicore(x, fun), bounds=bounds, method=method, x0=x0, tol=tol)
+def multioptimiser(fun, bounds, method, x0, tol, pool):
+	return scipy.optimize.minimize(fun, jac=lambda x: _jac_multicore(x, fun, pool), bounds=bounds, method=method, x0=x0, tol=tol)
 
 
-def _jac_multicore(x, fun):
-	n_cores = len(x)
-	manager = multiprocessing.Manager()
-	shared_memory_dict = manager.dict()
-	epsilon = 1e-5
-
+def _jac_multicore(x, fun, pool):
+	""" Forward difference gradient where the perturbed evaluations are farmed out to a TunerPool. Only the parameter
+		vectors are sent to the workers, the backtest data lives in shared memory.
+	"""
 	f0 = fun(x)
-	grad = np.zeros((len(x),), float)
-	ei = np.zeros((len(x),), float)
-
-	jobs = []
-	for i in range(n_cores):
-		ei[i] = 1.
-		d = epsilon * ei
-		job = multiprocessing.Process(
-			target=_grad_multicore,
-			args=(fun, x, d, f0, i, shared_memory_dict)
-		)
-		jobs.append(job)
-		job.start()
-		ei[i] = 0.
-
-	for job in jobs:
-		job.join()
-
-	for k, g in shared_memory_dict.items():
-		grad[k] = g
-	return grad
+	return pool.gradient(x, f0)
 
 
-def _grad_multicore(f, x, d, f0, batch_number, shared_memory_dict):
-	shared_memory_dict[batch_number] = (f(x + d) - f0) / d[batch_number]
-	return shared_memory_dict
+def group_indices(values):
+	""" Equivalent of pandas' groupby(...).indices for a 1D array: a dict of sorted unique value to the (ascending)
+		indices at which it occurs.
+	"""
+	values = np.asarray(values)
+	uniques, inverse = np.unique(values, return_inverse=True)
+	order = np.argsort(inverse, kind='mergesort')
+	splits = np.cumsum(np.bincount(inverse, minlength=len(uniques)))[:-1]
+	return dict(zip(uniques.tolist(), np.split(order, splits)))
 
 
 def test_for_nans(data, name):
@@ -310,63 +295,90 @@ class CrazyParameters(Exception):
 	pass
 
 
-def residual_resample(weights):
-	N = len(weights)
-	indexes = np.zeros(N, 'i')
-
-	# take int(N*w) copies of each weight, which ensures particles with the
-	# same weight are drawn uniformly
-	num_copies = (np.floor(N*weights)).astype(int)
-	k = 0
-	for i in range(N):
-		for _ in range(num_copies[i]): # make n copies
-			indexes[k] = i
-			k += 1
-
-	# use multinormal resample on the residual to fill up the rest. This
-	# maximizes the variance of the samples
-	residual = weights - num_copies     # get fractional part
-	residual /= sum(residual)           # normalize
-	cumulative_sum = np.cumsum(residual)
-	cumulative_sum[-1] = 1. # avoid round-off errors: ensures sum is exactly one
-	indexes[k:N] = np.searchsorted(cumulative_sum, np.random.random(N-k))
-
-	return indexes
-
-
-def stratified_resample(weights):
-	N = len(weights)
-	# make N subdivisions, and chose a random position within each one
-	positions = (np.random.random(N) + np.arange(N)) / N
-
-	indexes = np.zeros(N, 'i')
-	cumulative_sum = np.cumsum(weights)
-	i, j = 0, 0
-	while i < N:
-		if positions[i] < cumulative_sum[j]:
-			indexes[i] = j
-			i += 1
-		else:
-			j += 1
-	return indexes
+def residual_resample(weights, random_state=np.random):
+	""" Residual resampling of the (normalised) weights, or of each row of a 2D array of them. Particle i is copied
+		floor(N * w_i) times, and the rest of the N draws are multinomial on the residual weights.
+
+		Like the other resamplers, random numbers are drawn row by row, so resampling a 2D array gives the same indexes
+		as resampling each of its rows in turn with the same random_state.
+	"""
+	is_batch = np.ndim(weights) == 2
+	weights = np.atleast_2d(weights)
+	n_rows, N = weights.shape
+
+	# take int(N*w) copies of each weight, which ensures particles with the same weight are drawn uniformly
+	num_copies = np.floor(N * weights).astype(int)
+	n_copied = num_copies.sum(axis=1)
+	indexes = np.empty((n_rows, N), dtype=int)
+	copied = np.arange(N) < n_copied[:, None]
+	indexes[copied] = np.repeat(np.tile(np.arange(N), n_rows), num_copies.ravel())
+
+	# use multinomial resampling on the residual to fill up the rest, which maximises the variance of the samples
+	residual = np.maximum(N * weights - num_copies, 0)
+	total = residual.sum(axis=1, keepdims=True)
+	cumulative_sum = _cumulative_sum(residual / np.where(total > 0, total, 1))
+	positions = random_state.random_sample(N * n_rows - n_copied.sum())
+	indexes[~copied] = _search_rows(cumulative_sum, positions, np.repeat(np.arange(n_rows), N - n_copied))
+	return indexes if is_batch else indexes[0]
+
+
+def stratified_resample(weights, random_state=np.random):
+	""" Stratified resampling of the (normalised) weights, or of each row of a 2D array of them: one draw from each
+		of N equal subdivisions of the cumulative weights, at an independent random position within each.
+	"""
+	is_batch = np.ndim(weights) == 2
+	weights = np.atleast_2d(weights)
+	n_rows, N = weights.shape
+	offsets = random_state.random_sample((n_rows, N))
+
+	# the draws below cumulative weight c are those of the floor(N * c) whole subdivisions below it, and that of the
+	# subdivision it is in if its offset is below c's
+	scaled_sum = N * _cumulative_sum(weights)
+	whole = np.minimum(np.floor(scaled_sum).astype(int), N - 1)
+	partial = np.take_along_axis(offsets, whole, axis=1) < scaled_sum - whole
+	indexes = _repeat_counts(whole + partial)
+	return indexes if is_batch else indexes[0]
+
+
+def systematic_resample(weights, random_state=np.random):
+	""" Systematic resampling of the (normalised) weights, or of each row of a 2D array of them: one draw from each
+		of N equal subdivisions of the cumulative weights, at the same random offset within each.
+	"""
+	is_batch = np.ndim(weights) == 2
+	weights = np.atleast_2d(weights)
+	n_rows, N = weights.shape
+	offsets = random_state.random_sample(n_rows)[:, None]
 
+	# the draws (offset + k) / N below cumulative weight c are those with k < N * c - offset
+	indexes = _repeat_counts(np.ceil(N * _cumulative_sum(weights) - offsets).astype(int))
+	return indexes if is_batch else indexes[0]
 
-def systematic_resample(weights):
-	N = len(weights)
 
-	# make N subdivisions, and choose positions with a consistent random offset
-	positions = (np.random.random() + np.arange(N)) / N
+def _cumulative_sum(weights):
+	""" Cumulative sums of the rows of weights, with the last of each set to exactly one so that round off can never
+		leave a draw beyond it.
+	"""
+	cumulative_sum = np.cumsum(weights, axis=1)
+	cumulative_sum[:, -1] = 1.
+	return cumulative_sum
 
-	indexes = np.zeros(N, 'i')
-	cumulative_sum = np.cumsum(weights)
-	i, j = 0, 0
-	while i < N:
-		if positions[i] < cumulative_sum[j]:
-			indexes[i] = j
-			i += 1
-		else:
-			j += 1
-	return indexes
+
+def _repeat_counts(n_below):
+	""" Indexes for the resampled particles given, for each particle, how many of the N sorted draws fall below its
+		cumulative weight: each particle is repeated by the number of draws between its and the previous one's.
+	"""
+	n_rows, N = n_below.shape
+	counts = np.diff(n_below, axis=1, prepend=0).ravel()
+	return np.repeat(np.tile(np.arange(N), n_rows), counts).reshape(n_rows, N)
+
+
+def _search_rows(cumulative_sum, positions, rows):
+	""" For each position in [0, 1), the index of the first entry of its row's cumulative sum of weights above it, the
+		rows being searched together by offsetting each by its row number.
+	"""
+	n_rows, N = cumulative_sum.shape
+	offset_sum = cumulative_sum + np.arange(n_rows)[:, None]
+	return np.searchsorted(offset_sum.ravel(), positions + rows, side='right') - rows * N
 
 
 def reverse_dict(forward_dict):
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from src.load.generate_synthetic_data import generate, load_generated
+from src.tuners.tuner_params import PARAM_LAYOUT
+
+# the fitted params when these tests were written, so that they do not move with later tunes
+PARAMS = dict(
+	team_initial_away_att_rating_var=0.33477097624942,
+	team_initial_away_def_rating_var=0.1764711333541196,
+	team_initial_home_att_rating_var=0.1260726822665661,
+	team_initial_home_def_rating_var=0.041627463813835114,
+	team_rating_variance=0.05,
+	league_away_init=1.1537928623662717,
+	league_away_variance_init=0.684108622096261,
+	league_home_init=1.5015473716386198,
+	league_home_variance_init=0.7612413765742427,
+	league_rating_variance=0.036160901226263316,
+	player_goal_P0=0.04098491470415108,
+	player_goal_Q=3.168802121294639e-06,
+	player_goal_x0_att=0.24418486786883764,
+	player_goal_x0_def=0.035892151020278554,
+	player_goal_x0_gks=0.012412024766527328,
+	player_goal_x0_mid=0.08406191831845791,
+	player_assist_P0=0.04342942648950761,
+	player_assist_Q=0.0003378336385237796,
+	player_assist_x0_att=0.114307173172254,
+	player_assist_x0_def=0.05244156301477053,
+	player_assist_x0_gks=0.004363088274225237,
+	player_assist_x0_mid=0.11551679398343292,
+)
+
+
+@pytest.fixture(scope='session')
+def params():
+	return PARAM_LAYOUT.vector(PARAMS)
+
+
+@pytest.fixture(scope='session')
+def generated(tmp_path_factory):
+	""" Two seasons of two synthetic leagues, with the first's fpl data, as load_generated returns them.
+	"""
+	root = str(tmp_path_factory.mktemp('generated'))
+	seasons = generate(root, n_seasons=2, n_leagues=2, params=PARAMS, seed=0)
+	return load_generated(root, seasons)
+
+
+@pytest.fixture
+def rng():
+	return np.random.RandomState(0)
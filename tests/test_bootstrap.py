@@ -0,0 +1,34 @@
+import numpy as np
+
+from src.tuners.bootstrap import Bootstrap
+from src.tuners.team_tuner import TeamTuner
+
+
+def tuner(matches):
+	return TeamTuner(matches, [], [], 'Nelder-Mead', 1e-3, False, False)
+
+
+def test_resumes_only_the_same_tuner_and_start(generated, tmp_path):
+	matches = generated['match_scores']
+	matches = matches[matches.gw <= 6]
+	folder = str(tmp_path) + '/'
+	first = Bootstrap(tuner(matches), n_replicates=2, block_length=2, folder=folder).run(n_processes=1, maxiter=5)
+	assert np.isfinite(first.costs).all()
+
+	# a rerun picks up the finished draws rather than re-tuning
+	again = Bootstrap(tuner(matches), n_replicates=2, block_length=2, folder=folder)
+	draws, costs = np.full_like(first.draws, np.nan), np.full_like(first.costs, np.nan)
+	again._restore(first.names, np.array(again.tuner.tuner_params.x0, dtype=float), draws, costs)
+	np.testing.assert_array_equal(costs, first.costs)
+
+	# other data saves elsewhere, and its draws are not taken even when named the same
+	other = Bootstrap(tuner(matches[matches.gw <= 5]), n_replicates=2, block_length=2, folder=folder,
+					  name=first.path.split('/')[-1][:-len('.npz')])
+	assert other.fingerprint != again.fingerprint
+	draws, costs = np.full_like(first.draws, np.nan), np.full_like(first.costs, np.nan)
+	other._restore(first.names, np.array(other.tuner.tuner_params.x0, dtype=float), draws, costs)
+	assert np.isnan(costs).all()
+
+	# as are the draws from another starting point
+	again._restore(first.names, np.array(again.tuner.tuner_params.x0, dtype=float) * 1.01, draws, costs)
+	assert np.isnan(costs).all()
@@ -0,0 +1,30 @@
+import numpy as np
+
+from src.models.team_ratings.joint_team_ratings_backtest import JointTeamRatingsBacktest
+from src.models.team_ratings.team_ratings_backtest import TeamRatingsBacktest
+from src.utils import group_indices
+
+
+def run(backtest, matches, params, **kwargs):
+	bt = backtest(params, matches.fthg.values, matches.ftag.values, matches.home_id.values, matches.away_id.values,
+				  group_indices(matches.gw.values), **kwargs)
+	bt.run_backtest()
+	return bt
+
+
+def test_no_correlations_reproduce_the_per_team_filters(generated, params):
+	matches = generated['match_scores']
+	joint = run(JointTeamRatingsBacktest, matches, params, correlation_tol=1.)
+	per_team = run(TeamRatingsBacktest, matches, params)
+	# with no correlations kept, each goal count updates just its own attack and defence ratings
+	assert joint.team_ratings.largest_block == 2
+	np.testing.assert_allclose(joint.cost, per_team.cost, rtol=1e-12)
+	np.testing.assert_allclose(joint.cum_team_log_lhood, per_team.cum_team_log_lhood, rtol=1e-12)
+
+
+def test_correlations_change_the_fit(generated, params):
+	matches = generated['match_scores']
+	joint = run(JointTeamRatingsBacktest, matches, params, correlation_tol=0.)
+	per_team = run(TeamRatingsBacktest, matches, params)
+	assert joint.team_ratings.largest_block > 2
+	assert np.isfinite(joint.cost) and not np.isclose(joint.cost, per_team.cost)
@@ -0,0 +1,25 @@
+import numpy as np
+
+from src.models.player_percentages.player_ratings_backtest import PlayerRatingsBacktest
+from src.models.team_ratings.team_ratings_backtest import TeamRatingsBacktest
+from src.tuners.player_tuner import PlayerTuner
+from src.utils import group_indices
+
+# the costs of the conftest's generated data and params with the per match and per player filters that the batched
+# extended Kalman filter core replaced
+TEAM_COST = 0.22032951224413888
+PLAYER_COST = 0.6547109834610382
+
+
+def test_team_cost_matches_per_match_filters(generated, params):
+	matches = generated['match_scores']
+	bt = TeamRatingsBacktest(params, matches.fthg.values, matches.ftag.values, matches.home_id.values,
+							 matches.away_id.values, group_indices(matches.gw.values))
+	bt.run_backtest()
+	np.testing.assert_allclose(bt.cost, TEAM_COST, rtol=1e-9)
+
+
+def test_player_cost_matches_per_player_filters(generated, params):
+	bt = PlayerRatingsBacktest(params=params, **PlayerTuner.extract_arrays(generated['all_player_data']))
+	bt.run_backtest()
+	np.testing.assert_allclose(bt.cost, PLAYER_COST, rtol=1e-9)
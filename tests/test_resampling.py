@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from src.benchmarks.resampling import KERNELS, loop_stratified_resample, loop_systematic_resample, random_weights
+from src.utils import residual_resample, stratified_resample, systematic_resample
+
+
+def corrected_loop_residual_resample(weights, random_state):
+	""" The loop residual resampler with its residual taken as N * w - floor(N * w), as the batched one does.
+	"""
+	N = len(weights)
+	num_copies = np.floor(N * weights).astype(int)
+	indexes = list(np.repeat(np.arange(N), num_copies))
+	if len(indexes) < N:
+		residual = N * weights - num_copies
+		cumulative_sum = np.cumsum(residual / residual.sum())
+		cumulative_sum[-1] = 1.
+		indexes += list(np.searchsorted(cumulative_sum, random_state.random_sample(N - len(indexes))))
+	return np.array(indexes)
+
+
+@pytest.mark.parametrize('loop, batched', [
+	(corrected_loop_residual_resample, residual_resample),
+	(loop_stratified_resample, stratified_resample),
+	(loop_systematic_resample, systematic_resample),
+])
+@pytest.mark.parametrize('N', [1, 7, 1000])
+def test_kernel_matches_loop(loop, batched, N, rng):
+	for seed, weights in enumerate(random_weights((5, N), rng)):
+		np.testing.assert_array_equal(
+			batched(weights, np.random.RandomState(seed)), loop(weights, np.random.RandomState(seed)))
+
+
+@pytest.mark.parametrize('batched', [kernel for _, _, kernel in KERNELS])
+def test_batch_matches_rows(batched, rng):
+	weights = random_weights((6, 500), rng)
+	random_state = np.random.RandomState(0)
+	rows = np.array([batched(w, random_state) for w in weights])
+	np.testing.assert_array_equal(batched(weights, np.random.RandomState(0)), rows)
+
+
+@pytest.mark.parametrize('batched', [kernel for _, _, kernel in KERNELS])
+def test_degenerate_weights(batched, rng):
+	weights = np.zeros(50)
+	weights[17] = 1.
+	np.testing.assert_array_equal(batched(weights, rng), np.full(50, 17))
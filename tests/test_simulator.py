@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from src.models.player_percentages.player_ratings_backtest import PlayerRatingsBacktest
+from src.models.team_ratings.team_ratings_backtest import TeamRatingsBacktest
+from src.projections.projection_engine import ProjectionEngine, current_teams, upcoming_fixtures
+from src.projections.simulator import GameweekSimulator
+from src.tuners.player_tuner import PlayerTuner
+from src.utils import group_indices
+
+GAMEWEEK = 30
+
+
+@pytest.fixture(scope='module')
+def engine(generated, params):
+	""" A ProjectionEngine from backtests of the generated data up to GAMEWEEK.
+	"""
+	matches, players = generated['match_scores'], generated['all_player_data']
+	matches, history = matches[matches.gw < GAMEWEEK], players[players.gameweek < GAMEWEEK]
+	team_backtest = TeamRatingsBacktest(params, matches.fthg.values, matches.ftag.values, matches.home_id.values,
+										matches.away_id.values, group_indices(matches.gw.values))
+	team_backtest.run_backtest()
+	player_backtest = PlayerRatingsBacktest(params=params, **PlayerTuner.extract_arrays(history))
+	player_backtest.run_backtest()
+	pid_to_pos = dict(zip(players.player_id, players.position_id))
+	return ProjectionEngine.from_backtests(team_backtest, player_backtest, pid_to_pos)
+
+
+def test_simulated_means_match_expected_points(generated, engine):
+	# with every player playing, no team's shares are scaled down for a goal, so the means are the expected points
+	pids, team_ids = current_teams(generated['all_player_data'], GAMEWEEK)
+	home_ids, away_ids, gameweeks = upcoming_fixtures(generated['match_scores'], GAMEWEEK, 1)
+
+	xfpl = engine.project(pids, team_ids, home_ids, away_ids, gameweeks).xfpl[:, 0]
+	distribution = GameweekSimulator(engine, pids, team_ids).simulate(home_ids, away_ids, n_simulations=50000)
+	variance = distribution.histograms @ distribution.points ** 2 / distribution.n_simulations - distribution.mean ** 2
+	standard_errors = np.sqrt(variance / distribution.n_simulations)
+	assert np.all(np.abs(distribution.mean - xfpl) < 5 * standard_errors + 1e-6)
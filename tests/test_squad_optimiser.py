@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+from src.benchmarks.squad_selection import SOLVERS, brute_force, crowded_pool, small_pool
+from src.selection.squad_optimiser import SQUAD_QUOTAS
+
+
+@pytest.mark.parametrize('pool', [small_pool, crowded_pool])
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('solver', SOLVERS)
+@pytest.mark.parametrize('prune', [False, True])
+def test_solver_matches_brute_force(pool, seed, solver, prune):
+	optimiser = pool(np.random.RandomState(seed))
+	squad = optimiser.solve(solver, prune=prune)
+	assert np.isclose(squad.value, brute_force(optimiser))
+
+	players = np.isin(optimiser.pids, squad.pids)
+	np.testing.assert_array_equal(np.bincount(squad.positions, minlength=len(SQUAD_QUOTAS)), SQUAD_QUOTAS)
+	assert squad.cost <= optimiser.budget
+	assert np.unique(optimiser.team_ids[players], return_counts=True)[1].max() <= optimiser.max_per_club
@@ -0,0 +1,28 @@
+import numpy as np
+
+from src.tuners import sweep
+from src.tuners.sweep import ParameterSweep
+from src.tuners.team_tuner import TeamTuner
+
+
+def test_resumes_only_the_same_surface(generated, tmp_path, monkeypatch):
+	matches = generated['match_scores']
+	tuner = TeamTuner(matches[matches.gw <= 4], [], [], 'Nelder-Mead', 1e-3, False, False)
+	folder = str(tmp_path) + '/'
+	first = ParameterSweep(tuner, ['team_rating_variance'], n_points=3, folder=folder)
+	_, costs = first.run(n_processes=1)
+	assert np.isfinite(costs).all()
+
+	# a finished sweep is picked up without starting any processes
+	pools = []
+	monkeypatch.setattr(sweep, 'TunerPool', lambda *args, **kwargs: pools.append(args))
+	_, resumed = ParameterSweep(tuner, ['team_rating_variance'], n_points=3, folder=folder).run()
+	np.testing.assert_array_equal(resumed, costs)
+	assert not pools
+
+	# holding another parameter elsewhere is another surface, even under the same name
+	tuner.tuner_params.x0[tuner.tuner_params.optimise_params.index('league_rating_variance')] *= 2
+	moved = ParameterSweep(tuner, ['team_rating_variance'], n_points=3, folder=folder,
+						   name=first.costs_path.split('/')[-1][:-len('.npy')])
+	assert moved.key != first.key
+	assert np.isnan(moved._open_costs()).all()
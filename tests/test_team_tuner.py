@@ -0,0 +1,22 @@
+import numpy as np
+
+from src.tuners.team_tuner import TeamTuner
+
+
+def test_exact_gradient_matches_finite_differences(generated):
+	matches = generated['match_scores']
+	tuner = TeamTuner(matches[matches.gw <= 10], [], [], 'L-BFGS-B', 1e-7, False, False, use_exact_grad=True)
+	x = np.array(tuner.tuner_params.x0, dtype=float)
+	# the fitted team_rating_variance sits on its lower bound, where the boundary penalty's kink spoils the differences
+	x[tuner.tuner_params.optimise_params.index('team_rating_variance')] = 0.05
+
+	cost, _, grad = tuner.evaluate_with_gradient(x)
+	assert np.isfinite(cost)
+
+	eps = 1e-6
+	finite_differences = []
+	for i in range(len(x)):
+		step = np.zeros(len(x))
+		step[i] = eps
+		finite_differences.append((tuner.evaluate(x + step)[0] - tuner.evaluate(x - step)[0]) / (2 * eps))
+	np.testing.assert_allclose(grad, finite_differences, rtol=1e-4, atol=1e-6)
@@ -0,0 +1,47 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from src.benchmarks.transfer_planning import random_planner
+from src.selection.squad_optimiser import best_lineup
+
+
+def brute_force(planner, squad_pids, bank):
+	""" The value of the best single transfer, or none, for a one gameweek planner.
+	"""
+	squad = np.flatnonzero(np.isin(planner.pids, squad_pids))
+	points = planner.points[:, 0]
+	best_value = best_lineup(points[squad], planner.positions[squad], planner.bench_weight)[2]
+	for slot, player in itertools.product(range(len(squad)), range(len(planner.pids))):
+		if player in squad or planner.positions[player] != planner.positions[squad[slot]]:
+			continue
+		new_squad = squad.copy()
+		new_squad[slot] = player
+		if bank + planner.prices[squad[slot]] - planner.prices[player] < 0:
+			continue
+		if np.bincount(planner.team_ids[new_squad]).max() > planner.max_per_club:
+			continue
+		best_value = max(best_value, best_lineup(points[new_squad], planner.positions[new_squad], planner.bench_weight)[2])
+	return best_value
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_single_transfer_matches_brute_force(seed):
+	planner, squad, bank = random_planner(60, 2, np.random.RandomState(seed), max_moves=1000, max_transfers=1)
+	# plan the second gameweek alone, for which the squad picked for the first is no longer the best
+	planner.points, planner.gameweeks = planner.points[:, 1:], planner.gameweeks[1:]
+	bank += 10
+	assert np.isclose(planner.plan(squad, bank, prune=False).value, brute_force(planner, squad, bank))
+	assert np.isclose(planner.plan(squad, bank).value, brute_force(planner, squad, bank))
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_pruning_keeps_the_best_plan(seed):
+	planner, squad, bank = random_planner(80, 3, np.random.RandomState(seed), max_moves=4)
+	expected = planner.plan(squad, bank, prune=False)
+	plan = planner.plan(squad, bank)
+	assert np.isclose(plan.value, expected.value)
+
+	# the plan's steps are worth its value
+	assert np.isclose(sum(step.points - step.hits for step in plan.steps), plan.value)